@@ -0,0 +1,66 @@
+"""
+    benchmarks/bench_hdf5.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the layouts of io.save_locs: one compound dataset as before,
+    chunked and compressed with lzf, and one dataset per column. Reports
+    the file size and the time to load all locs and only frame, x and y.
+
+    Usage: python benchmarks/bench_hdf5.py [n_locs]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from picasso import io, lib
+
+
+def measure(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    n_locs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    rng = np.random.default_rng(0)
+    columns = {
+        "frame": np.sort(rng.integers(0, n_locs // 100, n_locs)),
+        "x": rng.uniform(1, 1000, n_locs),
+        "y": rng.uniform(1, 1000, n_locs),
+    }
+    names = np.dtype(lib.FIT_LOCS_DTYPE).names
+    for name in names[3:]:
+        columns[name] = rng.uniform(0.01, 2, n_locs)
+    locs = np.rec.fromarrays(
+        [columns[_] for _ in names], dtype=lib.FIT_LOCS_DTYPE
+    )
+    info = [{"Frames": n_locs // 100, "Width": 1001, "Height": 1001}]
+    print("Locs: {:,}".format(n_locs))
+    print(
+        "{:<10} {:>10} {:>10} {:>12}".format(
+            "Layout", "Size (MB)", "Load (s)", "frame, x, y"
+        )
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for name, kwargs in [
+            ("compound", {}),
+            ("lzf", {"compression": "lzf"}),
+            ("columnar", {"columnar": True}),
+            ("col. lzf", {"columnar": True, "compression": "lzf"}),
+        ]:
+            path = os.path.join(directory, "locs.hdf5")
+            io.save_locs(path, locs, info, **kwargs)
+            size = os.path.getsize(path) / 1e6
+            load_all = measure(lambda: io.load_locs(path))
+            load_xy = measure(lambda: io.load_locs(path, columns=["frame", "x", "y"]))
+            print(
+                "{:<10} {:>10.0f} {:>10.2f} {:>12.2f}".format(
+                    name, size, load_all, load_xy
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+    benchmarks/bench_ifd.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares collecting the image offsets of a TIFF stack by walking every
+    IFD entry with a seek and a read, as TiffMap used to, with the bulk
+    scan of TiffMap through a memory map of the file and with reopening
+    the file from its cached index. Reports the time to open the file.
+
+    Usage: python benchmarks/bench_ifd.py [n_frames]
+"""
+import os
+import struct
+import sys
+import tempfile
+import time
+from picasso import io
+
+N_TAGS = 16
+
+
+def write_tiff(path, n_frames, height, width):
+    frame_bytes = 2 * height * width
+    tags = [(256, 4, width), (257, 4, height), (258, 3, 16), (259, 3, 1)]
+    tags += [(273, 4, 0), (278, 4, height), (279, 4, frame_bytes)]
+    tags += [(50000 + _, 4, 0) for _ in range(N_TAGS - len(tags))]
+    frame = bytes(frame_bytes)
+    with open(path, "wb") as file:
+        file.write(b"II" + struct.pack("<HL", 42, 8))
+        for i in range(n_frames):
+            image_offset = file.tell() + 2 + 12 * len(tags) + 4
+            file.write(struct.pack("<H", len(tags)))
+            for tag, type, value in tags:
+                value = image_offset if tag == 273 else value
+                file.write(struct.pack("<HHLL", tag, type, 1, value))
+            next_ifd = image_offset + frame_bytes if i < n_frames - 1 else 0
+            file.write(struct.pack("<L", next_ifd))
+            file.write(frame)
+
+
+def walk_ifds(tif):
+    image_offsets = []
+    offset = tif.first_ifd_offset
+    while offset != 0:
+        tif.file.seek(offset)
+        n_entries = tif.read("H")
+        if n_entries is None:
+            break
+        for i in range(n_entries):
+            tif.file.seek(offset + 2 + i * 12)
+            tag = tif.read("H")
+            if tag == 273:
+                type = tif.TIFF_TYPES[tif.read("H")]
+                count = tif.read("L")
+                image_offsets.append(tif.read(type, count))
+                break
+        tif.file.seek(offset + 2 + n_entries * 12)
+        offset = tif.read("L")
+    return image_offsets
+
+
+def measure(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "movie.ome.tif")
+        write_tiff(path, n_frames, 64, 64)
+        print("Frames: {:,}".format(n_frames))
+        print("{:<8} {:>10}".format("Scan", "Time (s)"))
+        with io.TiffMap(path, cache_index=False) as tif:
+            elapsed, offsets = measure(lambda: walk_ifds(tif))
+        print("{:<8} {:>10.3f}".format("walk", elapsed))
+        elapsed, tif = measure(lambda: io.TiffMap(path))
+        assert list(tif.image_offsets) == offsets
+        tif.close()
+        print("{:<8} {:>10.3f}".format("bulk", elapsed))
+        elapsed, tif = measure(lambda: io.TiffMap(path))
+        tif.close()
+        print("{:<8} {:>10.3f}".format("index", elapsed))
+
+
+if __name__ == "__main__":
+    main()
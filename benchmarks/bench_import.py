@@ -0,0 +1,53 @@
+"""
+    benchmarks/bench_import.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the time to import the core picasso modules in a fresh
+    interpreter and lists the slowest top-level imports.
+
+    Usage: python benchmarks/bench_import.py [module ...]
+"""
+import subprocess
+import sys
+import time
+
+
+MODULES = ["picasso.localize", "picasso.postprocess", "picasso.render"]
+
+
+def import_time(module, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import " + module], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def slowest_imports(module, n=10):
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main():
+    modules = sys.argv[1:] or MODULES
+    baseline = import_time("numpy")
+    print("Interpreter with numpy: {:.3f} s".format(baseline))
+    for module in modules:
+        print("{:<24} {:.3f} s".format(module, import_time(module)))
+        for cumulative, name in slowest_imports(module):
+            print("    {:<28} {:8.1f} ms".format(name, cumulative / 1000))
+
+
+if __name__ == "__main__":
+    main()
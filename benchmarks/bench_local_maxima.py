@@ -0,0 +1,48 @@
+"""
+    benchmarks/bench_local_maxima.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the separable local maximum kernel with the argmax kernel
+    on a simulated sCMOS frame for box sizes 5 to 15.
+
+    Usage: python benchmarks/bench_local_maxima.py [size]
+"""
+import sys
+import time
+import numpy as np
+from picasso import localize
+
+
+def best_of(func, *args, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    rng = np.random.default_rng(0)
+    frame = rng.poisson(100, (size, size)).astype(np.float32)
+    print("Frame: {0}x{0}".format(size))
+    print(
+        "{:<6} {:>14} {:>14} {:>8}".format("Box", "argmax (s)", "separable (s)", "Speedup")
+    )
+    for box in range(5, 16, 2):
+        # compile before timing
+        localize._local_maxima_argmax(frame[:32, :32], box)
+        localize._local_maxima_separable(frame[:32, :32], box)
+        t_argmax, (y0, x0) = best_of(localize._local_maxima_argmax, frame, box)
+        t_sep, (y1, x1) = best_of(localize._local_maxima_separable, frame, box)
+        assert np.array_equal(y0, y1) and np.array_equal(x0, x1)
+        print(
+            "{:<6} {:>14.4f} {:>14.4f} {:>8.1f}".format(
+                box, t_argmax, t_sep, t_argmax / t_sep
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
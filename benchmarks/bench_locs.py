@@ -0,0 +1,80 @@
+"""
+    benchmarks/bench_locs.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares building locs from a tuple of columns and sorting them by
+    frame, as the fitters used to, with lib.build_locs, which writes the
+    fits into one preallocated array and skips the sort of frame-ordered
+    identifications. Reports the time and peak memory of both.
+
+    Usage: python benchmarks/bench_locs.py [n_locs]
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+from picasso import gausslq, lib, postprocess
+
+
+def from_columns(identifications, theta, box, em):
+    x = theta[:, 0] + identifications.x
+    y = theta[:, 1] + identifications.y
+    lpx = postprocess.localization_precision(theta[:, 2], theta[:, 4], theta[:, 3], em)
+    lpy = postprocess.localization_precision(theta[:, 2], theta[:, 5], theta[:, 3], em)
+    a = np.maximum(theta[:, 4], theta[:, 5])
+    b = np.minimum(theta[:, 4], theta[:, 5])
+    ellipticity = (a - b) / a
+    locs = np.rec.array(
+        (
+            identifications.frame,
+            x,
+            y,
+            theta[:, 2],
+            theta[:, 4],
+            theta[:, 5],
+            theta[:, 3],
+            lpx,
+            lpy,
+            ellipticity,
+            identifications.net_gradient,
+        ),
+        dtype=lib.FIT_LOCS_DTYPE,
+    )
+    locs.sort(kind="mergesort", order="frame")
+    return locs
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    n_locs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    rng = np.random.default_rng(0)
+    identifications = np.rec.fromarrays(
+        (
+            np.sort(rng.integers(0, n_locs // 100, n_locs)),
+            rng.integers(3, 1000, n_locs),
+            rng.integers(3, 1000, n_locs),
+            rng.uniform(0, 1e4, n_locs),
+        ),
+        dtype=[("frame", "i"), ("x", "i"), ("y", "i"), ("net_gradient", "f4")],
+    )
+    theta = rng.uniform(0.5, 1.5, (n_locs, 6)).astype(np.float32)
+    theta[:, 2] *= 1000
+    gausslq.locs_from_fits(identifications[:10], theta[:10], 7, False)
+    print("Locs: {:,} ({:.0f} MB)".format(n_locs, n_locs * 44 / 1e6))
+    print("{:<12} {:>10} {:>16}".format("Builder", "Time (s)", "Peak memory (MB)"))
+    for name, func in [("columns", from_columns), ("build_locs", gausslq.locs_from_fits)]:
+        elapsed, peak = measure(func, identifications, theta, 7, False)
+        print("{:<12} {:>10.2f} {:>16.0f}".format(name, elapsed, peak / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+    benchmarks/bench_locs_index.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares loading the locs of a viewport and frame range from a locs
+    file without an index, which is read whole and filtered, with a file
+    saved with index=True, of which only the overlapping tiles and frame
+    bins are read.
+
+    Usage: python benchmarks/bench_locs_index.py [n_locs]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from picasso import io, lib
+
+
+def measure(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    n_locs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    n_frames = 20000
+    rng = np.random.default_rng(0)
+    names = np.dtype(lib.FIT_LOCS_DTYPE).names
+    columns = {
+        "frame": np.sort(rng.integers(0, n_frames, n_locs)),
+        "x": rng.uniform(1, 511, n_locs),
+        "y": rng.uniform(1, 511, n_locs),
+    }
+    for name in names[3:]:
+        columns[name] = rng.uniform(0.01, 2, n_locs)
+    locs = np.rec.fromarrays([columns[_] for _ in names], dtype=lib.FIT_LOCS_DTYPE)
+    info = [{"Frames": n_frames, "Width": 512, "Height": 512}]
+    queries = [
+        ("viewport", {"viewport": ((100, 200), (164, 264))}),
+        ("frames", {"frames": (5000, 7000)}),
+        ("both", {"viewport": ((100, 200), (164, 264)), "frames": (5000, 7000)}),
+    ]
+    print("Locs: {:,}".format(n_locs))
+    header = ("Query", "Locs", "Whole (s)", "Index (s)")
+    print("{:<10} {:>10} {:>12} {:>10}".format(*header))
+    with tempfile.TemporaryDirectory() as directory:
+        plain = os.path.join(directory, "plain.hdf5")
+        indexed = os.path.join(directory, "indexed.hdf5")
+        io.save_locs(plain, locs, info)
+        io.save_locs(indexed, locs, info, index=True)
+        for name, query in queries:
+            whole, (expected, _) = measure(lambda: io.load_locs(plain, **query))
+            index, (loaded, _) = measure(lambda: io.load_locs(indexed, **query))
+            assert len(loaded) == len(expected)
+            print(
+                "{:<10} {:>10,} {:>12.3f} {:>10.3f}".format(
+                    name, len(loaded), whole, index
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+    benchmarks/bench_mle.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the MLE fit throughput on simulated spots for increasing
+    numbers of threads, claiming one spot or one block of spots at a time.
+
+    Usage: python benchmarks/bench_mle.py [n_spots]
+"""
+import multiprocessing
+import sys
+import time
+import numpy as np
+from picasso import gaussmle
+
+
+def simulate_spots(n_spots, box=7, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-0.5, 0.5, n_spots)[:, None, None]
+    y = rng.uniform(-0.5, 0.5, n_spots)[:, None, None]
+    s = rng.uniform(0.9, 1.3, n_spots)[:, None, None]
+    grid = np.arange(box) - box // 2
+    psf = np.exp(
+        -((grid[None, :, None] - y) ** 2 + (grid[None, None, :] - x) ** 2)
+        / (2 * s**2)
+    )
+    psf *= 2000 / (2 * np.pi * s**2)
+    return rng.poisson(psf + 50).astype(np.float32)
+
+
+def main():
+    n_spots = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    spots = simulate_spots(n_spots)
+    # compile before timing
+    gaussmle.gaussmle(spots[:10], 0.001, 1000, method="sigmaxy")
+    print("Spots: {:,}".format(n_spots))
+    print("{:<8} {:>12} {:>18}".format("Threads", "Block size", "Spots per second"))
+    n_cpus = multiprocessing.cpu_count()
+    for n_workers in sorted({1, 2, 4, n_cpus}):
+        if n_workers > n_cpus:
+            continue
+        for block_size in [1, gaussmle.MLE_BLOCK_SIZE]:
+            start = time.perf_counter()
+            gaussmle.gaussmle_parallel(
+                spots,
+                0.001,
+                1000,
+                method="sigmaxy",
+                n_workers=n_workers,
+                block_size=block_size,
+            )
+            dt = time.perf_counter() - start
+            print("{:<8} {:>12} {:>18,.0f}".format(n_workers, block_size, n_spots / dt))
+
+
+if __name__ == "__main__":
+    main()
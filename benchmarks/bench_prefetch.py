@@ -0,0 +1,56 @@
+"""
+    benchmarks/bench_prefetch.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares identifying spots in a movie on slow storage, simulated by a
+    fixed latency per frame read, when frames are read as they are needed
+    with reading them ahead with io.FramePrefetcher.
+
+    Usage: python benchmarks/bench_prefetch.py [n_frames] [latency_ms]
+"""
+import sys
+import time
+import numpy as np
+from picasso import io, localize
+
+
+class SlowMovie:
+    def __init__(self, movie, latency):
+        self.movie = movie
+        self.latency = latency
+        self.shape = movie.shape
+        self.dtype = movie.dtype
+
+    def __len__(self):
+        return len(self.movie)
+
+    def __getitem__(self, index):
+        time.sleep(self.latency)
+        return self.movie[index].copy()
+
+
+def identify_all(frames, n_frames):
+    for i in range(n_frames):
+        localize.identify_in_frame(frames[i], 1000, 7)
+
+
+def main():
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+    rng = np.random.default_rng(0)
+    movie = rng.poisson(20, (n_frames, 256, 256)).astype(np.uint16)
+    slow = SlowMovie(movie, latency)
+    identify_all(movie, 2)
+    print("Frames: {:,}, latency: {:.1f} ms".format(n_frames, 1000 * latency))
+    print("{:<10} {:>10}".format("Reader", "Time (s)"))
+    start = time.perf_counter()
+    identify_all(slow, n_frames)
+    print("{:<10} {:>10.2f}".format("direct", time.perf_counter() - start))
+    start = time.perf_counter()
+    with io.FramePrefetcher(slow, range(n_frames)) as frames:
+        identify_all(frames, n_frames)
+    print("{:<10} {:>10.2f}".format("prefetch", time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
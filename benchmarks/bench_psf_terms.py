@@ -0,0 +1,87 @@
+"""
+    benchmarks/bench_psf_terms.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares evaluating the pixel-integrated Gaussian and its derivatives
+    per pixel with evaluating them once per row and column of the box,
+    as the MLE kernels do. Reports the throughput of both and the largest
+    deviation of the model and its derivatives at fitted parameters.
+
+    Usage: python benchmarks/bench_psf_terms.py [n_spots]
+"""
+import sys
+import time
+import numba
+import numpy as np
+from picasso import gaussmle
+from bench_mle import simulate_spots
+
+
+@numba.njit(nogil=True)
+def per_pixel(theta, size, out):
+    for s in range(theta.shape[0]):
+        x, y, photons, bg, sx, sy = theta[s]
+        for ii in range(size):
+            for jj in range(size):
+                PSFx = gaussmle._gaussian_integral(ii, x, sx)
+                PSFy = gaussmle._gaussian_integral(jj, y, sy)
+                out[s, ii, jj, 0] = PSFx * PSFy
+                out[s, ii, jj, 1:3] = gaussmle._derivative_gaussian_integral(
+                    ii, x, sx, photons, PSFy
+                )
+                out[s, ii, jj, 3:5] = gaussmle._derivative_gaussian_integral_1d_sigma(
+                    jj, y, sy, photons, PSFx
+                )
+
+
+@numba.njit(nogil=True)
+def per_row(theta, size, out):
+    x_terms = np.zeros((8, size, 1))
+    y_terms = np.zeros((8, size, 1))
+    for s in range(theta.shape[0]):
+        x, y, photons, bg, sx, sy = theta[s]
+        gaussmle._fill_integral_terms(x_terms, 0, x, sx)
+        gaussmle._fill_integral_terms(y_terms, 0, y, sy)
+        for ii in range(size):
+            for jj in range(size):
+                PSFx = x_terms[0, ii, 0]
+                PSFy = y_terms[0, jj, 0]
+                out[s, ii, jj, 0] = PSFx * PSFy
+                out[s, ii, jj, 1:3] = gaussmle._position_derivative(
+                    x_terms, ii, 0, sx, photons, PSFy
+                )
+                out[s, ii, jj, 3:5] = gaussmle._sigma_derivative(
+                    y_terms, jj, 0, sy, photons, PSFx
+                )
+
+
+def best_of(func, *args, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    n_spots = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    size = 7
+    spots = simulate_spots(n_spots, size)
+    theta, _, _, _ = gaussmle.gaussmle(spots, 0.001, 1000, method="sigmaxy")
+    out_pixel = np.zeros((n_spots, size, size, 5))
+    out_row = np.zeros((n_spots, size, size, 5))
+    per_pixel(theta[:1], size, out_pixel)
+    per_row(theta[:1], size, out_row)
+    t_pixel = best_of(per_pixel, theta, size, out_pixel)
+    t_row = best_of(per_row, theta, size, out_row)
+    print("Spots: {:,} ({}x{} pixels)".format(n_spots, size, size))
+    print("{:<10} {:>18}".format("Path", "Spots per second"))
+    print("{:<10} {:>18,.0f}".format("per pixel", n_spots / t_pixel))
+    print("{:<10} {:>18,.0f}".format("per row", n_spots / t_row))
+    print("Speedup: {:.1f}".format(t_pixel / t_row))
+    print("Max. derivative deviation: {:g}".format(np.abs(out_pixel - out_row).max()))
+
+
+if __name__ == "__main__":
+    main()
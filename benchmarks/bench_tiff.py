@@ -0,0 +1,68 @@
+"""
+    benchmarks/bench_tiff.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares reading the frames of an uncompressed TIFF stack one by one
+    through file seeks and reads, as TiffMap always did, with the
+    memory-mapped TiffMap.stack, which slices frames out of one map of
+    the file. Reports the read throughput of both.
+
+    Usage: python benchmarks/bench_tiff.py [n_frames]
+"""
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+from picasso import io
+
+
+def write_tiff(path, n_frames, height, width):
+    frame = np.random.default_rng(0).integers(0, 2**16, (height, width), "<u2")
+    frame_bytes = frame.nbytes
+    tags = [(256, 4, width), (257, 4, height), (258, 3, 16), (259, 3, 1)]
+    tags += [(273, 4, 0), (278, 4, height), (279, 4, frame_bytes)]
+    with open(path, "wb") as file:
+        file.write(b"II" + struct.pack("<HL", 42, 8))
+        for i in range(n_frames):
+            image_offset = file.tell() + 2 + 12 * len(tags) + 4
+            file.write(struct.pack("<H", len(tags)))
+            for tag, type, value in tags:
+                value = image_offset if tag == 273 else value
+                file.write(struct.pack("<HHLL", tag, type, 1, value))
+            next_ifd = image_offset + frame_bytes if i < n_frames - 1 else 0
+            file.write(struct.pack("<L", next_ifd))
+            file.write(frame.tobytes())
+
+
+def read_all(tif):
+    start = time.perf_counter()
+    total = 0
+    for i in range(tif.n_frames):
+        total += int(tif[i].sum())
+    return time.perf_counter() - start
+
+
+def report(name, elapsed, n_frames):
+    print("{:<8} {:>10.3f} {:>14,.0f}".format(name, elapsed, n_frames / elapsed))
+
+
+def main():
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "movie.ome.tif")
+        write_tiff(path, n_frames, 256, 256)
+        size = os.path.getsize(path) / 1e6
+        print("Frames: {:,} ({:.0f} MB)".format(n_frames, size))
+        print("{:<8} {:>10} {:>14}".format("Reader", "Time (s)", "Frames per s"))
+        with io.TiffMap(path) as tif:
+            stack = tif.stack
+            tif.stack = None
+            report("seek", read_all(tif), n_frames)
+            tif.stack = stack
+            report("mmap", read_all(tif), n_frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+    benchmarks/bench_zfit.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares z fits with one scipy minimize_scalar per loc with the lookup
+    and Newton kernel of zfit, on a single thread and on threads. Reports
+    the throughput of each and the largest deviation of z from the
+    minimize_scalar fits.
+
+    Usage: python benchmarks/bench_zfit.py [n_locs]
+"""
+import sys
+import time
+import numpy as np
+from scipy.optimize import minimize_scalar
+from picasso import zfit
+
+
+def fit_z_values(sx, sy, cx, cy, z, square_d_zcalib):
+    """One minimize_scalar per loc, as zfit did before the lookup kernel"""
+    for i in range(len(z)):
+        result = minimize_scalar(zfit._fit_z_target, args=(sx[i], sy[i], cx, cy))
+        z[i] = result.x
+        square_d_zcalib[i] = result.fun
+
+
+def main():
+    n_locs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = np.random.default_rng(0)
+    z_range = np.linspace(-600, 600, 121)
+    cx = np.polyfit(z_range, 1.2 * np.sqrt(1 + ((z_range - 250) / 450) ** 2), 6)
+    cy = np.polyfit(z_range, 1.2 * np.sqrt(1 + ((z_range + 250) / 450) ** 2), 6)
+    true_z = rng.uniform(-500, 500, n_locs)
+    locs = np.rec.fromarrays(
+        (
+            np.zeros(n_locs),
+            np.full(n_locs, 10.0),
+            np.full(n_locs, 10.0),
+            np.polyval(cx, true_z) * rng.normal(1, 0.03, n_locs),
+            np.polyval(cy, true_z) * rng.normal(1, 0.03, n_locs),
+            np.full(n_locs, 0.1),
+            np.full(n_locs, 0.1),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("sx", "f4"),
+            ("sy", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+    info = [{"Width": 32, "Height": 32}]
+    calibration = {"X Coefficients": list(cx), "Y Coefficients": list(cy)}
+    zfit.fit_z(locs[:10], info, calibration, 1, filter=0)
+
+    n_scalar = min(n_locs, 20000)
+    z = np.zeros(n_scalar, dtype=np.float32)
+    square_d_zcalib = np.zeros_like(z)
+    start = time.perf_counter()
+    sx, sy = locs.sx[:n_scalar], locs.sy[:n_scalar]
+    fit_z_values(sx, sy, cx, cy, z, square_d_zcalib)
+    t_scalar = time.perf_counter() - start
+    start = time.perf_counter()
+    locs_z = zfit.fit_z(locs, info, calibration, 1, filter=0)
+    t_lookup = time.perf_counter() - start
+    start = time.perf_counter()
+    fs = zfit.fit_z_parallel(locs, info, calibration, 1, filter=0, asynch=True)
+    zfit.locs_from_futures(fs, filter=0)
+    t_threads = time.perf_counter() - start
+
+    found = np.isfinite(z)
+    deviation = np.abs(locs_z.z[:n_scalar][found] - z[found]).max()
+    print("Locs: {:,}".format(n_locs))
+    print("{:<16} {:>16}".format("Method", "Locs per second"))
+    print("{:<16} {:>16,.0f}".format("minimize_scalar", n_scalar / t_scalar))
+    print("{:<16} {:>16,.0f}".format("lookup", n_locs / t_lookup))
+    print("{:<16} {:>16,.0f}".format("lookup, threads", n_locs / t_threads))
+    print("Max. deviation from minimize_scalar: {:.3g}".format(deviation))
+    print("minimize_scalar failures: {:,} of {:,}".format((~found).sum(), n_scalar))
+
+
+if __name__ == "__main__":
+    main()
@@ -723,19 +723,11 @@ def _nanotron(args):
 def _localize(args):
     files = args.files
     from glob import glob
-    from .io import load_movie, save_locs, save_info
-    from .localize import (
-        get_spots,
-        identify_async,
-        identifications_from_futures,
-        fit_async,
-        locs_from_fits,
-        add_file_to_db,
-    )
+    from .io import load_movie, save_locs, save_info, load_camera_maps
+    from .localize import localize_streaming, add_file_to_db, STREAM_CHUNK_SIZE
 
     from os.path import splitext, isdir
-    from time import sleep
-    from . import gausslq, avgroi
+    from . import gausslq
     import os.path as _ospath
     import re as _re
     import os as _os
@@ -752,7 +744,8 @@ def _localize(args):
             raise Exception("GPUfit not installed. Aborting.")
 
     for index, element in enumerate(vars(args)):
-        print("{:<8} {:<15} {:<10}".format(index + 1, element, getattr(args, element)))
+        value = str(getattr(args, element))
+        print("{:<8} {:<15} {:<10}".format(index + 1, element, value))
     print("------------------------------------------")
 
     def check_consecutive_tif(filepath):
@@ -823,11 +816,60 @@ def _localize(args):
         camera_info["sensitivity"] = args.sensitivity
         camera_info["gain"] = args.gain
         camera_info["qe"] = args.qe
+        camera_maps = getattr(args, "camera_maps", None)
+        if camera_maps is not None:
+            # per-pixel baseline and sensitivity replace the scalar ones
+            camera_info["maps"] = load_camera_maps(camera_maps)
+
+        if getattr(args, "chunk_size", None) is not None:
+            chunk_size = args.chunk_size
+        else:
+            chunk_size = STREAM_CHUNK_SIZE
+
+        if hasattr(args, "processes"):
+            processes = args.processes
+        else:
+            processes = False
 
+        if hasattr(args, "adaptive_snr"):
+            adaptive_snr = args.adaptive_snr
+        else:
+            adaptive_snr = None
+
+        if hasattr(args, "warm_start"):
+            warm_start = args.warm_start
+        else:
+            warm_start = "centroid"
+
+        if hasattr(args, "max_emitters"):
+            max_emitters = args.max_emitters
+        else:
+            max_emitters = 1
+
+        # rejection criteria that are given on the command line
+        rejection_criteria = {
+            name: getattr(args, name)
+            for name in ["min_sigma", "max_sigma", "min_photons", "max_llr"]
+            if getattr(args, name, None) is not None
+        }
+        if getattr(args, "reject_unconverged", False):
+            rejection_criteria["unconverged"] = True
+        rejection = None
+        if rejection_criteria:
+            from .gaussmle import rejection_limits
+
+            rejection = rejection_limits(**rejection_criteria)
+
+        iteration_histogram = None
         if args.fit_method == "mle":
+            from .gaussmle import IterationHistogram
+
             # use default settings
             convergence = 0.001
-            max_iterations = 1000
+            if hasattr(args, "max_iterations"):
+                max_iterations = args.max_iterations
+            else:
+                max_iterations = 1000
         else:
             convergence = 0
             max_iterations = 0
@@ -865,49 +907,37 @@ def _localize(args):
             print("Processing {}, File {} of {}".format(path, i + 1, len(paths)))
             print("------------------------------------------")
             movie, info = load_movie(path)
-            current, futures = identify_async(movie, min_net_gradient, box)
             n_frames = len(movie)
-            while current[0] < n_frames:
+
+            if args.fit_method == "mle":
+                iteration_histogram = IterationHistogram(max_iterations)
+
+            def print_progress(frame):
                 print(
-                    "Identifying in frame {:,} of {:,}".format(
-                        current[0] + 1, n_frames
-                    ),
+                    "Localizing in frame {:,} of {:,}".format(frame, n_frames),
                     end="\r",
                 )
-                sleep(0.2)
-            print("Identifying in frame {:,} of {:,}".format(n_frames, n_frames))
-            ids = identifications_from_futures(futures)
-
-            if args.fit_method == "lq" or args.fit_method == "lq-3d":
-                spots = get_spots(movie, ids, box, camera_info)
-                theta = gausslq.fit_spots_parallel(spots, asynch=False)
-                locs = gausslq.locs_from_fits(ids, theta, box, args.gain)
-            elif args.fit_method == "lq-gpu" or args.fit_method == "lq-gpu-3d":
-                spots = get_spots(movie, ids, box, camera_info)
-                theta = gausslq.fit_spots_gpufit(spots)
-                em = camera_info["gain"] > 1
-                locs = gausslq.locs_from_fits_gpufit(ids, theta, box, em)
-            elif args.fit_method == "mle":
-                current, thetas, CRLBs, likelihoods, iterations = fit_async(
-                    movie, camera_info, ids, box, convergence, max_iterations
-                )
-                n_spots = len(ids)
-                while current[0] < n_spots:
-                    print(
-                        "Fitting spot {:,} of {:,}".format(current[0] + 1, n_spots),
-                        end="\r",
-                    )
-                    sleep(0.2)
-                print("Fitting spot {:,} of {:,}".format(n_spots, n_spots))
-                locs = locs_from_fits(ids, thetas, CRLBs, likelihoods, iterations, box)
-
-            elif args.fit_method == "avg":
-                spots = get_spots(movie, ids, box, camera_info)
-                theta = avgroi.fit_spots_parallel(spots, asynch=False)
-                locs = avgroi.locs_from_fits(ids, theta, box, args.gain)
 
-            else:
-                print("This should never happen...")
+            locs = localize_streaming(
+                movie,
+                camera_info,
+                min_net_gradient,
+                box,
+                fit_method=args.fit_method,
+                eps=convergence,
+                max_it=max_iterations,
+                chunk_size=chunk_size,
+                callback=print_progress,
+                processes=processes,
+                adaptive_snr=adaptive_snr,
+                warm_start=warm_start,
+                iteration_histogram=iteration_histogram,
+                max_emitters=max_emitters,
+                rejection=rejection,
+            )
+            print("Localizing in frame {:,} of {:,}".format(n_frames, n_frames))
+            if iteration_histogram is not None:
+                print(iteration_histogram.summary())
 
             localize_info = {
                 "Generated by": "Picasso Localize",
@@ -917,6 +947,16 @@ def _localize(args):
                 "Convergence Criterion": convergence,
                 "Max. Iterations": max_iterations,
             }
+            if adaptive_snr is not None:
+                localize_info["Adaptive SNR"] = adaptive_snr
+            if args.fit_method == "mle" and warm_start != "centroid":
+                localize_info["Warm Start"] = warm_start
+            if max_emitters > 1:
+                localize_info["Max. Emitters"] = max_emitters
+            if rejection_criteria:
+                localize_info["Rejection"] = rejection_criteria
+            if camera_maps is not None:
+                localize_info["Camera Maps"] = _ospath.abspath(camera_maps)
 
             if args.fit_method == "lq-3d" or args.fit_method == "lq-gpu-3d":
                 print("------------------------------------------")
@@ -939,7 +979,7 @@ def _localize(args):
 
             base, ext = splitext(path)
             out_path = base + "_locs.hdf5"
-            save_locs(out_path, locs, info)
+            save_locs(out_path, locs, info, index=getattr(args, "index", False))
             print("File saved to {}".format(out_path))
 
             if hasattr(args, "database"):
@@ -969,6 +1009,16 @@ def _localize(args):
         raise FileNotFoundError
 
 
+def _warmup():
+    from time import time
+    from .localize import warmup
+
+    print("Compiling and caching kernels...", end="")
+    start = time()
+    warmup()
+    print(" done in {:.1f} s.".format(time() - start))
+
+
 def _render(args):
     from .lib import locs_glob_map
     from .render import render
@@ -1067,7 +1117,7 @@ def main():
     parser = argparse.ArgumentParser("picasso")
     subparsers = parser.add_subparsers(dest="command")
 
-    for command in ["toraw", "localize", "filter", "render"]:
+    for command in ["toraw", "filter"]:
         subparsers.add_parser(command)
 
     # link parser
@@ -1373,6 +1423,108 @@ def main():
         default="",
         help="Path to 3d calibration file (only 3d)",
     )
+    localize_parser.add_argument(
+        "-cs",
+        "--chunk-size",
+        type=int,
+        help="number of frames that are identified and fitted at once"
+        " (default: localize.STREAM_CHUNK_SIZE)",
+    )
+    localize_parser.add_argument(
+        "-p",
+        "--processes",
+        action="store_true",
+        help="identify in worker processes instead of threads",
+    )
+    localize_parser.add_argument(
+        "-as",
+        "--adaptive-snr",
+        type=float,
+        default=None,
+        help=(
+            "raise the minimum net gradient to this multiple of the local"
+            " noise of the net gradient (e.g. 4)"
+        ),
+    )
+    localize_parser.add_argument(
+        "-mi",
+        "--max-iterations",
+        type=int,
+        default=1000,
+        help="maximum number of iterations per spot (only mle)",
+    )
+    localize_parser.add_argument(
+        "-ws",
+        "--warm-start",
+        choices=["centroid", "lq", "previous"],
+        default="centroid",
+        help=(
+            "start mle fits from the center of mass, from least squares fits"
+            " or from the fit of the same emitter in the previous frame"
+        ),
+    )
+    localize_parser.add_argument(
+        "-me",
+        "--max-emitters",
+        type=int,
+        default=1,
+        help=(
+            "jointly fit spots with overlapping boxes as up to this number of"
+            " emitters (only mle)"
+        ),
+    )
+    localize_parser.add_argument(
+        "--min-sigma",
+        type=float,
+        default=None,
+        help="reject fits narrower than this width in pixels (only mle)",
+    )
+    localize_parser.add_argument(
+        "--max-sigma",
+        type=float,
+        default=None,
+        help="reject fits wider than this width in pixels (only mle)",
+    )
+    localize_parser.add_argument(
+        "--min-photons",
+        type=float,
+        default=None,
+        help="reject fits with fewer photons (only mle)",
+    )
+    localize_parser.add_argument(
+        "--max-llr",
+        type=float,
+        default=None,
+        help=(
+            "reject fits whose log-likelihood ratio per pixel exceeds this value"
+            " (only mle)"
+        ),
+    )
+    localize_parser.add_argument(
+        "--reject-unconverged",
+        action="store_true",
+        help="reject fits that reach the max. iterations or diverge (only mle)",
+    )
+    localize_parser.add_argument(
+        "-cm",
+        "--camera-maps",
+        type=str,
+        default=None,
+        help=(
+            "path to sCMOS baseline, variance and sensitivity maps saved with"
+            " picasso.io.save_camera_maps (replaces baseline and sensitivity)"
+        ),
+    )
+    localize_parser.add_argument(
+        "-ix",
+        "--index",
+        action="store_true",
+        help=(
+            "save the locs with an index of tiles and frames, for fast loading"
+            " of viewports and frame ranges (older Picasso versions load them"
+            " sorted by tile)"
+        ),
+    )
     localize_parser.add_argument(
         "-db",
         "--database",
@@ -1380,6 +1532,11 @@ def main():
         help="do not add to database",
     )
 
+    subparsers.add_parser(
+        "warmup",
+        help="compile and cache the localization kernels for fast startup",
+    )
+
     # nneighbors
     nneighbor_parser = subparsers.add_parser(
         "nneighbor", help="calculate nearest neighbor of a clustered dataset"
@@ -1609,6 +1766,8 @@ def main():
             _hdf2csv(args.files)
         elif args.command == "server":
             _start_server()
+        elif args.command == "warmup":
+            _warmup()
     else:
         parser.print_help()
 
@@ -8,16 +8,20 @@
     :copyright: Copyright (c) 2016 Jungmann Lab, MPI of Biochemistry
 """
 
-from scipy import optimize as _optimize
 import numpy as _np
 from tqdm import tqdm as _tqdm
 import numba as _numba
 import multiprocessing as _multiprocessing
 from concurrent import futures as _futures
-from . import postprocess as _postprocess
+from . import lib as _lib
 
 
-@_numba.jit(nopython=True, nogil=True)
+# Below this many spots, copying them to shared memory and waking the
+# process pool takes longer than summing them on threads
+SHARED_MIN_SPOTS = 20000
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _sum(spot, size):
     _sum_ = 0.0
     for i in range(size):
@@ -43,22 +47,54 @@ def fit_spots(spots):
     return theta
 
 
+def _fit_spots_shared(inputs, outputs, start, stop):
+    (spots,) = inputs
+    (theta,) = outputs
+    theta[start:stop] = fit_spots(spots[start:stop])
+
+
+def _copy_theta(outputs, start, stop):
+    return outputs[0][start:stop].copy()
+
+
+def _fit_spots_task(spots, theta, start, stop):
+    theta[start:stop] = fit_spots(spots[start:stop])
+    return theta[start:stop]
+
+
+def _fit_spots_threaded(spots, n_tasks, n_workers):
+    theta = _np.empty((len(spots), 6), dtype=_np.float32)
+    bounds = _np.linspace(0, len(spots), n_tasks + 1).astype(int)
+    executor = _futures.ThreadPoolExecutor(n_workers)
+    fs = [
+        executor.submit(_fit_spots_task, spots, theta, start, stop)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    executor.shutdown(wait=False)
+    return fs
+
+
 def fit_spots_parallel(spots, asynch=False):
+    """Fits spots in the reused process pool, which reads the spots from and
+    writes theta to shared memory (see lib.map_shared). Fewer than
+    SHARED_MIN_SPOTS spots, or all spots on Python 3.7, are fitted on
+    threads instead."""
     n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
-    n_spots = len(spots)
     n_tasks = 100 * n_workers
-    spots_per_task = [
-        int(n_spots / n_tasks + 1) if _ < n_spots % n_tasks else int(n_spots / n_tasks)
-        for _ in range(n_tasks)
-    ]
-    start_indices = _np.cumsum([0] + spots_per_task[:-1])
-    fs = []
-    executor = _futures.ProcessPoolExecutor(n_workers)
-    for i, n_spots_task in zip(start_indices, spots_per_task):
-        fs.append(executor.submit(fit_spots, spots[i : i + n_spots_task]))
+    if len(spots) < SHARED_MIN_SPOTS or not _lib.has_shared_memory():
+        fs = _fit_spots_threaded(spots, n_tasks, n_workers)
+    else:
+        fs = _lib.map_shared(
+            _fit_spots_shared,
+            [spots],
+            [((len(spots), 6), _np.float32)],
+            n_tasks,
+            _copy_theta,
+            n_workers=n_workers,
+        )
     if asynch:
         return fs
-    with _tqdm(total=n_tasks, unit="task") as progress_bar:
+    with _tqdm(total=len(fs), unit="task") as progress_bar:
         for f in _futures.as_completed(fs):
             progress_bar.update()
     return fits_from_futures(fs)
@@ -70,78 +106,17 @@ def fits_from_futures(futures):
 
 
 def locs_from_fits(identifications, theta, box, em):
-    # box_offset = int(box/2)
-    x = theta[:, 0] + identifications.x  # - box_offset
-    y = theta[:, 1] + identifications.y  # - box_offset
-    lpx = _postprocess.localization_precision(
-        theta[:, 2], theta[:, 4], theta[:, 3], em=em
-    )
-    lpy = _postprocess.localization_precision(
-        theta[:, 2], theta[:, 5], theta[:, 3], em=em
-    )
-    a = _np.maximum(theta[:, 4], theta[:, 5])
-    b = _np.minimum(theta[:, 4], theta[:, 5])
-    ellipticity = (a - b) / a
+    dtype = _lib.FIT_LOCS_DTYPE
     if hasattr(identifications, "n_id"):
-        locs = _np.rec.array(
-            (
-                identifications.frame,
-                x,
-                y,
-                theta[:, 2],
-                theta[:, 4],
-                theta[:, 5],
-                theta[:, 3],
-                lpx,
-                lpy,
-                ellipticity,
-                identifications.net_gradient,
-                identifications.n_id,
-            ),
-            dtype=[
-                ("frame", "u4"),
-                ("x", "f4"),
-                ("y", "f4"),
-                ("photons", "f4"),
-                ("sx", "f4"),
-                ("sy", "f4"),
-                ("bg", "f4"),
-                ("lpx", "f4"),
-                ("lpy", "f4"),
-                ("ellipticity", "f4"),
-                ("net_gradient", "f4"),
-                ("n_id", "u4"),
-            ],
-        )
-        locs.sort(kind="mergesort", order="n_id")
-    else:
-        locs = _np.rec.array(
-            (
-                identifications.frame,
-                x,
-                y,
-                theta[:, 2],
-                theta[:, 4],
-                theta[:, 5],
-                theta[:, 3],
-                lpx,
-                lpy,
-                ellipticity,
-                identifications.net_gradient,
-            ),
-            dtype=[
-                ("frame", "u4"),
-                ("x", "f4"),
-                ("y", "f4"),
-                ("photons", "f4"),
-                ("sx", "f4"),
-                ("sy", "f4"),
-                ("bg", "f4"),
-                ("lpx", "f4"),
-                ("lpy", "f4"),
-                ("ellipticity", "f4"),
-                ("net_gradient", "f4"),
-            ],
-        )
-        locs.sort(kind="mergesort", order="frame")
-    return locs
+        dtype = dtype + [("n_id", "u4")]
+    return _lib.build_locs(
+        identifications,
+        dtype,
+        theta[:, 0],
+        theta[:, 1],
+        em=em,
+        photons=theta[:, 2],
+        sx=theta[:, 4],
+        sy=theta[:, 5],
+        bg=theta[:, 3],
+    )
@@ -9,13 +9,12 @@
 """
 
 
-from scipy import optimize as _optimize
 import numpy as _np
 from tqdm import tqdm as _tqdm
 import numba as _numba
 import multiprocessing as _multiprocessing
 from concurrent import futures as _futures
-from . import postprocess as _postprocess
+from . import lib as _lib
 
 try:
     from pygpufit import gpufit as gf
@@ -25,7 +24,7 @@ except ImportError:
     gpufit_installed = False
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _gaussian(mu, sigma, grid):
     norm = 0.3989422804014327 / sigma
     return norm * _np.exp(-0.5 * ((grid - mu) / sigma) ** 2)
@@ -40,7 +39,7 @@ def integrated_gaussian(mu, sigma, grid):
 """
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _sum_and_center_of_mass(spot, size):
     x = 0.0
     y = 0.0
@@ -55,7 +54,7 @@ def _sum_and_center_of_mass(spot, size):
     return _sum_, y, x
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _initial_sigmas(spot, y, x, sum, size):
     sum_deviation_y = 0.0
     sum_deviation_x = 0.0
@@ -68,7 +67,7 @@ def _initial_sigmas(spot, y, x, sum, size):
     return sy, sx
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _initial_parameters(spot, size, size_half):
     theta = _np.zeros(6, dtype=_np.float32)
     theta[3] = _np.min(spot)
@@ -100,14 +99,14 @@ def initial_parameters_gpufit(spots, size):
     return initial_parameters
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _outer(a, b, size, model, n, bg):
     for i in range(size):
         for j in range(size):
             model[i, j] = n * a[i] * b[j] + bg
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _compute_model(theta, grid, size, model_x, model_y, model):
     model_x[:] = _gaussian(
         theta[0], theta[4], grid
@@ -117,7 +116,7 @@ def _compute_model(theta, grid, size, model_x, model_y, model):
     return model
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _compute_residuals(theta, spot, grid, size, model_x, model_y, model, residuals):
     _compute_model(theta, grid, size, model_x, model_y, model)
     residuals[:, :] = spot - model
@@ -135,6 +134,8 @@ def fit_spot(spot):
     # theta is [x, y, photons, bg, sx, sy]
     theta0 = _initial_parameters(spot, size, size_half)
     args = (spot, grid, size, model_x, model_y, model, residuals)
+    from scipy import optimize as _optimize
+
     result = _optimize.leastsq(
         _compute_residuals, theta0, args=args, ftol=1e-2, xtol=1e-2
     )  # leastsq is much faster than least_squares
@@ -151,15 +152,173 @@ def fit_spot(spot):
     return result[0]
 
 
+# Convergence criteria of _fit_spot_lm. They are tighter than the ones of
+# fit_spot, because MINPACK scales and tests its steps differently.
+LM_FTOL = 1e-3  # relative decrease of the sum of squares to stop at
+LM_XTOL = 1e-3  # relative change of the parameters to stop at
+LM_MAX_IT = 100
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _lm_normal_equations(spot, theta, grid, size, gx, gy, A, b):
+    """
+    Sum of squared residuals of the model in theta, the approximated
+    Hessian A = J^T J and b = J^T r with the analytic Jacobian J
+    """
+    x, y, n, bg, sx, sy = theta
+    for i in range(size):
+        dx = (grid[i] - x) / sx
+        dy = (grid[i] - y) / sy
+        gx[i] = 0.3989422804014327 / sx * _np.exp(-0.5 * dx * dx)
+        gy[i] = 0.3989422804014327 / sy * _np.exp(-0.5 * dy * dy)
+    A[:, :] = 0.0
+    b[:] = 0.0
+    jacobian = _np.empty(6)
+    chi2 = 0.0
+    for i in range(size):
+        dy = (grid[i] - y) / sy
+        for j in range(size):
+            dx = (grid[j] - x) / sx
+            g = gy[i] * gx[j]
+            r = spot[i, j] - (n * g + bg)
+            chi2 += r * r
+            jacobian[0] = n * g * dx / sx
+            jacobian[1] = n * g * dy / sy
+            jacobian[2] = g
+            jacobian[3] = 1.0
+            jacobian[4] = n * g * (dx * dx - 1.0) / sx
+            jacobian[5] = n * g * (dy * dy - 1.0) / sy
+            for k in range(6):
+                b[k] += jacobian[k] * r
+                for m in range(k + 1):
+                    A[k, m] += jacobian[k] * jacobian[m]
+    for k in range(6):
+        for m in range(k):
+            A[m, k] = A[k, m]
+    return chi2
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _chi2(spot, theta, grid, size, gx, gy):
+    x, y, n, bg, sx, sy = theta
+    for i in range(size):
+        dx = (grid[i] - x) / sx
+        dy = (grid[i] - y) / sy
+        gx[i] = 0.3989422804014327 / sx * _np.exp(-0.5 * dx * dx)
+        gy[i] = 0.3989422804014327 / sy * _np.exp(-0.5 * dy * dy)
+    chi2 = 0.0
+    for i in range(size):
+        for j in range(size):
+            r = spot[i, j] - (n * gy[i] * gx[j] + bg)
+            chi2 += r * r
+    return chi2
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _solve_damped(A, b, lambda_, L, step):
+    """
+    Solves (A + lambda_ * diag(A)) step = b by Cholesky decomposition.
+    Returns False if the damped matrix is not positive definite.
+    """
+    n = len(b)
+    for i in range(n):
+        for j in range(i + 1):
+            s = A[i, j]
+            if i == j:
+                s += lambda_ * A[i, i]
+            for k in range(j):
+                s -= L[i, k] * L[j, k]
+            if i == j:
+                if s <= 0.0:
+                    return False
+                L[i, i] = _np.sqrt(s)
+            else:
+                L[i, j] = s / L[j, j]
+    for i in range(n):
+        s = b[i]
+        for k in range(i):
+            s -= L[i, k] * step[k]
+        step[i] = s / L[i, i]
+    for i in range(n - 1, -1, -1):
+        s = step[i]
+        for k in range(i + 1, n):
+            s -= L[k, i] * step[k]
+        step[i] = s / L[i, i]
+    return True
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _fit_spot_lm(spot, theta, grid, size, ftol, xtol, max_it):
+    """
+    Levenberg-Marquardt fit of the same model as fit_spot, starting at and
+    updating theta. The fit has converged when the undamped (Gauss-Newton)
+    step would decrease the sum of squares by less than ftol or change
+    every parameter by less than xtol, relative to their values. Damped steps are
+    not used for this test, as they are small far from the minimum, too.
+    Returns the number of iterations.
+    """
+    gx = _np.empty(size)
+    gy = _np.empty(size)
+    A = _np.empty((6, 6))
+    b = _np.empty(6)
+    L = _np.zeros((6, 6))
+    step = _np.empty(6)
+    trial = _np.empty(6)
+    lambda_ = 1e-3
+    chi2 = _lm_normal_equations(spot, theta, grid, size, gx, gy, A, b)
+    for it in range(max_it):
+        if _solve_damped(A, b, 0.0, L, step):
+            if _np.dot(step, b) <= ftol * chi2:
+                return it
+            if _np.all(_np.abs(step) <= xtol * (_np.abs(theta) + xtol)):
+                return it
+        while True:
+            if _solve_damped(A, b, lambda_, L, step):
+                trial[:] = theta + step
+                if trial[4] > 0 and trial[5] > 0:
+                    if _chi2(spot, trial, grid, size, gx, gy) < chi2:
+                        break
+            lambda_ *= 10.0
+            if lambda_ > 1e10:
+                return it
+        lambda_ = max(lambda_ / 10.0, 1e-10)
+        theta[:] = trial
+        chi2 = _lm_normal_equations(spot, theta, grid, size, gx, gy, A, b)
+    return max_it
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _fit_spots_lm(spots, theta, start, stop, ftol, xtol, max_it):
+    """Fits spots start to stop (exclusive) into theta"""
+    size = spots.shape[1]
+    size_half = int(size / 2)
+    grid = _np.arange(-size_half, size_half + 1).astype(_np.float64)
+    spot = _np.empty((size, size))
+    theta_i = _np.empty(6)
+    for i in range(start, stop):
+        spot[:, :] = spots[i]
+        theta_i[:] = _initial_parameters(spots[i], size, size_half)
+        _fit_spot_lm(spot, theta_i, grid, size, ftol, xtol, max_it)
+        theta[i] = theta_i
+
+
 def fit_spots(spots):
+    """
+    Fits spots with a Levenberg-Marquardt solver compiled with numba.
+    The theta columns are [x, y, photons, bg, sx, sy] as in fit_spot.
+    """
     theta = _np.empty((len(spots), 6), dtype=_np.float32)
-    theta.fill(_np.nan)
-    for i, spot in enumerate(spots):
-        theta[i] = fit_spot(spot)
+    _fit_spots_lm(spots, theta, 0, len(spots), LM_FTOL, LM_XTOL, LM_MAX_IT)
     return theta
 
 
+def _fit_spots_task(spots, theta, start, stop):
+    _fit_spots_lm(spots, theta, start, stop, LM_FTOL, LM_XTOL, LM_MAX_IT)
+    return theta[start:stop]
+
+
 def fit_spots_parallel(spots, asynch=False):
+    """Fits spots on threads, which write to one shared theta array"""
     n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
     n_spots = len(spots)
     n_tasks = 100 * n_workers
@@ -168,10 +327,12 @@ def fit_spots_parallel(spots, asynch=False):
         for _ in range(n_tasks)
     ]
     start_indices = _np.cumsum([0] + spots_per_task[:-1])
+    theta = _np.empty((n_spots, 6), dtype=_np.float32)
     fs = []
-    executor = _futures.ProcessPoolExecutor(n_workers)
+    executor = _futures.ThreadPoolExecutor(n_workers)
     for i, n_spots_task in zip(start_indices, spots_per_task):
-        fs.append(executor.submit(fit_spots, spots[i : i + n_spots_task]))
+        fs.append(executor.submit(_fit_spots_task, spots, theta, i, i + n_spots_task))
+    executor.shutdown(wait=False)
     if asynch:
         return fs
     with _tqdm(total=n_tasks, unit="task") as progress_bar:
@@ -206,124 +367,32 @@ def fits_from_futures(futures):
 
 
 def locs_from_fits(identifications, theta, box, em):
-    # box_offset = int(box/2)
-    x = theta[:, 0] + identifications.x  # - box_offset
-    y = theta[:, 1] + identifications.y  # - box_offset
-    lpx = _postprocess.localization_precision(
-        theta[:, 2], theta[:, 4], theta[:, 3], em=em
-    )
-    lpy = _postprocess.localization_precision(
-        theta[:, 2], theta[:, 5], theta[:, 3], em=em
-    )
-    a = _np.maximum(theta[:, 4], theta[:, 5])
-    b = _np.minimum(theta[:, 4], theta[:, 5])
-    ellipticity = (a - b) / a
-
+    dtype = _lib.FIT_LOCS_DTYPE
     if hasattr(identifications, "n_id"):
-        locs = _np.rec.array(
-            (
-                identifications.frame,
-                x,
-                y,
-                theta[:, 2],
-                theta[:, 4],
-                theta[:, 5],
-                theta[:, 3],
-                lpx,
-                lpy,
-                ellipticity,
-                identifications.net_gradient,
-                identifications.n_id,
-            ),
-            dtype=[
-                ("frame", "u4"),
-                ("x", "f4"),
-                ("y", "f4"),
-                ("photons", "f4"),
-                ("sx", "f4"),
-                ("sy", "f4"),
-                ("bg", "f4"),
-                ("lpx", "f4"),
-                ("lpy", "f4"),
-                ("ellipticity", "f4"),
-                ("net_gradient", "f4"),
-                ("n_id", "u4"),
-            ],
-        )
-        locs.sort(kind="mergesort", order="n_id")
-    else:
-        locs = _np.rec.array(
-            (
-                identifications.frame,
-                x,
-                y,
-                theta[:, 2],
-                theta[:, 4],
-                theta[:, 5],
-                theta[:, 3],
-                lpx,
-                lpy,
-                ellipticity,
-                identifications.net_gradient,
-            ),
-            dtype=[
-                ("frame", "u4"),
-                ("x", "f4"),
-                ("y", "f4"),
-                ("photons", "f4"),
-                ("sx", "f4"),
-                ("sy", "f4"),
-                ("bg", "f4"),
-                ("lpx", "f4"),
-                ("lpy", "f4"),
-                ("ellipticity", "f4"),
-                ("net_gradient", "f4"),
-            ],
-        )
-        locs.sort(kind="mergesort", order="frame")
-    return locs
+        dtype = dtype + [("n_id", "u4")]
+    return _lib.build_locs(
+        identifications,
+        dtype,
+        theta[:, 0],
+        theta[:, 1],
+        em=em,
+        photons=theta[:, 2],
+        sx=theta[:, 4],
+        sy=theta[:, 5],
+        bg=theta[:, 3],
+    )
 
 
 def locs_from_fits_gpufit(identifications, theta, box, em):
-    box_offset = int(box / 2)
-    x = theta[:, 1] + identifications.x - box_offset
-    y = theta[:, 2] + identifications.y - box_offset
-    lpx = _postprocess.localization_precision(
-        theta[:, 0], theta[:, 3], theta[:, 5], em=em
-    )
-    lpy = _postprocess.localization_precision(
-        theta[:, 0], theta[:, 4], theta[:, 5], em=em
-    )
-    a = _np.maximum(theta[:, 3], theta[:, 4])
-    b = _np.minimum(theta[:, 3], theta[:, 4])
-    ellipticity = (a - b) / a
-    locs = _np.rec.array(
-        (
-            identifications.frame,
-            x,
-            y,
-            theta[:, 0],
-            theta[:, 3],
-            theta[:, 4],
-            theta[:, 5],
-            lpx,
-            lpy,
-            ellipticity,
-            identifications.net_gradient,
-        ),
-        dtype=[
-            ("frame", "u4"),
-            ("x", "f4"),
-            ("y", "f4"),
-            ("photons", "f4"),
-            ("sx", "f4"),
-            ("sy", "f4"),
-            ("bg", "f4"),
-            ("lpx", "f4"),
-            ("lpy", "f4"),
-            ("ellipticity", "f4"),
-            ("net_gradient", "f4"),
-        ],
+    return _lib.build_locs(
+        identifications,
+        _lib.FIT_LOCS_DTYPE,
+        theta[:, 1],
+        theta[:, 2],
+        box_offset=int(box / 2),
+        em=em,
+        photons=theta[:, 0],
+        sx=theta[:, 3],
+        sy=theta[:, 4],
+        bg=theta[:, 5],
     )
-    locs.sort(kind="mergesort", order="frame")
-    return locs
@@ -14,12 +14,24 @@ import math as _math
 import multiprocessing as _multiprocessing
 import threading as _threading
 from concurrent import futures as _futures
+from . import gausslq as _gausslq
+from . import lib as _lib
 
 
 GAMMA = _np.array([1.0, 1.0, 0.5, 1.0, 1.0, 1.0])
-
-
-@_numba.jit(nopython=True, nogil=True)
+# Number of spots a worker claims and fits per kernel call
+MLE_BLOCK_SIZE = 64
+# Why the fit of a spot stopped, as indices of STOP_REASONS
+STOP_CONVERGED = 0
+STOP_MAX_ITERATIONS = 1
+STOP_DIVERGED = 2
+STOP_REJECTED = 3
+STOP_REASONS = ["converged", "max. iterations", "diverged", "rejected"]
+# Number of ROIs a worker claims and fits per call of the multi-emitter kernel
+MULTI_BLOCK_SIZE = 8
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _sum_and_center_of_mass(spot, size):
     x = 0.0
     y = 0.0
@@ -34,7 +46,7 @@ def _sum_and_center_of_mass(spot, size):
     return _sum_, y, x
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def mean_filter(spot, size):
     filtered_spot = _np.zeros_like(spot)
     for k in range(size):
@@ -52,7 +64,7 @@ def mean_filter(spot, size):
     return filtered_spot
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _initial_sigmas(spot, y, x, size):
     size_half = int(size / 2)
     sum_deviation_y = 0.0
@@ -78,7 +90,7 @@ def _initial_sigmas(spot, y, x, size):
     return sy, sx
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _initial_parameters(spot, size):
     sum, y, x = _sum_and_center_of_mass(spot, size)
     bg = _np.min(mean_filter(spot, size))
@@ -88,7 +100,7 @@ def _initial_parameters(spot, size):
     return x, y, photons_sane, bg, sx, sy
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _initial_theta_sigma(spot, size):
     theta = _np.zeros(5, dtype=_np.float32)
     theta[0], theta[1], theta[2], theta[3], sx, sy = _initial_parameters(spot, size)
@@ -96,7 +108,7 @@ def _initial_theta_sigma(spot, size):
     return theta
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _initial_theta_sigmaxy(spot, size):
     theta = _np.zeros(6, dtype=_np.float32)
     theta[0], theta[1], theta[2], theta[3], theta[4], theta[5] = _initial_parameters(
@@ -191,18 +203,23 @@ def _erf(x):
     return _np.sign(x)
 
 
-@_numba.jit(nopython=True, nogil=True, cache=False)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _gaussian_integral(x, mu, sigma):
     sq_norm = 0.70710678118654757 / sigma  # sq_norm = sqrt(0.5/sigma**2)
     d = x - mu
     return 0.5 * (_math.erf((d + 0.5) * sq_norm) - _math.erf((d - 0.5) * sq_norm))
 
 
-@_numba.jit(nopython=True, nogil=True, cache=False)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _derivative_gaussian_integral(x, mu, sigma, photons, PSFc):
     d = x - mu
     a = _np.exp(-0.5 * ((d + 0.5) / sigma) ** 2)
     b = _np.exp(-0.5 * ((d - 0.5) / sigma) ** 2)
+    return _derivative_from_exponentials(d, a, b, sigma, photons, PSFc)
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _derivative_from_exponentials(d, a, b, sigma, photons, PSFc):
     dudt = -photons * PSFc * (a - b) / (_np.sqrt(2.0 * _np.pi) * sigma)
     d2udt2 = (
         -photons
@@ -213,23 +230,25 @@ def _derivative_gaussian_integral(x, mu, sigma, photons, PSFc):
     return dudt, d2udt2
 
 
-@_numba.jit(nopython=True, nogil=True, cache=False)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _derivative_gaussian_integral_1d_sigma(x, mu, sigma, photons, PSFc):
-    ax = _np.exp(-0.5 * ((x + 0.5 - mu) / sigma) ** 2)
-    bx = _np.exp(-0.5 * ((x - 0.5 - mu) / sigma) ** 2)
-    dudt = (
-        -photons
-        * (ax * (x + 0.5 - mu) - bx * (x - 0.5 - mu))
-        * PSFc
-        / (_np.sqrt(2.0 * _np.pi) * sigma**2)
+    u = x + 0.5 - mu
+    v = x - 0.5 - mu
+    ax = _np.exp(-0.5 * (u / sigma) ** 2)
+    bx = _np.exp(-0.5 * (v / sigma) ** 2)
+    return _sigma_derivative_from_exponentials(u, v, ax, bx, sigma, photons, PSFc)
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _sigma_derivative_from_exponentials(u, v, ax, bx, sigma, photons, PSFc):
+    dudt = -photons * (ax * u - bx * v) * PSFc / (_np.sqrt(2.0 * _np.pi) * sigma**2)
+    d2udt2 = -2.0 * dudt / sigma - photons * (ax * u**3 - bx * v**3) * PSFc / (
+        _np.sqrt(2.0 * _np.pi) * sigma**5
     )
-    d2udt2 = -2.0 * dudt / sigma - photons * (
-        ax * (x + 0.5 - mu) ** 3 - bx * (x - 0.5 - mu) ** 3
-    ) * PSFc / (_np.sqrt(2.0 * _np.pi) * sigma**5)
     return dudt, d2udt2
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _derivative_gaussian_integral_2d_sigma(x, y, mu, nu, sigma, photons, PSFx, PSFy):
     dSx, ddSx = _derivative_gaussian_integral_1d_sigma(x, mu, sigma, photons, PSFy)
     dSy, ddSy = _derivative_gaussian_integral_1d_sigma(y, nu, sigma, photons, PSFx)
@@ -238,203 +257,642 @@ def _derivative_gaussian_integral_2d_sigma(x, y, mu, nu, sigma, photons, PSFx, P
     return dudt, d2udt2
 
 
-def _worker(
-    func,
-    spots,
-    thetas,
-    CRLBs,
-    likelihoods,
-    iterations,
-    eps,
-    max_it,
-    current,
-    lock,
-):
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _fill_integral_terms(terms, s, mu, sigma):
+    """The integrated Gaussian and the exponentials of its derivatives only
+    depend on one pixel coordinate. They are evaluated once per row (or
+    column) of spot s, with the same expressions as the per-pixel helpers."""
+    for i in range(terms.shape[1]):
+        terms[0, i, s] = _gaussian_integral(i, mu, sigma)
+        d = i - mu
+        terms[1, i, s] = d
+        terms[2, i, s] = _np.exp(-0.5 * ((d + 0.5) / sigma) ** 2)
+        terms[3, i, s] = _np.exp(-0.5 * ((d - 0.5) / sigma) ** 2)
+        u = i + 0.5 - mu
+        v = i - 0.5 - mu
+        terms[4, i, s] = u
+        terms[5, i, s] = v
+        terms[6, i, s] = _np.exp(-0.5 * (u / sigma) ** 2)
+        terms[7, i, s] = _np.exp(-0.5 * (v / sigma) ** 2)
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _position_derivative(terms, i, s, sigma, photons, PSFc):
+    return _derivative_from_exponentials(
+        terms[1, i, s], terms[2, i, s], terms[3, i, s], sigma, photons, PSFc
+    )
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _sigma_derivative(terms, i, s, sigma, photons, PSFc):
+    return _sigma_derivative_from_exponentials(
+        terms[4, i, s],
+        terms[5, i, s],
+        terms[6, i, s],
+        terms[7, i, s],
+        sigma,
+        photons,
+        PSFc,
+    )
+
+
+def _worker(func, spots, args, current, lock, block_size):
+    """Claims blocks of spots until all are fit. current[1] counts the
+    claimed spots, current[0] the fitted ones."""
     N = len(spots)
     while True:
         with lock:
-            index = current[0]
-            if index == N:
+            start = current[1]
+            if start == N:
                 return
-            current[0] += 1
-        func(spots, index, thetas, CRLBs, likelihoods, iterations, eps, max_it)
+            stop = min(start + block_size, N)
+            current[1] = stop
+        func(spots, start, stop, *args)
+        with lock:
+            current[0] += stop - start
 
 
-def gaussmle(spots, eps, max_it, method="sigma"):
-    N = len(spots)
-    thetas = _np.zeros((N, 6), dtype=_np.float32)
-    CRLBs = _np.inf * _np.ones((N, 6), dtype=_np.float32)
-    likelihoods = _np.zeros(N, dtype=_np.float32)
-    iterations = _np.zeros(N, dtype=_np.int32)
+def _fit_function(method):
     if method == "sigma":
-        func = _mlefit_sigma
+        return _mlefit_sigma
     elif method == "sigmaxy":
-        func = _mlefit_sigmaxy
+        return _mlefit_sigmaxy
     else:
         raise ValueError("Method not available.")
-    for i in range(N):
-        func(spots, i, thetas, CRLBs, likelihoods, iterations, eps, max_it)
-    return thetas, CRLBs, likelihoods, iterations
 
 
-def gaussmle_async(spots, eps, max_it, method="sigma"):
-    N = len(spots)
+def _empty_fits(N):
     thetas = _np.zeros((N, 6), dtype=_np.float32)
     CRLBs = _np.inf * _np.ones((N, 6), dtype=_np.float32)
     likelihoods = _np.zeros(N, dtype=_np.float32)
     iterations = _np.zeros(N, dtype=_np.int32)
+    stop_reasons = _np.zeros(N, dtype=_np.uint8)
+    return thetas, CRLBs, likelihoods, iterations, stop_reasons
+
+
+def rejection_limits(
+    min_sigma=0.0,
+    max_sigma=_np.inf,
+    min_photons=0.0,
+    max_llr=_np.inf,
+    unconverged=False,
+):
+    """
+    Limits for rejecting fits in the MLE kernels. A fit is rejected if its
+    parameters or CRLBs are not finite, a width is outside of [min_sigma,
+    max_sigma] pixels, it has less than min_photons photons, its
+    log-likelihood ratio -2 ln(L(fit) / L(data)) per pixel exceeds max_llr
+    or, with unconverged, if it stopped at the max. iterations or diverged.
+    """
+    return _np.array(
+        [min_sigma, max_sigma, min_photons, max_llr, unconverged], dtype=_np.float64
+    )
+
+
+def _rejection_args(rejection):
+    if rejection is None:
+        return _np.empty(0, dtype=_np.float64)
+    return _np.asarray(rejection, dtype=_np.float64)
+
+
+def _kernel_args(
+    spots, fits, initial_thetas, variances, eps, max_it, check_divergence, rejection
+):
+    if initial_thetas is None:
+        initial_thetas = _np.empty((0, 6), dtype=_np.float32)
+    else:
+        initial_thetas = _np.ascontiguousarray(initial_thetas, dtype=_np.float32)
+    if variances is None:
+        variances = _np.empty((0,) + spots.shape[1:], dtype=_np.float32)
+    else:
+        variances = _np.ascontiguousarray(variances, dtype=_np.float32)
+    return (
+        *fits,
+        initial_thetas,
+        variances,
+        eps,
+        max_it,
+        check_divergence,
+        _rejection_args(rejection),
+    )
+
+
+def gaussmle(
+    spots,
+    eps,
+    max_it,
+    method="sigma",
+    block_size=None,
+    initial_thetas=None,
+    variances=None,
+    check_divergence=True,
+    return_stop_reasons=False,
+    rejection=None,
+):
+    """
+    Fits spots by maximum likelihood. Fits start from the finite values of
+    initial_thetas, if given, and otherwise from the center of mass and
+    width of each spot. Fits that leave the box are stopped as diverged
+    unless check_divergence is False. With return_stop_reasons, the STOP_*
+    reason of each spot is returned in addition.
+    For sCMOS cameras, variances holds the readout variance of each spot
+    pixel in photons^2 (see localize.get_spots_and_variances).
+    Fits that fail the rejection_limits in rejection are marked with
+    STOP_REJECTED.
+    """
+    N = len(spots)
+    fits = _empty_fits(N)
+    func = _fit_function(method)
+    args = _kernel_args(
+        spots,
+        fits,
+        initial_thetas,
+        variances,
+        eps,
+        max_it,
+        check_divergence,
+        rejection,
+    )
+    if block_size is None:
+        block_size = MLE_BLOCK_SIZE
+    for start in range(0, N, block_size):
+        func(spots, start, min(start + block_size, N), *args)
+    return fits if return_stop_reasons else fits[:4]
+
+
+def gaussmle_async(
+    spots,
+    eps,
+    max_it,
+    method="sigma",
+    block_size=None,
+    initial_thetas=None,
+    variances=None,
+    check_divergence=True,
+    return_stop_reasons=False,
+    rejection=None,
+):
+    N = len(spots)
+    fits = _empty_fits(N)
     n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
     lock = _threading.Lock()
-    current = [0]
-    if method == "sigma":
-        func = _mlefit_sigma
-    elif method == "sigmaxy":
-        func = _mlefit_sigmaxy
-    else:
-        raise ValueError("Method not available.")
+    current = [0, 0]
+    func = _fit_function(method)
+    args = _kernel_args(
+        spots,
+        fits,
+        initial_thetas,
+        variances,
+        eps,
+        max_it,
+        check_divergence,
+        rejection,
+    )
+    if block_size is None:
+        block_size = MLE_BLOCK_SIZE
     executor = _futures.ThreadPoolExecutor(n_workers)
     for i in range(n_workers):
-        executor.submit(
-            _worker,
-            func,
-            spots,
-            thetas,
-            CRLBs,
-            likelihoods,
-            iterations,
-            eps,
-            max_it,
-            current,
-            lock,
-        )
+        executor.submit(_worker, func, spots, args, current, lock, block_size)
     executor.shutdown(wait=False)
     # A synchronous single-threaded version for debugging:
-    # for i in range(N):
-    #     print('Spot', i)
-    #     func(spots, i, thetas, CRLBs, likelihoods, iterations, eps, max_it)
-    return current, thetas, CRLBs, likelihoods, iterations
+    # func(spots, 0, N, *args)
+    if return_stop_reasons:
+        return (current, *fits)
+    return (current, *fits[:4])
 
 
-@_numba.jit(nopython=True, nogil=True)
-def _mlefit_sigma(spots, index, thetas, CRLBs, likelihoods, iterations, eps, max_it):
-    n_params = 5
+def gaussmle_parallel(
+    spots,
+    eps,
+    max_it,
+    method="sigma",
+    executor=None,
+    n_workers=None,
+    block_size=None,
+    initial_thetas=None,
+    variances=None,
+    check_divergence=True,
+    return_stop_reasons=False,
+    rejection=None,
+):
+    """Multi-threaded version of gaussmle that blocks until all spots are fit.
+    A thread pool can be passed to reuse its workers across calls."""
+    N = len(spots)
+    fits = _empty_fits(N)
+    func = _fit_function(method)
+    args = _kernel_args(
+        spots,
+        fits,
+        initial_thetas,
+        variances,
+        eps,
+        max_it,
+        check_divergence,
+        rejection,
+    )
+    if block_size is None:
+        block_size = MLE_BLOCK_SIZE
+    _run_workers(func, spots, args, executor, n_workers, block_size)
+    return fits if return_stop_reasons else fits[:4]
+
+
+def _run_workers(func, spots, args, executor, n_workers, block_size):
+    """Runs n_workers _worker threads and blocks until all spots are fit"""
+    if n_workers is None:
+        n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
+    if executor is None:
+        pool = _futures.ThreadPoolExecutor(n_workers)
+    else:
+        pool = executor
+    lock = _threading.Lock()
+    current = [0, 0]
+    fs = [
+        pool.submit(_worker, func, spots, args, current, lock, block_size)
+        for _ in range(n_workers)
+    ]
+    for f in fs:
+        f.result()
+    if executor is None:
+        pool.shutdown()
+
+
+def gaussmle_multi(
+    rois,
+    initial_positions,
+    n_initial,
+    eps,
+    max_it,
+    initial_sigma=1.0,
+    variances=None,
+    executor=None,
+    n_workers=None,
+    block_size=None,
+    rejection=None,
+):
+    """
+    Jointly fits overlapping emitters in each ROI with a common background
+    and width. For ROI i, 1 to n_initial[i] emitters are fit, starting at
+    the first initial_positions[i] (row, column), and the number of emitters
+    is selected by the Bayesian information criterion. Returns thetas and
+    CRLBs of shape (N, max. emitters, 6) in the layout of gaussmle, the
+    log-likelihoods, the iterations of all fits of a ROI, the selected
+    numbers of emitters and the STOP_* reasons of each emitter, which
+    include STOP_REJECTED for emitters that fail the rejection_limits in
+    rejection. ROIs are fit in blocks on threads like in gaussmle_parallel.
+    """
+    N, max_emitters = initial_positions.shape[:2]
+    thetas = _np.zeros((N, max_emitters, 6), dtype=_np.float32)
+    CRLBs = _np.inf * _np.ones((N, max_emitters, 6), dtype=_np.float32)
+    likelihoods = _np.zeros(N, dtype=_np.float32)
+    iterations = _np.zeros(N, dtype=_np.int32)
+    n_emitters = _np.zeros(N, dtype=_np.int32)
+    stop_reasons = _np.zeros((N, max_emitters), dtype=_np.uint8)
+    if variances is None:
+        variances = _np.empty((0,) + rois.shape[1:], dtype=_np.float32)
+    args = (
+        thetas,
+        CRLBs,
+        likelihoods,
+        iterations,
+        n_emitters,
+        stop_reasons,
+        _np.ascontiguousarray(initial_positions, dtype=_np.float32),
+        _np.ascontiguousarray(n_initial, dtype=_np.int32),
+        _np.ascontiguousarray(variances, dtype=_np.float32),
+        float(initial_sigma),
+        eps,
+        max_it,
+        _rejection_args(rejection),
+    )
+    if block_size is None:
+        block_size = MULTI_BLOCK_SIZE
+    _run_workers(_mlefit_multi, rois, args, executor, n_workers, block_size)
+    return thetas, CRLBs, likelihoods, iterations, n_emitters, stop_reasons
+
+
+def initial_thetas_from_lq(theta_lq, box):
+    """Converts gausslq fits to initial MLE parameters, e.g. to warm-start
+    the MLE fits of the same spots"""
+    box_half = int(box / 2)
+    initial_thetas = _np.empty((len(theta_lq), 6), dtype=_np.float32)
+    initial_thetas[:, 0] = theta_lq[:, 1] + box_half
+    initial_thetas[:, 1] = theta_lq[:, 0] + box_half
+    initial_thetas[:, 2:4] = theta_lq[:, 2:4]
+    initial_thetas[:, 4] = theta_lq[:, 5]
+    initial_thetas[:, 5] = theta_lq[:, 4]
+    return initial_thetas
+
+
+class IterationHistogram:
+    """Counts fitted spots by number of iterations and stop reason"""
+
+    def __init__(self, max_it):
+        self.counts = _np.zeros((len(STOP_REASONS), max_it + 1), dtype=_np.int64)
+
+    def add(self, iterations, stop_reasons):
+        _np.add.at(self.counts, (stop_reasons, iterations), 1)
+
+    def percentile(self, q):
+        cumulative = _np.cumsum(self.counts.sum(axis=0))
+        return int(_np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+
+    def summary(self):
+        n_spots = self.counts.sum(axis=1)
+        if n_spots.sum() == 0:
+            return "No spots fitted."
+        reasons = ", ".join(
+            "{:,} {}".format(n, reason) for n, reason in zip(n_spots, STOP_REASONS)
+        )
+        return "Fits: {}. Iterations: median {}, 99th percentile {}.".format(
+            reasons, self.percentile(50), self.percentile(99)
+        )
 
-    spot = spots[index]
-    size, _ = spot.shape
 
-    # theta is [x, y, N, bg, S]
-    theta = _initial_theta_sigma(spot, size)
-    max_step = _np.zeros(n_params, dtype=_np.float32)
-    max_step[0:2] = theta[4]
-    max_step[2:4] = 0.1 * theta[2:4]
-    max_step[4] = 0.2 * theta[4]
-
-    # Memory allocation
-    # (we do that outside of the loops to avoid huge delays in threaded code):
-    dudt = _np.zeros(n_params, dtype=_np.float32)
-    d2udt2 = _np.zeros(n_params, dtype=_np.float32)
-    numerator = _np.zeros(n_params, dtype=_np.float32)
-    denominator = _np.zeros(n_params, dtype=_np.float32)
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _warm_start(theta, s, initial_theta, size):
+    """Replaces the initial parameters of spot s by the finite values of
+    initial_theta. Positions outside of the box and widths outside of
+    (0, size] are ignored."""
+    y, x, photons, bg, sy, sx = initial_theta
+    if -0.5 <= y <= size - 0.5 and -0.5 <= x <= size - 0.5:
+        theta[0, s] = y
+        theta[1, s] = x
+    if _np.isfinite(photons):
+        theta[2, s] = max(photons, 1.0)
+    if _np.isfinite(bg):
+        theta[3, s] = max(bg, 0.01)
+    if 0.0 < sy <= size and 0.0 < sx <= size:
+        if theta.shape[0] == 5:
+            theta[4, s] = 0.5 * (sy + sx)
+        else:
+            theta[4, s] = sy
+            theta[5, s] = sx
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _diverged(theta, s, size):
+    """A fit diverged if a parameter is not finite, if its position left
+    the box by more than one pixel or if its PSF got as wide as the box"""
+    for ll in range(theta.shape[0]):
+        if not _np.isfinite(theta[ll, s]):
+            return True
+    for ll in range(4, theta.shape[0]):
+        if theta[ll, s] >= size:
+            return True
+    return (
+        theta[0, s] < -1.0
+        or theta[0, s] > size
+        or theta[1, s] < -1.0
+        or theta[1, s] > size
+    )
 
-    old_x = theta[0]
-    old_y = theta[1]
 
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _rejected(theta, CRLB, likelihood, stop_reason, n_pixels, limits):
+    """Whether a fit fails the rejection_limits"""
+    for i in range(6):
+        if not (_np.isfinite(theta[i]) and _np.isfinite(CRLB[i])):
+            return True
+    for i in range(4, 6):
+        if theta[i] < limits[0] or theta[i] > limits[1]:
+            return True
+    if theta[2] < limits[2]:
+        return True
+    if -2 * likelihood / n_pixels > limits[3]:
+        return True
+    return limits[4] > 0 and stop_reason != STOP_CONVERGED
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _spot_variance(variances, index):
+    """The variance map of a spot, empty without sCMOS variances"""
+    if len(variances) > 0:
+        return variances[index]
+    return variances[0:0, 0, 0:0]
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _drop_finished(finished, n_active, slots, theta, max_step, old_theta):
+    """Moves the state of unfinished spots to the front of the block"""
+    n = 0
+    for s in range(n_active):
+        if not finished[s]:
+            if n != s:
+                slots[n] = slots[s]
+                theta[:, n] = theta[:, s]
+                max_step[:, n] = max_step[:, s]
+                old_theta[:, n] = old_theta[:, s]
+            n += 1
+    return n
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _mlefit_sigma(
+    spots,
+    start,
+    stop,
+    thetas,
+    CRLBs,
+    likelihoods,
+    iterations,
+    stop_reasons,
+    initial_thetas,
+    variances,
+    eps,
+    max_it,
+    check_divergence,
+    limits,
+):
+    n_params = 5
+    n_spots = stop - start
+    size = spots.shape[1]
+
+    # The fit state of the block is laid out with spots along the last axis,
+    # so that the inner loops run over contiguous memory of all active spots.
+    # theta is [x, y, N, bg, S]
+    theta = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    max_step = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    for s in range(n_spots):
+        theta[:, s] = _initial_theta_sigma(spots[start + s], size)
+        if len(initial_thetas):
+            _warm_start(theta, s, initial_thetas[start + s], size)
+        max_step[0:2, s] = theta[4, s]
+        max_step[2:4, s] = 0.1 * theta[2:4, s]
+        max_step[4, s] = 0.2 * theta[4, s]
+    old_theta = theta.copy()
+    slots = _np.arange(start, stop)
+    finished = _np.zeros(n_spots, dtype=_np.bool_)
+
+    dudt = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    d2udt2 = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    numerator = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    denominator = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    x_terms = _np.zeros((8, size, n_spots))
+    y_terms = _np.zeros((8, size, n_spots))
+
+    scmos = len(variances) > 0
+    n_active = n_spots
     kk = 0
-    while (
-        kk < max_it
-    ):  # we do this instead of a for loop for the special case of max_it=0
+    while kk < max_it and n_active > 0:
         kk += 1
 
-        numerator[:] = 0.0
-        denominator[:] = 0.0
+        numerator[:, :n_active] = 0.0
+        denominator[:, :n_active] = 0.0
+
+        for s in range(n_active):
+            _fill_integral_terms(x_terms, s, theta[0, s], theta[4, s])
+            _fill_integral_terms(y_terms, s, theta[1, s], theta[4, s])
 
         for ii in range(size):
             for jj in range(size):
-                PSFx = _gaussian_integral(ii, theta[0], theta[4])
-                PSFy = _gaussian_integral(jj, theta[1], theta[4])
+                for s in range(n_active):
+                    PSFx = x_terms[0, ii, s]
+                    PSFy = y_terms[0, jj, s]
 
-                # Derivatives
-                dudt[0], d2udt2[0] = _derivative_gaussian_integral(
-                    ii, theta[0], theta[4], theta[2], PSFy
-                )
-                dudt[1], d2udt2[1] = _derivative_gaussian_integral(
-                    jj, theta[1], theta[4], theta[2], PSFx
-                )
-                dudt[2] = PSFx * PSFy
-                d2udt2[2] = 0.0
-                dudt[3] = 1.0
-                d2udt2[3] = 0.0
-                dudt[4], d2udt2[4] = _derivative_gaussian_integral_2d_sigma(
-                    ii, jj, theta[0], theta[1], theta[4], theta[2], PSFx, PSFy
-                )
+                    # Derivatives
+                    dudt[0, s], d2udt2[0, s] = _position_derivative(
+                        x_terms, ii, s, theta[4, s], theta[2, s], PSFy
+                    )
+                    dudt[1, s], d2udt2[1, s] = _position_derivative(
+                        y_terms, jj, s, theta[4, s], theta[2, s], PSFx
+                    )
+                    dudt[2, s] = PSFx * PSFy
+                    d2udt2[2, s] = 0.0
+                    dudt[3, s] = 1.0
+                    d2udt2[3, s] = 0.0
+                    dSx, ddSx = _sigma_derivative(
+                        x_terms, ii, s, theta[4, s], theta[2, s], PSFy
+                    )
+                    dSy, ddSy = _sigma_derivative(
+                        y_terms, jj, s, theta[4, s], theta[2, s], PSFx
+                    )
+                    dudt[4, s] = dSx + dSy
+                    d2udt2[4, s] = ddSx + ddSy
+
+                    model = theta[2, s] * dudt[2, s] + theta[3, s]
+                    cf = df = 0.0
+                    data = spots[slots[s], ii, jj]
+                    if scmos:
+                        model += variances[slots[s], ii, jj]
+                        data += variances[slots[s], ii, jj]
+                    if model > 10e-3:
+                        cf = data / model - 1
+                        df = data / model**2
+                    cf = _np.minimum(cf, 10e4)
+                    df = _np.minimum(df, 10e4)
+
+                    for ll in range(n_params):
+                        numerator[ll, s] += cf * dudt[ll, s]
+                        denominator[ll, s] += (
+                            cf * d2udt2[ll, s] - df * dudt[ll, s] ** 2
+                        )
 
-                model = theta[2] * dudt[2] + theta[3]
-                cf = df = 0.0
-                data = spot[ii, jj]
-                if model > 10e-3:
-                    cf = data / model - 1
-                    df = data / model**2
-                cf = _np.minimum(cf, 10e4)
-                df = _np.minimum(df, 10e4)
-
-                for ll in range(n_params):
-                    numerator[ll] += cf * dudt[ll]
-                    denominator[ll] += cf * d2udt2[ll] - df * dudt[ll] ** 2
-
-        # The update
-        for ll in range(n_params):
-            if denominator[ll] == 0.0:
-                update = _np.sign(numerator[ll] * max_step[ll])
+        for s in range(n_active):
+            # The update
+            for ll in range(n_params):
+                if denominator[ll, s] == 0.0:
+                    update = _np.sign(numerator[ll, s] * max_step[ll, s])
+                else:
+                    update = _np.minimum(
+                        _np.maximum(
+                            numerator[ll, s] / denominator[ll, s], -max_step[ll, s]
+                        ),
+                        max_step[ll, s],
+                    )
+                if kk < 5:
+                    update *= GAMMA[ll]
+                theta[ll, s] -= update
+
+            # Other constraints
+            theta[2, s] = _np.maximum(theta[2, s], 1.0)
+            theta[3, s] = _np.maximum(theta[3, s], 0.01)
+            theta[4, s] = _np.maximum(theta[4, s], 0.01)
+            theta[4, s] = _np.minimum(theta[4, s], size)
+
+            # Check for convergence and divergence
+            finished[s] = True
+            if (_np.abs(old_theta[0, s] - theta[0, s]) < eps) and (
+                _np.abs(old_theta[1, s] - theta[1, s]) < eps
+            ):
+                stop_reasons[slots[s]] = STOP_CONVERGED
+            elif check_divergence and _diverged(theta, s, size):
+                stop_reasons[slots[s]] = STOP_DIVERGED
             else:
-                update = _np.minimum(
-                    _np.maximum(numerator[ll] / denominator[ll], -max_step[ll]),
-                    max_step[ll],
-                )
-            if kk < 5:
-                update *= GAMMA[ll]
-            theta[ll] -= update
-
-        # Other constraints
-        theta[2] = _np.maximum(theta[2], 1.0)
-        theta[3] = _np.maximum(theta[3], 0.01)
-        theta[4] = _np.maximum(theta[4], 0.01)
-        theta[4] = _np.minimum(theta[4], size)
-
-        # Check for convergence
-        if (_np.abs(old_x - theta[0]) < eps) and (_np.abs(old_y - theta[1]) < eps):
-            break
-        else:
-            old_x = theta[0]
-            old_y = theta[1]
+                finished[s] = False
+                old_theta[0, s] = theta[0, s]
+                old_theta[1, s] = theta[1, s]
+            if finished[s]:
+                thetas[slots[s], 0:5] = theta[:, s]
+                thetas[slots[s], 5] = theta[4, s]
+                iterations[slots[s]] = kk
+        n_active = _drop_finished(
+            finished, n_active, slots, theta, max_step, old_theta
+        )
 
-    thetas[index, 0:5] = theta
-    thetas[index, 5] = theta[4]
-    iterations[index] = kk
+    for s in range(n_active):
+        thetas[slots[s], 0:5] = theta[:, s]
+        thetas[slots[s], 5] = theta[4, s]
+        iterations[slots[s]] = kk
+        stop_reasons[slots[s]] = STOP_MAX_ITERATIONS
+
+    for index in range(start, stop):
+        CRLB, likelihoods[index] = _crlb_and_likelihood_sigma(
+            spots[index], _spot_variance(variances, index), thetas[index, 0:5], size
+        )
+        CRLBs[index, 0:5] = CRLB
+        CRLBs[index, 5] = CRLB[4]
+        if len(limits) and _rejected(
+            thetas[index],
+            CRLBs[index],
+            likelihoods[index],
+            stop_reasons[index],
+            size * size,
+            limits,
+        ):
+            stop_reasons[index] = STOP_REJECTED
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _crlb_and_likelihood_sigma(spot, variance, theta, size):
+    n_params = 5
+    dudt = _np.zeros(n_params, dtype=_np.float32)
+    d2udt2 = _np.zeros(n_params, dtype=_np.float32)
+    x_terms = _np.zeros((8, size, 1))
+    y_terms = _np.zeros((8, size, 1))
+    _fill_integral_terms(x_terms, 0, theta[0], theta[4])
+    _fill_integral_terms(y_terms, 0, theta[1], theta[4])
 
     # Calculating the CRLB and LogLikelihood
+    # With sCMOS variances, data and model are shifted by the readout variance
+    # (in photons^2) of each pixel, which approximates the readout noise by
+    # Poisson noise (Huang et al., Nat. Methods 2013)
+    scmos = len(variance) > 0
     Div = 0.0
     M = _np.zeros((n_params, n_params), dtype=_np.float32)
     for ii in range(size):
         for jj in range(size):
-            PSFx = _gaussian_integral(ii, theta[0], theta[4])
-            PSFy = _gaussian_integral(jj, theta[1], theta[4])
+            PSFx = x_terms[0, ii, 0]
+            PSFy = y_terms[0, jj, 0]
             model = theta[3] + theta[2] * PSFx * PSFy
 
             # Calculating derivatives
-            dudt[0], d2udt2[0] = _derivative_gaussian_integral(
-                ii, theta[0], theta[4], theta[2], PSFy
+            dudt[0], d2udt2[0] = _position_derivative(
+                x_terms, ii, 0, theta[4], theta[2], PSFy
             )
-            dudt[1], d2udt2[1] = _derivative_gaussian_integral(
-                jj, theta[1], theta[4], theta[2], PSFx
-            )
-            dudt[4], d2udt2[4] = _derivative_gaussian_integral_2d_sigma(
-                ii, jj, theta[0], theta[1], theta[4], theta[2], PSFx, PSFy
+            dudt[1], d2udt2[1] = _position_derivative(
+                y_terms, jj, 0, theta[4], theta[2], PSFx
             )
+            dSx, ddSx = _sigma_derivative(x_terms, ii, 0, theta[4], theta[2], PSFy)
+            dSy, ddSy = _sigma_derivative(y_terms, jj, 0, theta[4], theta[2], PSFx)
+            dudt[4] = dSx + dSy
+            d2udt2[4] = ddSx + ddSy
             dudt[2] = PSFx * PSFy
             dudt[3] = 1.0
 
             # Building the Fisher Information Matrix
             model = theta[3] + theta[2] * dudt[2]
+            if scmos:
+                model += variance[ii, jj]
             for kk in range(n_params):
                 for ll in range(kk, n_params):
                     M[kk, ll] += dudt[ll] * dudt[kk] / model
@@ -443,152 +901,227 @@ def _mlefit_sigma(spots, index, thetas, CRLBs, likelihoods, iterations, eps, max
             # LogLikelihood
             if model > 0:
                 data = spot[ii, jj]
+                if scmos:
+                    data += variance[ii, jj]
                 if data > 0:
                     Div += data * _np.log(model) - model - data * _np.log(data) + data
                 else:
                     Div += -model
 
-    likelihoods[index] = Div
-
     # Matrix inverse (CRLB=F^-1)
     Minv = _np.linalg.pinv(M)
     CRLB = _np.zeros(n_params, dtype=_np.float32)
     for kk in range(n_params):
         CRLB[kk] = Minv[kk, kk]
-    CRLBs[index, 0:5] = CRLB
-    CRLBs[index, 5] = CRLB[4]
+    return CRLB, Div
 
 
-@_numba.jit(nopython=True, nogil=True)
-def _mlefit_sigmaxy(spots, index, thetas, CRLBs, likelihoods, iterations, eps, max_it):
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _mlefit_sigmaxy(
+    spots,
+    start,
+    stop,
+    thetas,
+    CRLBs,
+    likelihoods,
+    iterations,
+    stop_reasons,
+    initial_thetas,
+    variances,
+    eps,
+    max_it,
+    check_divergence,
+    limits,
+):
     n_params = 6
+    n_spots = stop - start
+    size = spots.shape[1]
 
-    spot = spots[index]
-    size, _ = spot.shape
-
-    # Initial values
+    # Initial values, laid out with spots along the last axis as in
+    # _mlefit_sigma
     # theta is [x, y, N, bg, Sx, Sy]
-    theta = _initial_theta_sigmaxy(spot, size)
-    max_step = _np.zeros(n_params, dtype=_np.float32)
-    max_step[0:2] = theta[4]
-    max_step[2:4] = 0.1 * theta[2:4]
-    max_step[4:6] = 0.2 * theta[4:6]
-
-    # Memory allocation
-    # (we do that outside of the loops to avoid huge delays in threaded code):
-    dudt = _np.zeros(n_params, dtype=_np.float32)
-    d2udt2 = _np.zeros(n_params, dtype=_np.float32)
-    numerator = _np.zeros(n_params, dtype=_np.float32)
-    denominator = _np.zeros(n_params, dtype=_np.float32)
-
-    old_x = theta[0]
-    old_y = theta[1]
-    old_sx = theta[4]
-    old_sy = theta[5]
-
+    theta = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    max_step = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    for s in range(n_spots):
+        theta[:, s] = _initial_theta_sigmaxy(spots[start + s], size)
+        if len(initial_thetas):
+            _warm_start(theta, s, initial_thetas[start + s], size)
+        max_step[0:2, s] = theta[4, s]
+        max_step[2:4, s] = 0.1 * theta[2:4, s]
+        max_step[4:6, s] = 0.2 * theta[4:6, s]
+    old_theta = theta.copy()
+    slots = _np.arange(start, stop)
+    finished = _np.zeros(n_spots, dtype=_np.bool_)
+
+    dudt = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    d2udt2 = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    numerator = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    denominator = _np.zeros((n_params, n_spots), dtype=_np.float32)
+    x_terms = _np.zeros((8, size, n_spots))
+    y_terms = _np.zeros((8, size, n_spots))
+
+    scmos = len(variances) > 0
+    n_active = n_spots
     kk = 0
-    while (
-        kk < max_it
-    ):  # we do this instead of a for loop for the special case of max_it=0
+    while kk < max_it and n_active > 0:
         kk += 1
 
-        numerator[:] = 0.0
-        denominator[:] = 0.0
+        numerator[:, :n_active] = 0.0
+        denominator[:, :n_active] = 0.0
+
+        for s in range(n_active):
+            _fill_integral_terms(x_terms, s, theta[0, s], theta[4, s])
+            _fill_integral_terms(y_terms, s, theta[1, s], theta[5, s])
 
         for ii in range(size):
             for jj in range(size):
-                PSFx = _gaussian_integral(ii, theta[0], theta[4])
-                PSFy = _gaussian_integral(jj, theta[1], theta[5])
-                # Derivatives
-                dudt[0], d2udt2[0] = _derivative_gaussian_integral(
-                    ii, theta[0], theta[4], theta[2], PSFy
-                )
-                dudt[1], d2udt2[1] = _derivative_gaussian_integral(
-                    jj, theta[1], theta[5], theta[2], PSFx
-                )
-                dudt[2] = PSFx * PSFy
-                d2udt2[2] = 0.0
-                dudt[3] = 1.0
-                d2udt2[3] = 0.0
-                dudt[4], d2udt2[4] = _derivative_gaussian_integral_1d_sigma(
-                    ii, theta[0], theta[4], theta[2], PSFy
-                )
-                dudt[5], d2udt2[5] = _derivative_gaussian_integral_1d_sigma(
-                    jj, theta[1], theta[5], theta[2], PSFx
-                )
+                for s in range(n_active):
+                    PSFx = x_terms[0, ii, s]
+                    PSFy = y_terms[0, jj, s]
+                    # Derivatives
+                    dudt[0, s], d2udt2[0, s] = _position_derivative(
+                        x_terms, ii, s, theta[4, s], theta[2, s], PSFy
+                    )
+                    dudt[1, s], d2udt2[1, s] = _position_derivative(
+                        y_terms, jj, s, theta[5, s], theta[2, s], PSFx
+                    )
+                    dudt[2, s] = PSFx * PSFy
+                    d2udt2[2, s] = 0.0
+                    dudt[3, s] = 1.0
+                    d2udt2[3, s] = 0.0
+                    dudt[4, s], d2udt2[4, s] = _sigma_derivative(
+                        x_terms, ii, s, theta[4, s], theta[2, s], PSFy
+                    )
+                    dudt[5, s], d2udt2[5, s] = _sigma_derivative(
+                        y_terms, jj, s, theta[5, s], theta[2, s], PSFx
+                    )
 
-                model = theta[2] * dudt[2] + theta[3]
-                cf = df = 0.0
-                data = spot[ii, jj]
-                if model > 10e-3:
-                    cf = data / model - 1
-                    df = data / model**2
-                cf = _np.minimum(cf, 10e4)
-                df = _np.minimum(df, 10e4)
-
-                for ll in range(n_params):
-                    numerator[ll] += cf * dudt[ll]
-                    denominator[ll] += cf * d2udt2[ll] - df * dudt[ll] ** 2
-
-        # The update
-        for ll in range(n_params):
-            if denominator[ll] == 0.0:
-                # This is case is not handled in Lidke's code
-                # but it seems to be a problem here
-                # (maybe due to many iterations)
-                theta[ll] -= GAMMA[ll] * _np.sign(numerator[ll]) * max_step[ll]
+                    model = theta[2, s] * dudt[2, s] + theta[3, s]
+                    cf = df = 0.0
+                    data = spots[slots[s], ii, jj]
+                    if scmos:
+                        model += variances[slots[s], ii, jj]
+                        data += variances[slots[s], ii, jj]
+                    if model > 10e-3:
+                        cf = data / model - 1
+                        df = data / model**2
+                    cf = _np.minimum(cf, 10e4)
+                    df = _np.minimum(df, 10e4)
+
+                    for ll in range(n_params):
+                        numerator[ll, s] += cf * dudt[ll, s]
+                        denominator[ll, s] += (
+                            cf * d2udt2[ll, s] - df * dudt[ll, s] ** 2
+                        )
+
+        for s in range(n_active):
+            # The update
+            for ll in range(n_params):
+                if denominator[ll, s] == 0.0:
+                    # This is case is not handled in Lidke's code
+                    # but it seems to be a problem here
+                    # (maybe due to many iterations)
+                    theta[ll, s] -= (
+                        GAMMA[ll] * _np.sign(numerator[ll, s]) * max_step[ll, s]
+                    )
+                else:
+                    theta[ll, s] -= GAMMA[ll] * _np.minimum(
+                        _np.maximum(
+                            numerator[ll, s] / denominator[ll, s], -max_step[ll, s]
+                        ),
+                        max_step[ll, s],
+                    )
+
+            # Other constraints
+            theta[2, s] = _np.maximum(theta[2, s], 1.0)
+            theta[3, s] = _np.maximum(theta[3, s], 0.01)
+            theta[4, s] = _np.maximum(theta[4, s], 0.01)
+            theta[5, s] = _np.maximum(theta[5, s], 0.01)
+
+            # Check for convergence and divergence
+            finished[s] = True
+            if (
+                _np.abs(old_theta[0, s] - theta[0, s]) < eps
+                and _np.abs(old_theta[1, s] - theta[1, s]) < eps
+                and _np.abs(old_theta[4, s] - theta[4, s]) < eps
+                and _np.abs(old_theta[5, s] - theta[5, s]) < eps
+            ):
+                stop_reasons[slots[s]] = STOP_CONVERGED
+            elif check_divergence and _diverged(theta, s, size):
+                stop_reasons[slots[s]] = STOP_DIVERGED
             else:
-                theta[ll] -= GAMMA[ll] * _np.minimum(
-                    _np.maximum(numerator[ll] / denominator[ll], -max_step[ll]),
-                    max_step[ll],
-                )
+                finished[s] = False
+                old_theta[:, s] = theta[:, s]
+            if finished[s]:
+                thetas[slots[s]] = theta[:, s]
+                iterations[slots[s]] = kk
+        n_active = _drop_finished(
+            finished, n_active, slots, theta, max_step, old_theta
+        )
 
-        # Other constraints
-        theta[2] = _np.maximum(theta[2], 1.0)
-        theta[3] = _np.maximum(theta[3], 0.01)
-        theta[4] = _np.maximum(theta[4], 0.01)
-        theta[5] = _np.maximum(theta[5], 0.01)
-
-        # Check for convergence
-        if _np.abs(old_x - theta[0]) < eps:
-            if _np.abs(old_y - theta[1]) < eps:
-                if _np.abs(old_sx - theta[4]) < eps:
-                    if _np.abs(old_sy - theta[5]) < eps:
-                        break
-        old_x = theta[0]
-        old_y = theta[1]
-        old_sx = theta[4]
-        old_sy = theta[5]
-    thetas[index] = theta
-    iterations[index] = kk
+    for s in range(n_active):
+        thetas[slots[s]] = theta[:, s]
+        iterations[slots[s]] = kk
+        stop_reasons[slots[s]] = STOP_MAX_ITERATIONS
+
+    for index in range(start, stop):
+        CRLBs[index], likelihoods[index] = _crlb_and_likelihood_sigmaxy(
+            spots[index], _spot_variance(variances, index), thetas[index], size
+        )
+        if len(limits) and _rejected(
+            thetas[index],
+            CRLBs[index],
+            likelihoods[index],
+            stop_reasons[index],
+            size * size,
+            limits,
+        ):
+            stop_reasons[index] = STOP_REJECTED
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _crlb_and_likelihood_sigmaxy(spot, variance, theta, size):
+    n_params = 6
+    dudt = _np.zeros(n_params, dtype=_np.float32)
+    d2udt2 = _np.zeros(n_params, dtype=_np.float32)
+    x_terms = _np.zeros((8, size, 1))
+    y_terms = _np.zeros((8, size, 1))
+    _fill_integral_terms(x_terms, 0, theta[0], theta[4])
+    _fill_integral_terms(y_terms, 0, theta[1], theta[5])
 
     # Calculating the CRLB and LogLikelihood
+    # With sCMOS variances, data and model are shifted by the readout variance
+    # (in photons^2) of each pixel, which approximates the readout noise by
+    # Poisson noise (Huang et al., Nat. Methods 2013)
+    scmos = len(variance) > 0
     Div = 0.0
     M = _np.zeros((n_params, n_params), dtype=_np.float32)
     for ii in range(size):
         for jj in range(size):
-            PSFx = _gaussian_integral(ii, theta[0], theta[4])
-            PSFy = _gaussian_integral(jj, theta[1], theta[5])
+            PSFx = x_terms[0, ii, 0]
+            PSFy = y_terms[0, jj, 0]
             model = theta[3] + theta[2] * PSFx * PSFy
 
             # Calculating derivatives
-            dudt[0], d2udt2[0] = _derivative_gaussian_integral(
-                ii, theta[0], theta[4], theta[2], PSFy
+            dudt[0], d2udt2[0] = _position_derivative(
+                x_terms, ii, 0, theta[4], theta[2], PSFy
             )
-            dudt[1], d2udt2[1] = _derivative_gaussian_integral(
-                jj, theta[1], theta[5], theta[2], PSFx
+            dudt[1], d2udt2[1] = _position_derivative(
+                y_terms, jj, 0, theta[5], theta[2], PSFx
             )
-            dudt[4], d2udt2[4] = _derivative_gaussian_integral_1d_sigma(
-                ii, theta[0], theta[4], theta[2], PSFy
+            dudt[4], d2udt2[4] = _sigma_derivative(
+                x_terms, ii, 0, theta[4], theta[2], PSFy
             )
-            dudt[5], d2udt2[5] = _derivative_gaussian_integral_1d_sigma(
-                jj, theta[1], theta[5], theta[2], PSFx
+            dudt[5], d2udt2[5] = _sigma_derivative(
+                y_terms, jj, 0, theta[5], theta[2], PSFx
             )
             dudt[2] = PSFx * PSFy
             dudt[3] = 1.0
 
             # Building the Fisher Information Matrix
             model = theta[3] + theta[2] * dudt[2]
+            if scmos:
+                model += variance[ii, jj]
             for kk in range(n_params):
                 for ll in range(kk, n_params):
                     M[kk, ll] += dudt[ll] * dudt[kk] / model
@@ -597,91 +1130,258 @@ def _mlefit_sigmaxy(spots, index, thetas, CRLBs, likelihoods, iterations, eps, m
             # LogLikelihood
             if model > 0:
                 data = spot[ii, jj]
+                if scmos:
+                    data += variance[ii, jj]
                 if data > 0:
                     Div += data * _np.log(model) - model - data * _np.log(data) + data
                 else:
                     Div += -model
 
-    likelihoods[index] = Div
-
     # Matrix inverse (CRLB=F^-1)
     Minv = _np.linalg.pinv(M)
     CRLB = _np.zeros(n_params, dtype=_np.float32)
     for kk in range(n_params):
         CRLB[kk] = Minv[kk, kk]
-    CRLBs[index] = CRLB
+    return CRLB, Div
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _multi_likelihood(roi, variance, theta, k, size, x_terms, y_terms, A, b):
+    """
+    Log-likelihood of k emitters with a common background and width,
+    theta = [y_0, x_0, N_0, ..., y_k-1, x_k-1, N_k-1, bg, S]. If A and b are
+    not empty, they are set to the Fisher information and the gradient of
+    the log-likelihood.
+    """
+    n_params = 3 * k + 2
+    sigma = theta[3 * k + 1]
+    for e in range(k):
+        _fill_integral_terms(x_terms, e, theta[3 * e], sigma)
+        _fill_integral_terms(y_terms, e, theta[3 * e + 1], sigma)
+    gradient = len(b) > 0
+    if gradient:
+        A[:n_params, :n_params] = 0.0
+        b[:n_params] = 0.0
+    dudt = _np.zeros(n_params)
+    scmos = len(variance) > 0
+    Div = 0.0
+    for ii in range(size):
+        for jj in range(size):
+            model = theta[3 * k]
+            dudt[3 * k + 1] = 0.0
+            for e in range(k):
+                photons = theta[3 * e + 2]
+                PSFx = x_terms[0, ii, e]
+                PSFy = y_terms[0, jj, e]
+                model += photons * PSFx * PSFy
+                if gradient:
+                    dudt[3 * e], _ = _position_derivative(
+                        x_terms, ii, e, sigma, photons, PSFy
+                    )
+                    dudt[3 * e + 1], _ = _position_derivative(
+                        y_terms, jj, e, sigma, photons, PSFx
+                    )
+                    dudt[3 * e + 2] = PSFx * PSFy
+                    dSx, _ = _sigma_derivative(x_terms, ii, e, sigma, photons, PSFy)
+                    dSy, _ = _sigma_derivative(y_terms, jj, e, sigma, photons, PSFx)
+                    dudt[3 * k + 1] += dSx + dSy
+            dudt[3 * k] = 1.0
+            data = roi[ii, jj]
+            if scmos:
+                model += variance[ii, jj]
+                data += variance[ii, jj]
+            if data > 0:
+                Div += data * _np.log(model) - model - data * _np.log(data) + data
+            else:
+                Div += -model
+            if gradient:
+                cf = data / model - 1
+                for kk in range(n_params):
+                    b[kk] += cf * dudt[kk]
+                    for ll in range(kk + 1):
+                        A[kk, ll] += dudt[kk] * dudt[ll] / model
+    if gradient:
+        for kk in range(n_params):
+            for ll in range(kk):
+                A[ll, kk] = A[kk, ll]
+    return Div
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _multi_theta_valid(theta, k, size):
+    for e in range(k):
+        if theta[3 * e + 2] < 1.0:
+            return False
+    return theta[3 * k] > 0.0 and 0.0 < theta[3 * k + 1] < size
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _multi_converged(step, theta, k, eps):
+    """Positions change by less than eps, the other parameters by less
+    than eps relative to their values"""
+    for e in range(k):
+        if _np.abs(step[3 * e]) > eps or _np.abs(step[3 * e + 1]) > eps:
+            return False
+    for kk in range(3 * k + 2):
+        if kk % 3 == 2 or kk >= 3 * k:
+            if _np.abs(step[kk]) > eps * _np.abs(theta[kk]):
+                return False
+    return True
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _fit_multi_lm(roi, variance, theta, k, size, eps, max_it):
+    """
+    Levenberg-Marquardt fit of k emitters, starting at and updating theta
+    (see _multi_likelihood). Like gausslq._fit_spot_lm, but the Poisson
+    log-likelihood is maximized with the Fisher information in place of the
+    Hessian. Returns the log-likelihood and the number of iterations.
+    """
+    n_params = 3 * k + 2
+    x_terms = _np.zeros((8, size, k))
+    y_terms = _np.zeros((8, size, k))
+    A = _np.zeros((n_params, n_params))
+    b = _np.zeros(n_params)
+    no_A = _np.zeros((0, 0))
+    no_b = _np.zeros(0)
+    L = _np.zeros((n_params, n_params))
+    step = _np.zeros(n_params)
+    trial = _np.zeros(n_params)
+    lambda_ = 1e-3
+    Div = _multi_likelihood(roi, variance, theta, k, size, x_terms, y_terms, A, b)
+    for it in range(max_it):
+        if _gausslq._solve_damped(A, b, 0.0, L, step):
+            if _multi_converged(step, theta, k, eps):
+                return Div, it
+        while True:
+            if _gausslq._solve_damped(A, b, lambda_, L, step):
+                trial[:] = theta + step
+                if _multi_theta_valid(trial, k, size):
+                    trial_Div = _multi_likelihood(
+                        roi, variance, trial, k, size, x_terms, y_terms, no_A, no_b
+                    )
+                    if trial_Div > Div:
+                        break
+            lambda_ *= 10.0
+            if lambda_ > 1e10:
+                return Div, it
+        lambda_ = max(lambda_ / 10.0, 1e-10)
+        theta[:] = trial
+        Div = _multi_likelihood(roi, variance, theta, k, size, x_terms, y_terms, A, b)
+    return Div, max_it
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _mlefit_multi(
+    rois,
+    start,
+    stop,
+    thetas,
+    CRLBs,
+    likelihoods,
+    iterations,
+    n_emitters,
+    stop_reasons,
+    initial_positions,
+    n_initial,
+    variances,
+    initial_sigma,
+    eps,
+    max_it,
+    limits,
+):
+    size = rois.shape[1]
+    max_emitters = initial_positions.shape[1]
+    n_pixels = size * size
+    theta = _np.zeros(3 * max_emitters + 2)
+    best_theta = _np.zeros(3 * max_emitters + 2)
+    for index in range(start, stop):
+        roi = rois[index]
+        variance = _spot_variance(variances, index)
+        bg = max(_np.min(mean_filter(roi, size)), 0.01)
+        photons = max(_np.sum(roi) - n_pixels * bg, 1.0)
+        best_bic = _np.inf
+        best_k = 0
+        best_it = 0
+        # Fits 1 to n emitters at the brightest identifications and selects
+        # the number of emitters by the Bayesian information criterion
+        for k in range(1, n_initial[index] + 1):
+            for e in range(k):
+                theta[3 * e] = initial_positions[index, e, 0]
+                theta[3 * e + 1] = initial_positions[index, e, 1]
+                theta[3 * e + 2] = max(photons / k, 1.0)
+            theta[3 * k] = bg
+            theta[3 * k + 1] = initial_sigma
+            Div, it = _fit_multi_lm(
+                roi, variance, theta[: 3 * k + 2], k, size, eps, max_it
+            )
+            iterations[index] += it
+            bic = -2 * Div + (3 * k + 2) * _np.log(n_pixels)
+            if bic < best_bic:
+                best_bic = bic
+                best_k = k
+                best_it = it
+                best_theta[:] = theta
+                likelihoods[index] = Div
+        k = best_k
+        n_emitters[index] = k
+        n_params = 3 * k + 2
+        A = _np.zeros((n_params, n_params))
+        b = _np.zeros(n_params)
+        _multi_likelihood(
+            roi,
+            variance,
+            best_theta[:n_params],
+            k,
+            size,
+            _np.zeros((8, size, k)),
+            _np.zeros((8, size, k)),
+            A,
+            b,
+        )
+        Ainv = _np.linalg.pinv(A)
+        for e in range(k):
+            for kk in range(3):
+                thetas[index, e, kk] = best_theta[3 * e + kk]
+                CRLBs[index, e, kk] = Ainv[3 * e + kk, 3 * e + kk]
+            thetas[index, e, 3] = best_theta[3 * k]
+            CRLBs[index, e, 3] = Ainv[3 * k, 3 * k]
+            thetas[index, e, 4:6] = best_theta[3 * k + 1]
+            CRLBs[index, e, 4:6] = Ainv[3 * k + 1, 3 * k + 1]
+            if best_it < max_it:
+                stop_reasons[index, e] = STOP_CONVERGED
+            else:
+                stop_reasons[index, e] = STOP_MAX_ITERATIONS
+            if len(limits) and _rejected(
+                thetas[index, e],
+                CRLBs[index, e],
+                likelihoods[index],
+                stop_reasons[index, e],
+                n_pixels,
+                limits,
+            ):
+                stop_reasons[index, e] = STOP_REJECTED
 
 
 def locs_from_fits(identifications, theta, CRLBs, likelihoods, iterations, box):
-    box_offset = int(box / 2)
-    y = theta[:, 0] + identifications.y - box_offset
-    x = theta[:, 1] + identifications.x - box_offset
-    with _np.errstate(invalid="ignore"):
-        lpy = _np.sqrt(CRLBs[:, 0])
-        lpx = _np.sqrt(CRLBs[:, 1])
-        a = _np.maximum(theta[:, 4], theta[:, 5])
-        b = _np.minimum(theta[:, 4], theta[:, 5])
-        ellipticity = (a - b) / a
+    dtype = _lib.FIT_LOCS_DTYPE
     if hasattr(identifications, "n_id"):
-        locs = _np.rec.array(
-            (
-                identifications.frame,
-                x,
-                y,
-                theta[:, 2],
-                theta[:, 4],
-                theta[:, 5],
-                theta[:, 3],
-                lpx,
-                lpy,
-                ellipticity,
-                identifications.net_gradient,
-                identifications.n_id,
-            ),
-            dtype=[
-                ("frame", "u4"),
-                ("x", "f4"),
-                ("y", "f4"),
-                ("photons", "f4"),
-                ("sx", "f4"),
-                ("sy", "f4"),
-                ("bg", "f4"),
-                ("lpx", "f4"),
-                ("lpy", "f4"),
-                ("ellipticity", "f4"),
-                ("net_gradient", "f4"),
-                ("n_id", "u4"),
-            ],
-        )
-        locs.sort(kind="mergesort", order="n_id")
-    else:
-        locs = _np.rec.array(
-            (
-                identifications.frame,
-                x,
-                y,
-                theta[:, 2],
-                theta[:, 4],
-                theta[:, 5],
-                theta[:, 3],
-                lpx,
-                lpy,
-                ellipticity,
-                identifications.net_gradient,
-            ),
-            dtype=[
-                ("frame", "u4"),
-                ("x", "f4"),
-                ("y", "f4"),
-                ("photons", "f4"),
-                ("sx", "f4"),
-                ("sy", "f4"),
-                ("bg", "f4"),
-                ("lpx", "f4"),
-                ("lpy", "f4"),
-                ("ellipticity", "f4"),
-                ("net_gradient", "f4"),
-            ],
-        )
-        locs.sort(kind="mergesort", order="frame")
+        dtype = dtype + [("n_id", "u4")]
+    # the CRLBs are written as lpx and lpy and their square root taken in place
+    locs = _lib.build_locs(
+        identifications,
+        dtype,
+        theta[:, 1],
+        theta[:, 0],
+        box_offset=int(box / 2),
+        photons=theta[:, 2],
+        sx=theta[:, 4],
+        sy=theta[:, 5],
+        bg=theta[:, 3],
+        lpx=CRLBs[:, 1],
+        lpy=CRLBs[:, 0],
+    )
+    with _np.errstate(invalid="ignore"):
+        _np.sqrt(locs.lpx, out=locs.lpx)
+        _np.sqrt(locs.lpy, out=locs.lpy)
     return locs
@@ -1434,6 +1434,7 @@ class Window(QtWidgets.QMainWindow):
                         self.parameters["Box Size"],
                         self.curr_frame_number,
                         self.view.roi,
+                        tile_size=localize.PREVIEW_TILE_SIZE,
                     )
                     box = self.parameters["Box Size"]
                     self.status_bar.showMessage(
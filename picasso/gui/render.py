@@ -57,6 +57,7 @@ N_GROUP_COLORS = 8
 N_Z_COLORS = 32
 
 matplotlib.rcParams.update({"axes.titlesize": "large"})
+plt.style.use("ggplot")
 
 try:
     from PyImarisWriter.ImarisWriterCtypes import *
@@ -7,17 +7,12 @@
     :author: Joerg Schnitzbauer, 2016
     :copyright: Copyright (c) 2016 Jungmann Lab, MPI of Biochemistry
 """
-import matplotlib.pyplot as _plt
 import numpy as _np
 from numpy import fft as _fft
-import lmfit as _lmfit
 from tqdm import tqdm as _tqdm
 from . import lib as _lib
 
 
-_plt.style.use("ggplot")
-
-
 def xcorr(imageA, imageB):
     FimageA = _fft.fft2(imageA)
     CFimageB = _np.conj(_fft.fft2(imageB))
@@ -63,6 +58,8 @@ def get_image_shift(imageA, imageB, box, roi=None, display=False):
     if 0 in dimensions or dimensions[0] != dimensions[1]:
         xc, yc = 0, 0
     else:
+        import lmfit as _lmfit
+
         # The fit model
         def flat_2d_gaussian(a, xc, yc, s, b):
             A = a * _np.exp(-0.5 * ((x - xc) ** 2 + (y - yc) ** 2) / s**2) + b
@@ -88,6 +85,9 @@ def get_image_shift(imageA, imageB, box, roi=None, display=False):
         yc += Y_ + y_max_
 
         if display:
+            import matplotlib.pyplot as _plt
+
+            _plt.style.use("ggplot")
             _plt.figure(figsize=(17, 10))
             _plt.subplot(1, 3, 1)
             _plt.imshow(imageA, interpolation="none")
@@ -15,9 +15,10 @@ import h5py as _h5py
 import re as _re
 import struct as _struct
 import json as _json
+import bisect as _bisect
+import mmap as _mmap
 import os as _os
 import threading as _threading
-from PyQt5.QtWidgets import QMessageBox as _QMessageBox
 from . import lib as _lib
 
 from .ext import bitplane
@@ -158,6 +159,25 @@ def save_raw(path, movie, info):
     save_info(info_path, info)
 
 
+def save_camera_maps(path, baseline, variance, sensitivity):
+    """
+    Saves per-pixel calibration maps of an sCMOS camera as one .npy file:
+    the baseline in counts, the readout variance in counts^2 and the
+    sensitivity in electrons per count
+    """
+    maps = _np.stack([baseline, variance, sensitivity]).astype(_np.float32)
+    _np.save(path, maps)
+
+
+def load_camera_maps(path):
+    """Memory-maps camera maps saved by save_camera_maps as an array of shape
+    (3, height, width)"""
+    maps = _np.load(path, mmap_mode="r")
+    if maps.ndim != 3 or len(maps) != 3:
+        raise ValueError("Camera maps must have the shape (3, height, width).")
+    return maps
+
+
 def multiple_filenames(path, index):
     base, ext = _ospath.splitext(path)
     filename = base + "_" + str(index) + ext
@@ -190,6 +210,8 @@ def load_info(path, qt_parent=None):
     except FileNotFoundError as e:
         print("\nAn error occured. Could not find metadata file:\n{}".format(filename))
         if qt_parent is not None:
+            from PyQt5.QtWidgets import QMessageBox as _QMessageBox
+
             _QMessageBox.critical(
                 qt_parent,
                 "An error occured",
@@ -242,6 +264,11 @@ def save_user_settings(settings):
 
 
 class TiffMap:
+    """
+    Reads the frames of a TIFF file. The offsets of the frames are cached
+    in a hidden index file next to it, which is reused as long as the size
+    and modification time of the TIFF file are unchanged.
+    """
 
     TIFF_TYPES = {1: "B", 2: "c", 3: "H", 4: "L", 5: "RATIONAL"}
     TYPE_SIZES = {
@@ -255,11 +282,12 @@ class TiffMap:
         "RATIONAL": 8,
     }
 
-    def __init__(self, path, verbose=False):
+    def __init__(self, path, verbose=False, cache_index=True):
         if verbose:
             print("Reading info from {}".format(path))
         self.path = _ospath.abspath(path)
         self.file = open(self.path, "rb")
+        self._mmap = _mmap.mmap(self.file.fileno(), 0, access=_mmap.ACCESS_READ)
         self._tif_byte_order = {b"II": "<", b"MM": ">"}[self.file.read(2)]
         self.file.seek(4)
         self.first_ifd_offset = self.read("L")
@@ -267,6 +295,7 @@ class TiffMap:
         # Read info from first IFD
         self.file.seek(self.first_ifd_offset)
         n_entries = self.read("H")
+        compression = 1
         for i in range(n_entries):
             self.file.seek(self.first_ifd_offset + 2 + i * 12)
             tag = self.read("H")
@@ -284,32 +313,23 @@ class TiffMap:
                 # the tif byte order might be different
                 # so we also store the file dtype
                 self._tif_dtype = _np.dtype(self._tif_byte_order + dtype_str)
+            elif tag == 259:
+                compression = self.read(type, count)
         self.frame_shape = (self.height, self.width)
         self.frame_size = self.height * self.width
 
         # Collect image offsets
-        self.image_offsets = []
-        offset = self.first_ifd_offset
-        while offset != 0:
-            self.file.seek(offset)
-            n_entries = self.read("H")
-            if n_entries is None:
-                # Some MM files have trailing nonsense bytes
-                break
-            for i in range(n_entries):
-                self.file.seek(offset + 2 + i * 12)
-                tag = self.read("H")
-                if tag == 273:
-                    type = self.TIFF_TYPES[self.read("H")]
-                    count = self.read("L")
-                    self.image_offsets.append(self.read(type, count))
-                    break
-            self.file.seek(offset + 2 + n_entries * 12)
-            last_offset = offset + 2 + n_entries * 12
-            offset = self.read("L")
+        index = self._load_index() if cache_index else None
+        if index is None:
+            self.image_offsets, self.last_ifd_offset = self._scan_ifds()
+            if cache_index:
+                self._save_index()
+        else:
+            self.image_offsets, self.last_ifd_offset = index
         self.n_frames = len(self.image_offsets)
-        self.last_ifd_offset = last_offset
+        self.shape = (self.n_frames,) + self.frame_shape
         self.lock = _threading.Lock()
+        self.stack = self._map_stack(compression)
 
     def __enter__(self):
         return self
@@ -318,7 +338,8 @@ class TiffMap:
         self.close()
 
     def __getitem__(self, it):
-
+        if self.stack is not None:
+            return self.stack[it]
         with self.lock:  # for reading frames from multiple threads
             if isinstance(it, tuple):
                 if isinstance(it, int) or _np.issubdtype(it[0], _np.integer):
@@ -425,7 +446,140 @@ class TiffMap:
 
         return info
 
+    @property
+    def index_path(self):
+        directory, filename = _ospath.split(self.path)
+        return _ospath.join(directory, "." + filename + ".ifd.npy")
+
+    def _file_key(self):
+        stat = _os.fstat(self.file.fileno())
+        return [stat.st_size, stat.st_mtime_ns, self.first_ifd_offset]
+
+    def _load_index(self):
+        """
+        Returns the image offsets and the end of the last IFD from the index
+        file, or None if there is none or it belongs to another version of
+        the TIFF file.
+        """
+        try:
+            index = _np.load(self.index_path)
+        except (OSError, ValueError):
+            return None
+        if len(index) < 4 or list(index[:3]) != self._file_key():
+            return None
+        return index[4:], int(index[3])
+
+    def _save_index(self):
+        index = _np.array(
+            self._file_key() + [self.last_ifd_offset], dtype=_np.int64
+        )
+        index = _np.concatenate((index, self.image_offsets))
+        temp_path = self.index_path + ".{}.tmp".format(_os.getpid())
+        try:
+            with open(temp_path, "wb") as file:
+                _np.save(file, index)
+            _os.replace(temp_path, self.index_path)
+        except OSError:  # e.g., a read-only acquisition folder
+            try:
+                _os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _scan_ifds(self):
+        """
+        Walks the chain of IFDs through the memory map of the file and
+        returns the offsets of the images and the end of the last IFD. Only
+        the entry counts and next IFD offsets are read one by one, the
+        entries of all IFDs are decoded at once with a structured dtype.
+        """
+        buffer = self._mmap
+        size = len(buffer)
+        short = _struct.Struct(self._tif_byte_order + "H")
+        long = _struct.Struct(self._tif_byte_order + "L")
+        ifd_offsets = []
+        n_entries = []
+        offset = self.first_ifd_offset
+        last_offset = offset
+        while offset != 0 and offset + 2 <= size:
+            n = short.unpack_from(buffer, offset)[0]
+            end = offset + 2 + 12 * n
+            if end + 4 > size:
+                break  # Some MM files have trailing nonsense bytes
+            ifd_offsets.append(offset)
+            n_entries.append(n)
+            last_offset = end
+            offset = long.unpack_from(buffer, end)[0]
+        if len(ifd_offsets) == 0:
+            return _np.zeros(0, dtype=_np.int64), last_offset
+        ifd_offsets = _np.array(ifd_offsets, dtype=_np.int64)
+        n_entries = _np.array(n_entries, dtype=_np.int64)
+        u2, u4 = self._tif_byte_order + "u2", self._tif_byte_order + "u4"
+        entry_dtype = _np.dtype(
+            {
+                "names": ["tag", "type", "value", "short_value"],
+                "formats": [u2, u2, u4, u2],
+                "offsets": [0, 2, 8, 8],
+                "itemsize": 12,
+            }
+        )
+
+        def read_entries(i):
+            return _np.frombuffer(buffer, entry_dtype, n_entries[i], ifd_offsets[i] + 2)
+
+        # MM files have the same entries in every IFD, so the strip offsets
+        # are gathered at their position in the first IFD and only IFDs
+        # that differ are searched
+        position = _np.flatnonzero(read_entries(0)["tag"] == 273)
+        position = position[0] if len(position) else 0
+        has_position = n_entries > position
+        starts = ifd_offsets[has_position] + 2 + 12 * position
+        data = _np.frombuffer(buffer, dtype=_np.uint8)
+        entries = _np.zeros(len(ifd_offsets), dtype=entry_dtype)
+        entries[has_position] = data[starts[:, _np.newaxis] + _np.arange(12)].view(
+            entry_dtype
+        )[:, 0]
+        found = entries["tag"] == 273
+        for i in _np.flatnonzero(~found):
+            ifd = read_entries(i)
+            match = _np.flatnonzero(ifd["tag"] == 273)
+            if len(match):
+                entries[i] = ifd[match[0]]
+                found[i] = True
+        entries = entries[found]
+        image_offsets = _np.where(
+            entries["type"] == 3, entries["short_value"], entries["value"]
+        ).astype(_np.int64)
+        return image_offsets, last_offset
+
+    def _map_stack(self, compression):
+        """
+        Maps the movie as one read-only array of frames, if the frames are
+        uncompressed, little endian and regularly spaced in the file, as in
+        most Micro-Manager OME-TIFFs. Frames are then views of the file,
+        which are read without copies or locks. Returns None for other
+        files, whose frames are read one by one.
+        """
+        if compression != 1 or self._tif_byte_order != "<" or self.n_frames == 0:
+            return None
+        offsets = self.image_offsets
+        itemsize = self.dtype.itemsize
+        frame_bytes = self.frame_size * itemsize
+        stride = offsets[1] - offsets[0] if self.n_frames > 1 else frame_bytes
+        if stride < frame_bytes or _np.any(_np.diff(offsets) != stride):
+            return None
+        if offsets[-1] + frame_bytes > len(self._mmap):
+            return None
+        return _np.ndarray(
+            (self.n_frames,) + self.frame_shape,
+            dtype=self.dtype,
+            buffer=self._mmap,
+            offset=int(offsets[0]),
+            strides=(int(stride), self.width * itemsize, itemsize),
+        )
+
     def get_frame(self, index, array=None):
+        if self.stack is not None:
+            return self.stack[index]
         self.file.seek(self.image_offsets[index])
         frame = _np.reshape(
             _np.fromfile(self.file, dtype=self._tif_dtype, count=self.frame_size),
@@ -454,6 +608,11 @@ class TiffMap:
             return None
 
     def close(self):
+        self.stack = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # frames that are still used keep the map open
         self.file.close()
 
     def tofile(self, file_handle, byte_order=None):
@@ -541,12 +700,11 @@ class TiffMultiMap:
             map.close()
 
     def get_frame(self, index):
-        # TODO deal with negative numbers
-        for i in range(self.n_maps):
-            if self.cum_n_frames[i] <= index < self.cum_n_frames[i + 1]:
-                break
-        else:
+        if index < 0:
+            index += self.n_frames
+        if not 0 <= index < self.n_frames:
             raise IndexError
+        i = _bisect.bisect_right(self.cum_n_frames, index) - 1
         return self.maps[i][index - self.cum_n_frames[i]]
 
     def info(self):
@@ -559,6 +717,130 @@ class TiffMultiMap:
             map.tofile(file_handle, byte_order)
 
 
+PREFETCH_WORKERS = 4  # threads of a FramePrefetcher
+PREFETCH_BLOCK_SIZE = 8  # frames a prefetch thread reads at once
+PREFETCH_BUFFER_SIZE = 2**27  # bytes of frames read ahead at most
+
+
+class FramePrefetcher:
+    """
+    Reads the given frames of a movie in order with background threads,
+    ahead of the consumers, which take each frame once with
+    prefetcher[frame_number], from any thread and in any order. Frames are
+    read within a window of buffer_size bytes from the first frame that is
+    not taken yet, so memory stays bounded. Frames that are not in the
+    order, taken again or beyond the window are read directly.
+    Helps with movies on slow or network-mounted storage. Use it as a
+    context manager or close it, so that the threads stop.
+    """
+
+    def __init__(
+        self,
+        movie,
+        frames,
+        n_workers=PREFETCH_WORKERS,
+        block_size=PREFETCH_BLOCK_SIZE,
+        buffer_size=PREFETCH_BUFFER_SIZE,
+    ):
+        self.movie = movie
+        if hasattr(movie, "shape"):
+            self.shape = movie.shape
+            self.dtype = movie.dtype
+        else:  # e.g., a list of frames
+            frame = _np.asarray(movie[0]) if len(movie) else _np.empty((0, 0))
+            self.shape = (len(movie),) + frame.shape
+            self.dtype = frame.dtype
+        self._positions = {}
+        for frame_number in frames:
+            self._positions.setdefault(int(frame_number), len(self._positions))
+        self.frames = list(self._positions)
+        frame_bytes = int(_np.prod(self.shape[1:])) * _np.dtype(self.dtype).itemsize
+        self.block_size = block_size
+        self.window = max(n_workers * block_size, buffer_size // max(1, frame_bytes))
+        self._buffer = {}  # read frames by position in self.frames
+        self._taken = _np.zeros(len(self.frames), dtype=bool)
+        self._first = 0  # first position that is not taken
+        self._next = 0  # next position to read
+        self._closed = False
+        self._condition = _threading.Condition()
+        self._threads = [
+            _threading.Thread(target=self._read_ahead, daemon=True)
+            for _ in range(n_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.movie)
+
+    def __getitem__(self, frame_number):
+        position = self._positions.get(int(frame_number))
+        with self._condition:
+            if position is None or self._taken[position]:
+                frame = None
+            elif position >= self._first + self.window:
+                frame = None
+                self._take(position)  # read directly, so it is not read ahead
+            else:
+                while position not in self._buffer and not self._closed:
+                    self._condition.wait()
+                frame = self._buffer.pop(position, None)
+                self._take(position)
+        if frame is None:
+            return self.movie[frame_number]
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    def _take(self, position):
+        self._taken[position] = True
+        while self._first < len(self.frames) and self._taken[self._first]:
+            self._first += 1
+        self._condition.notify_all()
+
+    def _read_ahead(self):
+        while True:
+            with self._condition:
+                while (
+                    not self._closed
+                    and self._next < len(self.frames)
+                    and self._next >= self._first + self.window
+                ):
+                    self._condition.wait()
+                if self._closed or self._next == len(self.frames):
+                    return
+                start = self._next
+                stop = min(start + self.block_size, self._first + self.window)
+                stop = min(stop, len(self.frames))
+                self._next = stop
+            for position in range(start, stop):
+                try:
+                    frame = self.movie[self.frames[position]]
+                    if not frame.flags.owndata:
+                        frame = frame.copy()  # reads memory-mapped frames
+                except Exception as e:
+                    frame = e
+                with self._condition:
+                    if not self._taken[position]:
+                        self._buffer[position] = frame
+                    self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._buffer.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not _threading.current_thread():
+                thread.join()
+
+
 def to_raw_combined(basename, paths):
     raw_file_name = basename + ".ome.raw"
     with open(raw_file_name, "wb") as file_handle:
@@ -633,21 +915,227 @@ def save_datasets(path, info, **kwargs):
     save_info(info_path, info)
 
 
-def save_locs(path, locs, info):
+LOCS_CHUNK_SIZE = 2**20  # bytes per chunk of saved locs datasets
+LOCS_TILE_SIZE = 32  # pixels per side of the tiles of a locs index
+LOCS_FRAME_BIN = 1000  # frames per bin of a locs index
+
+
+def _create_locs_dataset(parent, name, data, compression):
+    if len(data) == 0:  # empty datasets can not be chunked
+        return parent.create_dataset(name, data=data)
+    chunk_length = max(1, LOCS_CHUNK_SIZE // data.dtype.itemsize)
+    return parent.create_dataset(
+        name,
+        data=data,
+        chunks=(min(len(data), chunk_length),),
+        compression=compression,
+        shuffle=compression is not None,
+    )
+
+
+def _index_locs(locs, info, tile_size=LOCS_TILE_SIZE, frame_bin=LOCS_FRAME_BIN):
+    """
+    Sorts locs by square tiles of tile_size pixels and within the tiles by
+    frame. Returns the sorted locs, their positions in the given locs and
+    the offsets of the index of shape
+    (tiles in y, tiles in x, frame bins + 1): locs of tile (i, j) in frame
+    bin b or later start at offsets[i, j, b], and offsets[i, j, -1] is the
+    end of the tile, as in postprocess.get_index_blocks.
+    """
+    n_tiles_y = int(_np.ceil(info[0]["Height"] / tile_size))
+    n_tiles_x = int(_np.ceil(info[0]["Width"] / tile_size))
+    n_bins = int(locs.frame.max()) // frame_bin + 1 if len(locs) else 1
+    tile = (locs.y // tile_size).astype(_np.int64) * n_tiles_x
+    tile += (locs.x // tile_size).astype(_np.int64)
+    order = _np.lexsort((locs.frame, tile))
+    locs = locs[order]
+    keys = tile[order] * n_bins + locs.frame // frame_bin
+    bin_starts = _np.searchsorted(keys, _np.arange(n_tiles_y * n_tiles_x * n_bins + 1))
+    offsets = _np.empty((n_tiles_y * n_tiles_x, n_bins + 1), dtype=_np.int64)
+    offsets[:, :n_bins] = bin_starts[:-1].reshape(-1, n_bins)
+    offsets[:, n_bins] = bin_starts[n_bins::n_bins]
+    offsets = offsets.reshape(n_tiles_y, n_tiles_x, n_bins + 1)
+    order = order.astype(_np.uint32 if len(locs) < 2**32 else _np.int64)
+    return locs, order, offsets
+
+
+def _index_ranges(index, viewport, frames, max_gap=0):
+    """
+    Returns the (start, stop) ranges of locs in the tiles and frame bins of
+    a locs index (see _index_locs) that overlap viewport and frames. Ranges
+    less than max_gap apart are merged, as they share an HDF5 chunk, which
+    is read whole anyway.
+    """
+    offsets = index[...]
+    tile_size = index.attrs["tile_size"]
+    frame_bin = index.attrs["frame_bin"]
+    n_tiles_y, n_tiles_x = offsets.shape[:2]
+    n_bins = offsets.shape[2] - 1
+    i0, j0, i1, j1 = 0, 0, n_tiles_y, n_tiles_x
+    if viewport is not None:
+        (y_min, x_min), (y_max, x_max) = viewport
+        i0, i1 = [int(_np.clip(_ // tile_size, 0, n_tiles_y)) for _ in (y_min, y_max)]
+        j0, j1 = [int(_np.clip(_ // tile_size, 0, n_tiles_x)) for _ in (x_min, x_max)]
+        i1, j1 = min(i1 + 1, n_tiles_y), min(j1 + 1, n_tiles_x)
+    b0, b1 = 0, n_bins
+    if frames is not None:
+        b0 = int(_np.clip(frames[0] // frame_bin, 0, n_bins))
+        b1 = int(_np.clip(-(-frames[1] // frame_bin), b0, n_bins))
+    starts = offsets[i0:i1, j0:j1, b0].ravel()
+    stops = offsets[i0:i1, j0:j1, b1].ravel()
+    ranges = []
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        if start == stop:
+            continue
+        if ranges and start - ranges[-1][1] <= max_gap:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([start, stop])
+    return ranges
+
+
+def save_locs(path, locs, info, compression=None, columnar=False, index=False):
+    """
+    Saves locs to an HDF5 file in chunks of LOCS_CHUNK_SIZE bytes and info
+    to a YAML file of the same name. The chunks can be compressed with any
+    filter of h5py, e.g., "lzf" (fast) or "gzip" (small). With
+    columnar=True, every field is saved as a dataset of its own in the
+    group "locs", so that load_locs reads only the requested columns from
+    disk. Older Picasso versions can not read columnar files.
+    With index=True, locs are stored sorted by tiles of LOCS_TILE_SIZE
+    pixels and then by frame, with an index of where the tiles and bins of
+    LOCS_FRAME_BIN frames start, from which load_locs reads only the
+    locs of a viewport or frame range. Their given order is stored too, so
+    that load_locs returns them in this order.
+    """
     locs = _lib.ensure_sanity(locs, info)
+    if index:
+        locs, order, offsets = _index_locs(locs, info)
     with _h5py.File(path, "w") as locs_file:
-        locs_file.create_dataset("locs", data=locs)
+        if columnar:
+            group = locs_file.create_group("locs")
+            group.attrs["fields"] = list(locs.dtype.names)
+            for name in locs.dtype.names:
+                data = _np.ascontiguousarray(locs[name])
+                _create_locs_dataset(group, name, data, compression)
+        else:
+            _create_locs_dataset(locs_file, "locs", locs, compression)
+        if index:
+            locs_index = locs_file.create_dataset("locs_index", data=offsets)
+            locs_index.attrs["tile_size"] = LOCS_TILE_SIZE
+            locs_index.attrs["frame_bin"] = LOCS_FRAME_BIN
+            _create_locs_dataset(locs_file, "locs_order", order, compression)
     base, ext = _ospath.splitext(path)
     info_path = base + ".yaml"
     save_info(info_path, info)
 
 
-def load_locs(path, qt_parent=None):
+def _read_ranges(dataset, ranges):
+    """Reads the (start, stop) ranges of a dataset or fields of it into one
+    array"""
+    out = _np.empty(sum([stop - start for start, stop in ranges]), dataset[0:0].dtype)
+    offset = 0
+    for start, stop in ranges:
+        end = offset + stop - start
+        if isinstance(dataset, _h5py.Dataset):
+            dataset.read_direct(out, _np.s_[start:stop], _np.s_[offset:end])
+        else:
+            out[offset:end] = dataset[start:stop]
+        offset = end
+    return out
+
+
+def _read_locs(locs, columns=None, ranges=None):
+    """
+    Reads a locs dataset or group of columns (see save_locs) into a rec
+    array, optionally only the given columns in their order and only the
+    locs in the given (start, stop) ranges
+    """
+    if isinstance(locs, _h5py.Group):
+        if columns is None:
+            columns = list(locs.attrs["fields"])
+        datasets = [locs[name] for name in columns]
+        dtype = [(name, _.dtype) for name, _ in zip(columns, datasets)]
+        if ranges is not None:
+            n_locs = sum([stop - start for start, stop in ranges])
+        else:
+            n_locs = len(datasets[0]) if datasets else 0
+        out = _np.recarray(n_locs, dtype=dtype)
+        for name, dataset in zip(columns, datasets):
+            if ranges is None:
+                out[name] = dataset[...]
+            else:
+                out[name] = _read_ranges(dataset, ranges)
+        return out
+    if columns is not None:
+        locs = locs.fields(list(columns))
+    if ranges is None:
+        return locs[...].view(_np.recarray)
+    return _read_ranges(locs, ranges).view(_np.recarray)
+
+
+def _read_locs_in(locs_file, columns, viewport, frames):
+    """Reads the locs in viewport and frames, using the locs index if the
+    file has one"""
+    ranges = None
+    if "locs_index" in locs_file:
+        locs = locs_file["locs"]
+        datasets = locs.values() if isinstance(locs, _h5py.Group) else [locs]
+        max_gap = min([_.chunks[0] if _.chunks else 0 for _ in datasets])
+        ranges = _index_ranges(locs_file["locs_index"], viewport, frames, max_gap)
+    needed = []
+    if frames is not None:
+        needed.append("frame")
+    if viewport is not None:
+        needed += ["x", "y"]
+    read_columns = columns
+    if columns is not None:
+        read_columns = list(columns) + [_ for _ in needed if _ not in columns]
+    locs = _read_locs(locs_file["locs"], read_columns, ranges)
+    in_range = _np.ones(len(locs), dtype=bool)
+    if viewport is not None:
+        (y_min, x_min), (y_max, x_max) = viewport
+        in_range &= (locs.y >= y_min) & (locs.y < y_max)
+        in_range &= (locs.x >= x_min) & (locs.x < x_max)
+    if frames is not None:
+        in_range &= (locs.frame >= frames[0]) & (locs.frame < frames[1])
+    locs = locs[in_range]
+    if ranges is not None:
+        order = _read_ranges(locs_file["locs_order"], ranges)[in_range]
+        locs = locs[_np.argsort(order)]
+    if columns is not None and len(read_columns) > len(columns):
+        locs = _np.rec.fromarrays(
+            [locs[_] for _ in columns], dtype=[(_, locs.dtype[_]) for _ in columns]
+        )
+    return locs
+
+
+def _read_all_locs(locs_file, columns=None):
+    """Reads all locs of a file, in the order they were saved in"""
+    locs = _read_locs(locs_file["locs"], columns)
+    if "locs_order" not in locs_file:
+        return locs
+    saved = _np.empty_like(locs)
+    saved[locs_file["locs_order"][...]] = locs
+    return saved
+
+
+def load_locs(path, qt_parent=None, columns=None, viewport=None, frames=None):
+    """
+    Loads locs and their info. With columns, e.g., ["frame", "x", "y"],
+    only these fields are read, which reads proportionally less from
+    columnar files (see save_locs).
+    With viewport ((y_min, x_min), (y_max, x_max)) and/or frames (start,
+    stop), only locs with y_min <= y < y_max, x_min <= x < x_max and
+    start <= frame < stop are loaded. Files saved with index=True are read
+    only in the tiles and frames that overlap these; other files are read
+    whole and filtered. Locs are returned in the order they were saved in.
+    """
     with _h5py.File(path, "r") as locs_file:
-        locs = locs_file["locs"][...]
-    locs = _np.rec.array(
-        locs, dtype=locs.dtype
-    )  # Convert to rec array with fields as attributes
+        if viewport is None and frames is None:
+            locs = _read_all_locs(locs_file, columns)
+        else:
+            locs = _read_locs_in(locs_file, columns, viewport, frames)
     info = load_info(path, qt_parent=qt_parent)
     return locs, info
 
@@ -664,7 +1152,7 @@ def load_clusters(path, qt_parent=None):
 def load_filter(path, qt_parent=None):
     with _h5py.File(path, "r") as locs_file:
         try:
-            locs = locs_file["locs"][...]
+            locs = _read_all_locs(locs_file)
             info = load_info(path, qt_parent=qt_parent)
         except KeyError:
             try:
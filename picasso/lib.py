@@ -15,10 +15,13 @@ from numpy.lib.recfunctions import append_fields as _append_fields
 from numpy.lib.recfunctions import drop_fields as _drop_fields
 import collections as _collections
 import glob as _glob
+import atexit as _atexit
+import os as _os
 import os.path as _ospath
+import functools as _functools
+import threading as _threading
+from concurrent import futures as _futures
 from picasso import io as _io
-from PyQt5 import QtGui, QtCore, QtWidgets
-from lmfit import Model as _Model
 
 
 # A global variable where we store all open progress and status dialogs.
@@ -27,47 +30,78 @@ from lmfit import Model as _Model
 _dialogs = []
 
 
-class ProgressDialog(QtWidgets.QProgressDialog):
-    def __init__(self, description, minimum, maximum, parent):
-        super().__init__(
-            description,
-            None,
-            minimum,
-            maximum,
-            parent,
-            QtCore.Qt.CustomizeWindowHint,
-        )
-        self.initalized = None
-
-    def init(self):
-        _dialogs.append(self)
-        self.setMinimumDuration(500)
-        self.setModal(True)
-        self.app = QtCore.QCoreApplication.instance()
-        self.initalized = True
-
-    def set_value(self, value):
-        if not self.initalized:
-            self.init()
-        self.setValue(value)
-        self.app.processEvents()
-
-    def closeEvent(self, event):
-        _dialogs.remove(self)
-
-
-class StatusDialog(QtWidgets.QDialog):
-    def __init__(self, description, parent):
-        super(StatusDialog, self).__init__(parent, QtCore.Qt.CustomizeWindowHint)
-        _dialogs.append(self)
-        vbox = QtWidgets.QVBoxLayout(self)
-        label = QtWidgets.QLabel(description)
-        vbox.addWidget(label)
-        self.show()
-        QtCore.QCoreApplication.instance().processEvents()
-
-    def closeEvent(self, event):
-        _dialogs.remove(self)
+@_functools.lru_cache(maxsize=None)
+def _dialog_classes():
+    """Defines the Qt dialogs. PyQt5 is only imported once a dialog is
+    requested, so that headless use of picasso does not load it."""
+    from PyQt5 import QtCore, QtWidgets
+
+    class ProgressDialog(QtWidgets.QProgressDialog):
+        def __init__(self, description, minimum, maximum, parent):
+            super().__init__(
+                description,
+                None,
+                minimum,
+                maximum,
+                parent,
+                QtCore.Qt.CustomizeWindowHint,
+            )
+            self.initalized = None
+
+        def init(self):
+            _dialogs.append(self)
+            self.setMinimumDuration(500)
+            self.setModal(True)
+            self.app = QtCore.QCoreApplication.instance()
+            self.initalized = True
+
+        def set_value(self, value):
+            if not self.initalized:
+                self.init()
+            self.setValue(value)
+            self.app.processEvents()
+
+        def closeEvent(self, event):
+            _dialogs.remove(self)
+
+    class StatusDialog(QtWidgets.QDialog):
+        def __init__(self, description, parent):
+            super(StatusDialog, self).__init__(parent, QtCore.Qt.CustomizeWindowHint)
+            _dialogs.append(self)
+            vbox = QtWidgets.QVBoxLayout(self)
+            label = QtWidgets.QLabel(description)
+            vbox.addWidget(label)
+            self.show()
+            QtCore.QCoreApplication.instance().processEvents()
+
+        def closeEvent(self, event):
+            _dialogs.remove(self)
+
+    return {"ProgressDialog": ProgressDialog, "StatusDialog": StatusDialog}
+
+
+@_functools.lru_cache(maxsize=None)
+def _cumulative_exponential_model():
+    from lmfit import Model as _Model
+
+    return {"CumulativeExponentialModel": _Model(cumulative_exponential)}
+
+
+# Attributes that pull in PyQt5 or lmfit are created on first access
+_LAZY_ATTRIBUTES = {
+    "ProgressDialog": _dialog_classes,
+    "StatusDialog": _dialog_classes,
+    "CumulativeExponentialModel": _cumulative_exponential_model,
+}
+
+
+def __getattr__(name):
+    try:
+        factory = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals().update(factory())
+    return globals()[name]
 
 
 class AutoDict(_collections.defaultdict):
@@ -83,9 +117,11 @@ class AutoDict(_collections.defaultdict):
 
 
 def cancel_dialogs():
+    from PyQt5 import QtCore
+
     dialogs = [_ for _ in _dialogs]
     for dialog in dialogs:
-        if isinstance(dialog, ProgressDialog):
+        if isinstance(dialog, __getattr__("ProgressDialog")):
             dialog.cancel()
         else:
             dialog.close()
@@ -96,9 +132,6 @@ def cumulative_exponential(x, a, t, c):
     return a * (1 - _np.exp(-(x / t))) + c
 
 
-CumulativeExponentialModel = _Model(cumulative_exponential)
-
-
 def calculate_optimal_bins(data, max_n_bins=None):
     iqr = _np.subtract(*_np.percentile(data, [75, 25]))
     bin_size = 2 * iqr * len(data) ** (-1 / 3)
@@ -129,6 +162,88 @@ def append_to_rec(rec_array, data, name):
     return rec_array
 
 
+# Fields of the locs of 2D fits (see build_locs)
+FIT_LOCS_DTYPE = [
+    ("frame", "u4"),
+    ("x", "f4"),
+    ("y", "f4"),
+    ("photons", "f4"),
+    ("sx", "f4"),
+    ("sy", "f4"),
+    ("bg", "f4"),
+    ("lpx", "f4"),
+    ("lpy", "f4"),
+    ("ellipticity", "f4"),
+    ("net_gradient", "f4"),
+]
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _add_offsets(fitted, identified, offset, out):
+    for i in range(len(out)):
+        out[i] = fitted[i] + identified[i] - offset
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _localization_precision(photons, s, bg, factor, out):
+    """Like postprocess.localization_precision, without temporary arrays"""
+    for i in range(len(out)):
+        sa2 = s[i] ** 2 + 1 / 12
+        if photons[i] == 0:
+            out[i] = _np.inf
+            continue
+        v = factor * sa2 * (16 / 9 + (8 * _np.pi * sa2 * bg[i]) / photons[i])
+        out[i] = _np.sqrt(v / photons[i])
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _ellipticity(sx, sy, out):
+    for i in range(len(out)):
+        a = max(sx[i], sy[i])
+        b = min(sx[i], sy[i])
+        out[i] = (a - b) / a if a != 0 else _np.nan
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _is_sorted(a):
+    for i in range(1, len(a)):
+        if a[i] < a[i - 1]:
+            return False
+    return True
+
+
+def build_locs(identifications, dtype, x, y, box_offset=0, em=False, **columns):
+    """
+    Writes fits into one preallocated locs recarray of dtype. The fitted x
+    and y are relative to the identifications, shifted by box_offset, and
+    columns are the other fields of dtype, e.g. columns of theta. frame,
+    net_gradient and n_id are taken from the identifications. Unless given,
+    lpx and lpy are calculated from photons, sx, sy and bg (see
+    postprocess.localization_precision) and ellipticity from sx and sy.
+    Locs are sorted by n_id, if dtype has it, or else by frame, unless the
+    identifications are in that order already, which they usually are.
+    """
+    locs = _np.recarray(len(identifications), dtype=dtype)
+    names = locs.dtype.names
+    for name in ["frame", "net_gradient", "n_id"]:
+        if name in names:
+            locs[name] = identifications[name]
+    _add_offsets(x, identifications.x, box_offset, locs.x)
+    _add_offsets(y, identifications.y, box_offset, locs.y)
+    for name, column in columns.items():
+        locs[name] = column
+    if "lpx" not in columns:
+        factor = 2.0 if em else 1.0
+        _localization_precision(locs.photons, locs.sx, locs.bg, factor, locs.lpx)
+        _localization_precision(locs.photons, locs.sy, locs.bg, factor, locs.lpy)
+    if "ellipticity" in names and "ellipticity" not in columns:
+        _ellipticity(locs.sx, locs.sy, locs.ellipticity)
+    order = "n_id" if "n_id" in names else "frame"
+    if not _is_sorted(locs[order]):
+        locs = locs[_np.argsort(locs[order], kind="stable")]
+    return locs
+
+
 def ensure_sanity(locs, info):
     # no inf or nan:
     locs = locs[
@@ -229,6 +344,153 @@ def n_futures_done(futures):
     return sum([_.done() for _ in futures])
 
 
+_process_pool = None  # reused by map_shared, see below
+_process_pool_workers = None
+
+
+def process_pool(n_workers):
+    """Process pool that is created on first use and reused across calls"""
+    global _process_pool, _process_pool_workers
+    if _process_pool is not None:
+        broken = getattr(_process_pool, "_broken", False)
+        if _process_pool_workers == n_workers and not broken:
+            return _process_pool
+        _process_pool.shutdown(wait=False)
+    else:
+        _atexit.register(_shutdown_process_pool)
+    # Workers must share the resource tracker of this process, or they
+    # would warn about the shared memory blocks they attach to
+    if _os.name == "posix":
+        from multiprocessing import resource_tracker as _resource_tracker
+
+        _resource_tracker.ensure_running()
+    _process_pool = _futures.ProcessPoolExecutor(n_workers)
+    _process_pool_workers = n_workers
+    return _process_pool
+
+
+def _shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+
+
+def has_shared_memory():
+    """Whether multiprocessing.shared_memory, needed by map_shared, exists"""
+    try:
+        from multiprocessing import shared_memory as _shared_memory  # noqa: F401
+    except ImportError:  # Python 3.7
+        return False
+    return True
+
+
+def _to_shared_memory(array):
+    from multiprocessing import shared_memory as _shared_memory  # Python 3.8+
+
+    array = _np.ascontiguousarray(array)
+    shm = _shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    _np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _empty_shared_memory(shape, dtype):
+    from multiprocessing import shared_memory as _shared_memory  # Python 3.8+
+
+    dtype = _np.dtype(dtype)
+    size = int(_np.prod(shape)) * dtype.itemsize
+    shm = _shared_memory.SharedMemory(create=True, size=max(1, size))
+    return shm, (shm.name, shape, dtype.str)
+
+
+def _run_on_shared_memory(function, input_specs, output_specs, start, stop, args):
+    """Runs in a worker process: attaches to the shared arrays and calls
+    function on them"""
+    from multiprocessing import shared_memory as _shared_memory  # Python 3.8+
+
+    shms = [_shared_memory.SharedMemory(name=_[0]) for _ in input_specs + output_specs]
+    try:
+        arrays = [
+            _np.ndarray(shape, dtype, buffer=shm.buf)
+            for shm, (name, shape, dtype) in zip(shms, input_specs + output_specs)
+        ]
+        inputs = arrays[: len(input_specs)]
+        outputs = arrays[len(input_specs) :]
+        function(inputs, outputs, start, stop, *args)
+        del arrays, inputs, outputs  # release the buffers before closing
+    finally:
+        for shm in shms:
+            shm.close()
+
+
+def map_shared(function, inputs, outputs, n_tasks, finish, args=(), n_workers=1):
+    """
+    Runs function(inputs, outputs, start, stop, *args) in the reused process
+    pool for n_tasks consecutive ranges of the first axis of the input
+    arrays. The inputs are copied to shared memory once, and the outputs,
+    given as (shape, dtype), are allocated there, so the workers only
+    receive the names of the blocks and their index range. function must be
+    defined at module level.
+    Returns a future per range, which resolves to finish(outputs, start,
+    stop), computed in this process. finish must copy what it needs from
+    the outputs, as the shared memory is released when all ranges are done.
+    Needs Python 3.8 or later, for multiprocessing.shared_memory (see
+    has_shared_memory).
+    """
+    n_items = len(inputs[0])
+    input_blocks = [_to_shared_memory(_) for _ in inputs]
+    output_blocks = [_empty_shared_memory(*_) for _ in outputs]
+    blocks = input_blocks + output_blocks
+    output_arrays = [
+        _np.ndarray(shape, dtype, buffer=shm.buf)
+        for shm, (name, shape, dtype) in output_blocks
+    ]
+    input_specs = [_[1] for _ in input_blocks]
+    output_specs = [_[1] for _ in output_blocks]
+    bounds = _np.linspace(0, n_items, n_tasks + 1).astype(int)
+    ranges = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a] or [(0, 0)]
+    lock = _threading.Lock()
+    remaining = [len(ranges)]
+
+    def release():
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        del output_arrays[:]
+        for shm, spec in blocks:
+            shm.close()
+            shm.unlink()
+
+    def chain(f, result, start, stop):
+        try:
+            f.result()
+            result.set_result(finish(output_arrays, start, stop))
+        except BaseException as e:
+            result.set_exception(e)
+        finally:
+            release()
+
+    pool = process_pool(n_workers)
+    fs = []
+    for start, stop in ranges:
+        f = pool.submit(
+            _run_on_shared_memory,
+            function,
+            input_specs,
+            output_specs,
+            int(start),
+            int(stop),
+            args,
+        )
+        result = _futures.Future()
+        f.add_done_callback(
+            _functools.partial(chain, result=result, start=start, stop=stop)
+        )
+        fs.append(result)
+    return fs
+
+
 def remove_from_rec(rec_array, name):
     return _drop_fields(rec_array, name, usemask=False, asrecarray=True)
 
@@ -12,19 +12,23 @@ import numba as _numba
 import multiprocessing as _multiprocessing
 import ctypes as _ctypes
 from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
 import threading as _threading
+import queue as _queue
+import functools as _functools
+import mmap as _mmap
 from itertools import chain as _chain
-import matplotlib.pyplot as _plt
 from . import gaussmle as _gaussmle
+from . import gausslq as _gausslq
+from . import avgroi as _avgroi
 from . import io as _io
+from . import lib as _lib
 from . import postprocess as _postprocess
-from . import __main__ as main
 import os
 from datetime import datetime
-from sqlalchemy import create_engine
-import pandas as pd
 
 MAX_LOCS = int(1e6)
+STREAM_CHUNK_SIZE = 1000  # frames per chunk in localize_stream
 
 _C_FLOAT_POINTER = _ctypes.POINTER(_ctypes.c_float)
 LOCS_DTYPE = [
@@ -59,12 +63,11 @@ MEAN_COLS = [
 ]
 SET_COLS = ["Frames", "Height", "Width", "Box Size", "Min. Net Gradient", "Pixelsize"]
 
-_plt.style.use("ggplot")
 
-
-@_numba.jit(nopython=True, nogil=True, cache=False)
-def local_maxima(frame, box):
-    """Finds pixels with maximum value within a region of interest"""
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _local_maxima_argmax(frame, box):
+    """Finds pixels with maximum value within a region of interest
+    by an argmax over the full box at every pixel, O(box**2) per pixel"""
     Y, X = frame.shape
     maxima_map = _np.zeros(frame.shape, _np.uint8)
     box_half = int(box / 2)
@@ -84,14 +87,95 @@ def local_maxima(frame, box):
     return y, x
 
 
-@_numba.jit(nopython=True, nogil=True, cache=False)
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _sliding_max(a, w, g, h, out):
+    """
+    Running maximum out[k] = max(a[k : k + w]) for k in range(len(a) - w + 1)
+    with the van Herk/Gil-Werman algorithm: three comparisons per element,
+    independent of w. g and h are work buffers of the same length as a.
+    """
+    n = len(a)
+    for start in range(0, n, w):
+        stop = min(start + w, n)
+        g[start] = a[start]
+        for k in range(start + 1, stop):
+            g[k] = max(g[k - 1], a[k])
+        h[stop - 1] = a[stop - 1]
+        for k in range(stop - 2, start - 1, -1):
+            h[k] = max(h[k + 1], a[k])
+    for k in range(n - w + 1):
+        out[k] = max(h[k], g[k + w - 1])
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _local_maxima_separable(frame, box):
+    """
+    Same result as _local_maxima_argmax (for odd box sizes) with separable
+    running maxima, O(1) per pixel. argmax returns the first maximum in
+    row-major order, so a pixel is a local maximum if it equals the box
+    maximum and is strictly larger than all pixels in the rows above it
+    and all pixels left of it in its own row.
+    """
+    Y, X = frame.shape
+    box_half = int(box / 2)
+    maxima_map = _np.zeros(frame.shape, _np.uint8)
+    if Y < box or X < box:
+        y, x = _np.where(maxima_map)
+        return y, x
+    n_x = X - box + 1
+    n_y = Y - box + 1
+    # Row-wise running maxima over the box width and over the half box
+    row_max = _np.empty((Y, n_x), dtype=frame.dtype)
+    left_max = _np.empty((Y, X - box_half + 1), dtype=frame.dtype)
+    g = _np.empty(max(X, Y), dtype=frame.dtype)
+    h = _np.empty(max(X, Y), dtype=frame.dtype)
+    for i in range(Y):
+        _sliding_max(frame[i], box, g, h, row_max[i])
+        _sliding_max(frame[i], box_half, g, h, left_max[i])
+    # Column-wise running maxima of the row maxima
+    box_max = _np.empty((n_y, n_x), dtype=frame.dtype)
+    up_max = _np.empty((Y - box_half + 1, n_x), dtype=frame.dtype)
+    column = _np.empty(Y, dtype=frame.dtype)
+    out = _np.empty(Y, dtype=frame.dtype)
+    for j in range(n_x):
+        for i in range(Y):
+            column[i] = row_max[i, j]
+        _sliding_max(column, box, g, h, out)
+        for i in range(n_y):
+            box_max[i, j] = out[i]
+        _sliding_max(column, box_half, g, h, out)
+        for i in range(Y - box_half + 1):
+            up_max[i, j] = out[i]
+    for i in range(box_half, Y - box_half - 1):
+        for j in range(box_half, X - box_half - 1):
+            value = frame[i, j]
+            if (
+                value == box_max[i - box_half, j - box_half]
+                and value > up_max[i - box_half, j - box_half]
+                and value > left_max[i, j - box_half]
+            ):
+                maxima_map[i, j] = 1
+    y, x = _np.where(maxima_map)
+    return y, x
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def local_maxima(frame, box):
+    """Finds pixels with maximum value within a region of interest"""
+    if box % 2 == 1 and box > 1:
+        return _local_maxima_separable(frame, box)
+    # The argmax kernel handles even and trivial boxes in its own way
+    return _local_maxima_argmax(frame, box)
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def gradient_at(frame, y, x, i):
     gy = frame[y + 1, x] - frame[y - 1, x]
     gx = frame[y, x + 1] - frame[y, x - 1]
     return gy, gx
 
 
-@_numba.jit(nopython=True, nogil=True, cache=False)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def net_gradient(frame, y, x, box, uy, ux):
     box_half = int(box / 2)
     ng = _np.zeros(len(x), dtype=_np.float32)
@@ -104,9 +188,35 @@ def net_gradient(frame, y, x, box, uy, ux):
     return ng
 
 
-@_numba.jit(nopython=True, nogil=True, cache=False)
-def identify_in_image(image, minimum_ng, box):
-    y, x = local_maxima(image, box)
+@_numba.jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def net_gradient_fused(frame, y, x, box, weights):
+    """
+    Same as net_gradient, but the central differences and the projection on
+    the unit vectors are folded into one (box + 2) x (box + 2) stencil
+    (see _net_gradient_weights), so every candidate costs one dot product
+    with the frame instead of box**2 gradient evaluations.
+    """
+    box_half_1 = int(box / 2) + 1
+    size = box + 2
+    ng = _np.zeros(len(x), dtype=_np.float32)
+    for i in range(len(x)):
+        y0 = y[i] - box_half_1
+        x0 = x[i] - box_half_1
+        ng_i = _np.float32(0.0)
+        for k in range(size):
+            row = frame[y0 + k]
+            for m in range(size):
+                ng_i += row[x0 + m] * weights[k, m]
+        ng[i] = ng_i
+    return ng
+
+
+@_functools.lru_cache(maxsize=None)
+def _unit_vector_stencils(box):
+    """
+    Unit vectors pointing to the center of the box, cached per box size.
+    The center itself is undefined (nan) and skipped by the kernels.
+    """
     box_half = int(box / 2)
     # Now comes basically a meshgrid
     ux = _np.zeros((box, box), dtype=_np.float32)
@@ -114,62 +224,511 @@ def identify_in_image(image, minimum_ng, box):
     for i in range(box):
         val = box_half - i
         ux[:, i] = uy[i, :] = val
-    unorm = _np.sqrt(ux**2 + uy**2)
-    ux /= unorm
-    uy /= unorm
-    ng = net_gradient(image, y, x, box, uy, ux)
-    positives = ng > minimum_ng
+    with _np.errstate(invalid="ignore"):
+        unorm = _np.sqrt(ux**2 + uy**2)
+        ux /= unorm
+        uy /= unorm
+    ux.flags.writeable = False
+    uy.flags.writeable = False
+    return uy, ux
+
+
+@_functools.lru_cache(maxsize=None)
+def _net_gradient_weights(box):
+    """
+    Stencil w such that the net gradient of a candidate is the sum of w
+    times the (box + 2) x (box + 2) frame region around it:
+    gy(k, m) = f(k + 1, m) - f(k - 1, m) contributes +uy to the pixel below
+    and -uy to the pixel above, and likewise for x. Cached per box size.
+    """
+    uy, ux = _unit_vector_stencils(box)
+    uy = _np.nan_to_num(uy)  # the center is excluded from the net gradient
+    ux = _np.nan_to_num(ux)
+    weights = _np.zeros((box + 2, box + 2), dtype=_np.float64)
+    weights[2:, 1:-1] += uy
+    weights[:-2, 1:-1] -= uy
+    weights[1:-1, 2:] += ux
+    weights[1:-1, :-2] -= ux
+    weights = weights.astype(_np.float32)
+    weights.flags.writeable = False
+    return weights
+
+
+NOISE_CELL_SIZE = 32  # pixels per side of a noise map cell
+NOISE_MAP_INTERVAL = 8  # frames between updates of a noise map
+NOISE_MAP_PERIOD = 64  # frames after which a noise map is estimated anew
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _above_thresholds(y, x, ng, thresholds, cell_size):
+    """
+    Compares the net gradients with the minimum net gradient of the
+    cell_size x cell_size cell of thresholds that contains each spot.
+    The last row and column of cells extend to the edge of the image.
+    """
+    n_y, n_x = thresholds.shape
+    positives = _np.empty(len(ng), dtype=_np.bool_)
+    for i in range(len(ng)):
+        row = min(y[i] // cell_size, n_y - 1)
+        col = min(x[i] // cell_size, n_x - 1)
+        positives[i] = ng[i] > thresholds[row, col]
+    return positives
+
+
+def _uniform_thresholds(minimum_ng):
+    return _np.full((1, 1), minimum_ng, dtype=_np.float64)
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _identify_in_image(image, thresholds, cell_size, box, weights):
+    y, x = local_maxima(image, box)
+    ng = net_gradient_fused(image, y, x, box, weights)
+    positives = _above_thresholds(y, x, ng, thresholds, cell_size)
     y = y[positives]
     x = x[positives]
     ng = ng[positives]
     return y, x, ng
 
 
-def identify_in_frame(frame, minimum_ng, box, roi=None):
+def identify_in_image(image, minimum_ng, box, thresholds=None):
+    """thresholds is a map of minimum net gradients per cell of
+    NOISE_CELL_SIZE pixels which replaces minimum_ng (see _NoiseMap)"""
+    weights = _net_gradient_weights(box)
+    if thresholds is None:
+        thresholds = _uniform_thresholds(minimum_ng)
+    return _identify_in_image(image, thresholds, NOISE_CELL_SIZE, box, weights)
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _identify_in_tile(image, thresholds, cell_size, box, weights, y0, y1, x0, x1):
+    """
+    Identifies the spots whose center lies in rows y0 to y1 and columns
+    x0 to x1 (exclusive) of image. Local maxima are searched in the tile plus
+    a halo of box / 2 + 1 pixels, which covers the box and the last row and
+    column that local_maxima leaves out. The net gradient is computed on
+    the whole image, so the result is the same as without tiles.
+    """
+    Y, X = image.shape
+    halo = int(box / 2) + 1
+    ty0 = max(0, y0 - halo)
+    tx0 = max(0, x0 - halo)
+    ty1 = min(Y, y1 + halo)
+    tx1 = min(X, x1 + halo)
+    y, x = local_maxima(image[ty0:ty1, tx0:tx1], box)
+    y += ty0
+    x += tx0
+    inside = (y >= y0) & (y < y1) & (x >= x0) & (x < x1)
+    y = y[inside]
+    x = x[inside]
+    ng = net_gradient_fused(image, y, x, box, weights)
+    positives = _above_thresholds(y, x, ng, thresholds, cell_size)
+    return y[positives], x[positives], ng[positives]
+
+
+_tile_executor = None  # shared by all tiled identifications, see below
+
+
+def _get_tile_executor():
+    global _tile_executor
+    if _tile_executor is None:
+        _tile_executor = _ThreadPoolExecutor(_n_workers())
+    return _tile_executor
+
+
+def identify_in_image_tiled(image, minimum_ng, box, tile_size, thresholds=None):
+    """
+    Same as identify_in_image, but the image is split into tiles of
+    tile_size x tile_size pixels, which are processed in parallel threads.
+    Each tile only reports spots centered in it, so there are no duplicates.
+    """
+    Y, X = image.shape
+    weights = _net_gradient_weights(box)
+    if thresholds is None:
+        thresholds = _uniform_thresholds(minimum_ng)
+    executor = _get_tile_executor()
+    fs = [
+        executor.submit(
+            _identify_in_tile,
+            image,
+            thresholds,
+            NOISE_CELL_SIZE,
+            box,
+            weights,
+            y0,
+            min(y0 + tile_size, Y),
+            x0,
+            min(x0 + tile_size, X),
+        )
+        for y0 in range(0, Y, tile_size)
+        for x0 in range(0, X, tile_size)
+    ]
+    results = [_.result() for _ in fs]
+    y = _np.concatenate([_[0] for _ in results])
+    x = _np.concatenate([_[1] for _ in results])
+    ng = _np.concatenate([_[2] for _ in results])
+    # Restore the row-major order of identify_in_image
+    order = _np.lexsort((x, y))
+    return y[order], x[order], ng[order]
+
+
+def _frame_image(frame, roi=None):
     if roi is not None:
         frame = frame[roi[0][0] : roi[1][0], roi[0][1] : roi[1][1]]
-    image = _np.float32(frame)  # otherwise numba goes crazy
-    y, x, net_gradient = identify_in_image(image, minimum_ng, box)
+    return _np.float32(frame)  # otherwise numba goes crazy
+
+
+def identify_in_frame(
+    frame, minimum_ng, box, roi=None, tile_size=None, thresholds=None
+):
+    """With tile_size, frames larger than one tile are identified in
+    parallel tiles (see identify_in_image_tiled). thresholds is a map of
+    minimum net gradients within the roi (see _NoiseMap)."""
+    image = _frame_image(frame, roi)
+    if tile_size is not None and max(image.shape) > tile_size:
+        y, x, net_gradient = identify_in_image_tiled(
+            image, minimum_ng, box, tile_size, thresholds
+        )
+    else:
+        y, x, net_gradient = identify_in_image(image, minimum_ng, box, thresholds)
     if roi is not None:
         y += roi[0][0]
         x += roi[0][1]
     return y, x, net_gradient
 
 
-def identify_by_frame_number(movie, minimum_ng, box, frame_number, roi=None):
-    frame = movie[frame_number]
-    y, x, net_gradient = identify_in_frame(frame, minimum_ng, box, roi)
-    frame = frame_number * _np.ones(len(x))
-    return _np.rec.array(
-        (frame, x, y, net_gradient),
-        dtype=[("frame", "i"), ("x", "i"), ("y", "i"), ("net_gradient", "f4")],
-    )
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _estimate_noise(image, cell_size):
+    """
+    Estimates the standard deviation of the pixel noise in cells of
+    cell_size x cell_size pixels from the median absolute difference of
+    horizontal neighbors, which does not depend on the background level
+    and is robust against the few pixels covered by spots
+    """
+    Y, X = image.shape
+    n_y = max(1, Y // cell_size)
+    n_x = max(1, X // cell_size)
+    noise = _np.zeros((n_y, n_x), dtype=_np.float64)
+    for i in range(n_y):
+        y0 = i * cell_size
+        y1 = Y if i == n_y - 1 else y0 + cell_size
+        for j in range(n_x):
+            x0 = j * cell_size
+            x1 = X if j == n_x - 1 else x0 + cell_size
+            if x1 - x0 < 2:
+                continue
+            differences = _np.empty((y1 - y0) * (x1 - x0 - 1), dtype=_np.float32)
+            n = 0
+            for k in range(y0, y1):
+                for m in range(x0, x1 - 1):
+                    differences[n] = abs(image[k, m + 1] - image[k, m])
+                    n += 1
+            # For normal noise, the median absolute difference is 0.954 sigma
+            noise[i, j] = _np.median(differences) / 0.9539
+    return noise
+
+
+class _NoiseMap:
+    """
+    Pixel noise of a movie in cells of NOISE_CELL_SIZE pixels, from which
+    the minimum net gradient of each cell is derived: adaptive_snr times
+    the standard deviation of the net gradient on pure noise, but at least
+    minimum_ng. The map is the running mean of the estimates of every
+    NOISE_MAP_INTERVAL-th frame and starts anew every NOISE_MAP_PERIOD
+    frames. Both count from frame 0, so the thresholds of a frame do not
+    depend on which worker identifies it.
+    """
+
+    def __init__(self, movie, minimum_ng, box, adaptive_snr, roi=None):
+        self.movie = movie
+        self.roi = roi
+        self.minimum_ng = minimum_ng
+        # The net gradient is a weighted sum of pixels (_net_gradient_weights)
+        weights = _np.float64(_net_gradient_weights(box))
+        self.ng_per_noise = adaptive_snr * _np.sqrt(_np.sum(weights**2))
+        self.period = None
+        self.last = None
+        self.noise = None
+        self.n = 0
+        self.thresholds = None
+
+    def _add(self, frame):
+        noise = _estimate_noise(_frame_image(frame, self.roi), NOISE_CELL_SIZE)
+        self.n += 1
+        if self.n == 1:
+            self.noise = noise
+        else:
+            self.noise += (noise - self.noise) / self.n
+
+    def thresholds_at(self, frame_number, frame):
+        """Updates the map up to frame_number, whose frame is given"""
+        period = frame_number // NOISE_MAP_PERIOD
+        if period != self.period or frame_number < self.last:
+            self.period = period
+            self.last = period * NOISE_MAP_PERIOD - NOISE_MAP_INTERVAL
+            self.n = 0
+        latest = frame_number - frame_number % NOISE_MAP_INTERVAL
+        if latest > self.last:
+            first = self.last + NOISE_MAP_INTERVAL
+            for f in range(first, latest + 1, NOISE_MAP_INTERVAL):
+                self._add(frame if f == frame_number else self.movie[f])
+            self.last = latest
+            self.thresholds = _np.maximum(
+                self.minimum_ng, self.ng_per_noise * self.noise
+            )
+        return self.thresholds
 
 
-def _identify_worker(movie, current, minimum_ng, box, roi, lock):
-    n_frames = len(movie)
-    identifications = []
+IDS_DTYPE = [("frame", "i"), ("x", "i"), ("y", "i"), ("net_gradient", "f4")]
+IDENTIFY_BLOCK_SIZE = 64  # max. number of frames a worker claims at once
+PREVIEW_TILE_SIZE = 512  # tile size for single frame previews
+
+
+def identify_by_frame_number(
+    movie,
+    minimum_ng,
+    box,
+    frame_number,
+    roi=None,
+    tile_size=None,
+    adaptive_snr=None,
+    noise_map=None,
+):
+    """With adaptive_snr, the minimum net gradient adapts to the local noise
+    (see _NoiseMap). A noise_map of the movie can be passed to reuse it for
+    consecutive frames, which only reads the frames it has not seen."""
+    frame = movie[frame_number]
+    thresholds = None
+    if adaptive_snr is not None:
+        if noise_map is None:
+            noise_map = _NoiseMap(movie, minimum_ng, box, adaptive_snr, roi)
+        thresholds = noise_map.thresholds_at(frame_number, frame)
+    y, x, net_gradient = identify_in_frame(
+        frame, minimum_ng, box, roi, tile_size, thresholds
+    )
+    frame = frame_number * _np.ones(len(x))
+    return _np.rec.array((frame, x, y, net_gradient), dtype=IDS_DTYPE)
+
+
+class _IdentificationBuffer:
+    """
+    Growable column buffers that one worker fills with the identifications
+    of the frame blocks it processes. Blocks are recorded as
+    (first frame, start, stop) so that identifications_from_futures can
+    assemble them in frame order without sorting.
+    """
+
+    def __init__(self, capacity=1024):
+        self.frame = _np.empty(capacity, dtype=_np.int32)
+        self.x = _np.empty(capacity, dtype=_np.int32)
+        self.y = _np.empty(capacity, dtype=_np.int32)
+        self.net_gradient = _np.empty(capacity, dtype=_np.float32)
+        self.n = 0
+        self.blocks = []
+
+    def _grow(self, n_min):
+        capacity = max(2 * len(self.frame), n_min)
+        for name in ("frame", "x", "y", "net_gradient"):
+            old = getattr(self, name)
+            new = _np.empty(capacity, dtype=old.dtype)
+            new[: self.n] = old[: self.n]
+            setattr(self, name, new)
+
+    def append(self, frame_number, y, x, net_gradient):
+        n_new = len(x)
+        end = self.n + n_new
+        if end > len(self.frame):
+            self._grow(end)
+        self.frame[self.n : end] = frame_number
+        self.x[self.n : end] = x
+        self.y[self.n : end] = y
+        self.net_gradient[self.n : end] = net_gradient
+        self.n = end
+
+
+def _identify_worker(
+    movie,
+    current,
+    minimum_ng,
+    box,
+    roi,
+    lock,
+    stop=None,
+    block_size=None,
+    adaptive_snr=None,
+):
+    """Claims blocks of consecutive frames until frame stop (default: all)"""
+    if stop is None:
+        stop = len(movie)
+    if block_size is None:
+        block_size = IDENTIFY_BLOCK_SIZE
+    buffer = _IdentificationBuffer()
+    noise_map = None
+    if adaptive_snr is not None:
+        noise_map = _NoiseMap(movie, minimum_ng, box, adaptive_snr, roi)
+    thresholds = None
     while True:
         with lock:
-            index = current[0]
-            if index == n_frames:
-                return identifications
-            current[0] += 1
-        identifications.append(
-            identify_by_frame_number(movie, minimum_ng, box, index, roi)
+            first = current[0]
+            if first >= stop:
+                return buffer
+            last = min(first + block_size, stop)
+            current[0] = last
+        block_start = buffer.n
+        for frame_number in range(first, last):
+            frame = movie[frame_number]
+            if noise_map is not None:
+                thresholds = noise_map.thresholds_at(frame_number, frame)
+            y, x, ng = identify_in_frame(
+                frame, minimum_ng, box, roi, thresholds=thresholds
+            )
+            buffer.append(frame_number, y, x, ng)
+        buffer.blocks.append((first, block_start, buffer.n))
+
+
+def _block_size(n_frames, n_workers):
+    """Blocks are small enough that every worker gets several of them"""
+    return int(max(1, min(IDENTIFY_BLOCK_SIZE, n_frames / (4 * n_workers))))
+
+
+def _movie_source(movie):
+    """
+    Returns what a worker process needs to open its own handle of the movie,
+    or None if the movie only exists in the memory of this process
+    """
+    if isinstance(movie, (_io.TiffMap, _io.TiffMultiMap)):
+        return (type(movie).__name__, movie.path)
+    # Only a memmap of a whole file has the mmap as base, not a slice of it
+    if isinstance(movie, _np.memmap) and isinstance(movie.base, _mmap.mmap):
+        return ("memmap", movie.filename, movie.dtype.str, movie.shape, movie.offset)
+    return None
+
+
+def _prefetches(movie):
+    """
+    Whether frames of the movie are read ahead (see io.FramePrefetcher).
+    Arrays and memory-mapped TIFF files are sliced without copies instead.
+    """
+    if isinstance(movie, _np.ndarray):
+        return False
+    maps = movie.maps if isinstance(movie, _io.TiffMultiMap) else [movie]
+    return not all([getattr(_, "stack", None) is not None for _ in maps])
+
+
+_process_movies = {}  # movie handles of a worker process, by source
+
+
+def _open_movie_source(source):
+    if source not in _process_movies:
+        kind = source[0]
+        if kind == "TiffMap":
+            movie = _io.TiffMap(source[1])
+        elif kind == "TiffMultiMap":
+            movie = _io.TiffMultiMap(source[1], memmap_frames=False)
+        else:
+            kind, path, dtype, shape, offset = source
+            movie = _np.memmap(path, dtype, "r", offset=offset, shape=shape)
+        _process_movies[source] = movie
+    return _process_movies[source]
+
+
+def _identify_block_in_process(
+    source, minimum_ng, box, roi, first, last, adaptive_snr=None
+):
+    """
+    Runs in a worker process: identifies spots in frames first to last
+    (exclusive) and returns them as an array of IDS_DTYPE, which is small
+    enough to be sent back to the parent process
+    """
+    movie = _open_movie_source(source)
+    buffer = _identify_worker(
+        movie,
+        [first],
+        minimum_ng,
+        box,
+        roi,
+        _threading.Lock(),
+        last,
+        last - first,
+        adaptive_snr,
+    )
+    n = buffer.n
+    ids = _np.empty(n, dtype=IDS_DTYPE)
+    ids["frame"] = buffer.frame[:n]
+    ids["x"] = buffer.x[:n]
+    ids["y"] = buffer.y[:n]
+    ids["net_gradient"] = buffer.net_gradient[:n]
+    return first, ids
+
+
+def _submit_identify_blocks(
+    executor,
+    source,
+    minimum_ng,
+    box,
+    roi,
+    start,
+    stop,
+    block_size,
+    current=None,
+    adaptive_snr=None,
+):
+    """Submits frame blocks to a process pool. If given, current[0] counts
+    the frames of finished blocks."""
+    fs = []
+    for first in range(start, stop, block_size):
+        last = min(first + block_size, stop)
+        f = executor.submit(
+            _identify_block_in_process,
+            source,
+            minimum_ng,
+            box,
+            roi,
+            first,
+            last,
+            adaptive_snr,
         )
-    return identifications
+        if current is not None:
+
+            def count_frames(f, n=last - first):
+                current[0] += n
+
+            f.add_done_callback(count_frames)
+        fs.append(f)
+    return fs
 
 
 def identifications_from_futures(futures):
-    ids_list_of_lists = [_.result() for _ in futures]
-    ids_list = list(_chain(*ids_list_of_lists))
-    ids = _np.hstack(ids_list).view(_np.recarray)
-    ids.sort(kind="mergesort", order="frame")
+    """
+    Assembles the frame blocks of thread workers (buffers) and process
+    workers (arrays) in frame order
+    """
+    blocks = []
+    for result in [_.result() for _ in futures]:
+        if isinstance(result, _IdentificationBuffer):
+            for first, start, stop in result.blocks:
+                blocks.append((first, stop - start, result, start))
+        else:
+            first, block_ids = result
+            blocks.append((first, len(block_ids), block_ids, 0))
+    blocks.sort(key=lambda _: _[0])
+    n_ids = sum([_[1] for _ in blocks])
+    ids = _np.recarray(n_ids, dtype=IDS_DTYPE)
+    offset = 0
+    for first, n, source, start in blocks:
+        end = offset + n
+        if isinstance(source, _IdentificationBuffer):
+            stop = start + n
+            ids.frame[offset:end] = source.frame[start:stop]
+            ids.x[offset:end] = source.x[start:stop]
+            ids.y[offset:end] = source.y[start:stop]
+            ids.net_gradient[offset:end] = source.net_gradient[start:stop]
+        else:
+            ids[offset:end] = source
+        offset = end
     return ids
 
 
-def identify_async(movie, minimum_ng, box, roi=None):
+def _n_workers():
     "Use the user settings to define the number of workers that are being used"
     settings = _io.load_user_settings()
 
@@ -183,86 +742,176 @@ def identify_async(movie, minimum_ng, box, roi=None):
     settings["Localize"]["cpu_utilization"] = cpu_utilization
     _io.save_user_settings(settings)
 
-    n_workers = max(1, int(cpu_utilization * _multiprocessing.cpu_count()))
+    return max(1, int(cpu_utilization * _multiprocessing.cpu_count()))
 
+
+def identify_async(
+    movie, minimum_ng, box, roi=None, processes=False, adaptive_snr=None
+):
+    """
+    Identifies spots in all frames in the background. With processes=True,
+    frame blocks are identified in worker processes, which open their own
+    handle of the movie file. This scales better than threads for movies
+    whose frame access holds the GIL, such as TIFF files. Otherwise, frames
+    of movies that are not arrays or memory-mapped are read ahead (see
+    io.FramePrefetcher), in blocks that fit the read ahead window.
+    With adaptive_snr, the minimum net gradient adapts to the local noise
+    (see _NoiseMap), so fewer candidates are found in noisy regions.
+    """
+    n_workers = _n_workers()
+    n_frames = len(movie)
+    block_size = _block_size(n_frames, n_workers)
     current = [0]
+    if processes:
+        source = _movie_source(movie)
+        if source is None:
+            print("Movie is not backed by a file. Identifying with threads.")
+        else:
+            executor = _ProcessPoolExecutor(n_workers)
+            f = _submit_identify_blocks(
+                executor,
+                source,
+                minimum_ng,
+                box,
+                roi,
+                0,
+                n_frames,
+                block_size,
+                current,
+                adaptive_snr,
+            )
+            executor.shutdown(wait=False)
+            return current, f
+    prefetcher = None
+    if _prefetches(movie):
+        movie = prefetcher = _io.FramePrefetcher(movie, range(n_frames))
+        # The blocks that all workers claim have to fit the read ahead window
+        block_size = max(1, min(block_size, prefetcher.window // (n_workers + 1)))
     executor = _ThreadPoolExecutor(n_workers)
     lock = _threading.Lock()
     f = [
-        executor.submit(_identify_worker, movie, current, minimum_ng, box, roi, lock)
+        executor.submit(
+            _identify_worker,
+            movie,
+            current,
+            minimum_ng,
+            box,
+            roi,
+            lock,
+            n_frames,
+            block_size,
+            adaptive_snr,
+        )
         for _ in range(n_workers)
     ]
     executor.shutdown(wait=False)
+    if prefetcher is not None:
+        _close_when_done(prefetcher, f)
     return current, f
 
 
-def identify(movie, minimum_ng, box, threaded=True):
+def _close_when_done(resource, futures):
+    """Closes resource once all futures are done"""
+    remaining = [len(futures)]
+    lock = _threading.Lock()
+
+    def done(f):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                resource.close()
+
+    for f in futures:
+        f.add_done_callback(done)
+
+
+def identify(movie, minimum_ng, box, threaded=True, processes=False, adaptive_snr=None):
     if threaded:
-        current, futures = identify_async(movie, minimum_ng, box)
-        identifications = [_.result() for _ in futures]
-        identifications = [_np.hstack(_) for _ in identifications]
+        current, futures = identify_async(
+            movie, minimum_ng, box, processes=processes, adaptive_snr=adaptive_snr
+        )
+        return identifications_from_futures(futures)
     else:
+        noise_map = None
+        if adaptive_snr is not None:
+            noise_map = _NoiseMap(movie, minimum_ng, box, adaptive_snr)
         identifications = [
-            identify_by_frame_number(movie, minimum_ng, box, i)
+            identify_by_frame_number(
+                movie,
+                minimum_ng,
+                box,
+                i,
+                adaptive_snr=adaptive_snr,
+                noise_map=noise_map,
+            )
             for i in range(len(movie))
         ]
     return _np.hstack(identifications).view(_np.recarray)
 
 
-@_numba.jit(nopython=True, cache=False)
-def _cut_spots_numba(movie, ids_frame, ids_x, ids_y, box):
-    n_spots = len(ids_x)
+SPOT_BATCH_SIZE = 10000  # spots per batch in iter_spots
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _cut_spots_numba(movie, ids_frame, ids_x, ids_y, box, spots):
     r = int(box / 2)
-    spots = _np.zeros((n_spots, box, box), dtype=movie.dtype)
     for id, (frame, xc, yc) in enumerate(zip(ids_frame, ids_x, ids_y)):
         spots[id] = movie[frame, yc - r : yc + r + 1, xc - r : xc + r + 1]
     return spots
 
 
-@_numba.jit(nopython=True, cache=False)
-def _cut_spots_frame(frame, frame_number, ids_frame, ids_x, ids_y, r, start, N, spots):
-    for j in range(start, N):
-        if ids_frame[j] > frame_number:
-            break
-        if ids_frame[j] < frame_number:
-            break
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _cut_spots_frame(frame, ids_x, ids_y, r, start, stop, spots, offset):
+    """Cuts the spots of identifications start to stop, which all belong to
+    frame, into spots[offset:], casting them to the dtype of spots"""
+    for j in range(start, stop):
         yc = ids_y[j]
         xc = ids_x[j]
-        spots[j] = frame[yc - r : yc + r + 1, xc - r : xc + r + 1]
-    return j
+        spots[offset + j - start] = frame[yc - r : yc + r + 1, xc - r : xc + r + 1]
+
+
+def _frame_ranges(ids_frame):
+    """Frame numbers and start and stop indices of consecutive runs of
+    identifications in the same frame"""
+    starts = _np.flatnonzero(_np.diff(ids_frame, prepend=ids_frame[:1] - 1))
+    stops = _np.append(starts[1:], len(ids_frame))
+    return ids_frame[starts], starts, stops
 
 
 def _cut_spots(movie, ids, box):
+    """
+    Cuts spots into a float32 array. Only frames with identifications are
+    read, each of them once, if identifications are in order of frames.
+    Frames of movies that are not arrays or memory-mapped are read ahead in
+    the background (see io.FramePrefetcher).
+    """
+    N = len(ids)
+    spots = _np.empty((N, box, box), dtype=_np.float32)
+    if N == 0:
+        return spots
     if isinstance(movie, _np.ndarray):
-        return _cut_spots_numba(movie, ids.frame, ids.x, ids.y, box)
-    else:
-        """Assumes that identifications are in order of frames!"""
-        r = int(box / 2)
-        N = len(ids.frame)
-        spots = _np.zeros((N, box, box), dtype=movie.dtype)
-        start = 0
-        for frame_number, frame in enumerate(movie):
-            start = _cut_spots_frame(
-                frame,
-                frame_number,
-                ids.frame,
-                ids.x,
-                ids.y,
-                r,
-                start,
-                N,
-                spots,
-            )
+        return _cut_spots_numba(movie, ids.frame, ids.x, ids.y, box, spots)
+    r = int(box / 2)
+    frame_numbers, starts, stops = _frame_ranges(ids.frame)
+    if not _prefetches(movie):
+        for frame_number, start, stop in zip(frame_numbers, starts, stops):
+            frame = movie[frame_number]
+            _cut_spots_frame(frame, ids.x, ids.y, r, start, stop, spots, start)
         return spots
+    with _io.FramePrefetcher(movie, frame_numbers) as frames:
+        for frame_number, start, stop in zip(frame_numbers, starts, stops):
+            frame = frames[frame_number]
+            _cut_spots_frame(frame, ids.x, ids.y, r, start, stop, spots, start)
+    return spots
 
 
 def _to_photons(spots, camera_info):
-    spots = _np.float32(spots)
-    baseline = camera_info["baseline"]
-    sensitivity = camera_info["sensitivity"]
-    gain = camera_info["gain"]
-    qe = camera_info["qe"]
-    return (spots - baseline) * sensitivity / (gain * qe)
+    """Converts spots to photons. float32 spots are converted in place."""
+    spots = _np.asarray(spots, dtype=_np.float32)
+    spots -= camera_info["baseline"]
+    spots *= camera_info["sensitivity"]
+    spots /= camera_info["gain"] * camera_info["qe"]
+    return spots
 
 
 def get_spots(movie, identifications, box, camera_info):
@@ -270,6 +919,72 @@ def get_spots(movie, identifications, box, camera_info):
     return _to_photons(spots, camera_info)
 
 
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _maps_to_photons(spots, maps, ids_x, ids_y, factor, variances):
+    """Converts spots to photons with the baseline and sensitivity maps at
+    the spot positions and writes the readout variance in photons^2"""
+    box = spots.shape[1]
+    r = int(box / 2)
+    for n in range(len(spots)):
+        y0 = ids_y[n] - r
+        x0 = ids_x[n] - r
+        for i in range(box):
+            for j in range(box):
+                scale = maps[2, y0 + i, x0 + j] * factor
+                spots[n, i, j] = (spots[n, i, j] - maps[0, y0 + i, x0 + j]) * scale
+                variances[n, i, j] = maps[1, y0 + i, x0 + j] * scale**2
+
+
+def get_spots_and_variances(movie, identifications, box, camera_info):
+    """
+    Cuts spots in photons for an sCMOS camera with per-pixel calibration
+    maps in camera_info["maps"] (see io.load_camera_maps), which replace
+    the scalar baseline and sensitivity. Returns the spots and the readout
+    variance of each spot pixel in photons^2. The maps are read at the
+    spot positions only, so they can stay memory-mapped.
+    """
+    maps = _np.asarray(camera_info["maps"])
+    if len(movie) > 0 and maps.shape[1:] != movie[0].shape:
+        raise ValueError("Camera maps do not match the frame size.")
+    spots = _cut_spots(movie, identifications, box)
+    variances = _np.empty_like(spots)
+    factor = 1 / (camera_info["gain"] * camera_info["qe"])
+    _maps_to_photons(
+        spots, maps, identifications.x, identifications.y, factor, variances
+    )
+    return spots, variances
+
+
+def iter_spots(movie, identifications, box, camera_info, batch_size=SPOT_BATCH_SIZE):
+    """
+    Yields (index, spots) for batches of at most batch_size spots in photons,
+    where index is the position of the first spot of the batch in
+    identifications. Only frames with identifications are read.
+    All batches are views of the same buffer, so a batch has to be used
+    (or copied) before the next one is requested.
+    """
+    ids = identifications
+    if len(ids) == 0:
+        return
+    r = int(box / 2)
+    buffer = _np.empty((min(batch_size, len(ids)), box, box), dtype=_np.float32)
+    index = 0
+    offset = 0
+    for frame_number, start, stop in zip(*_frame_ranges(ids.frame)):
+        frame = movie[frame_number]
+        while start < stop:
+            n = min(stop - start, len(buffer) - offset)
+            _cut_spots_frame(frame, ids.x, ids.y, r, start, start + n, buffer, offset)
+            start += n
+            offset += n
+            if offset == len(buffer):
+                yield index, _to_photons(buffer, camera_info)
+                index += offset
+                offset = 0
+    if offset > 0:
+        yield index, _to_photons(buffer[:offset], camera_info)
+
+
 def fit(
     movie,
     camera_info,
@@ -279,10 +994,19 @@ def fit(
     max_it=100,
     method="sigma",
 ):
-    spots = get_spots(movie, identifications, box, camera_info)
-    theta, CRLBs, likelihoods, iterations = _gaussmle.gaussmle(
-        spots, eps, max_it, method=method
-    )
+    N = len(identifications)
+    theta = _np.zeros((N, 6), dtype=_np.float32)
+    CRLBs = _np.zeros((N, 6), dtype=_np.float32)
+    likelihoods = _np.zeros(N, dtype=_np.float32)
+    iterations = _np.zeros(N, dtype=_np.int32)
+    for index, spots in iter_spots(movie, identifications, box, camera_info):
+        batch = slice(index, index + len(spots))
+        (
+            theta[batch],
+            CRLBs[batch],
+            likelihoods[batch],
+            iterations[batch],
+        ) = _gaussmle.gaussmle(spots, eps, max_it, method=method)
     return locs_from_fits(identifications, theta, CRLBs, likelihoods, iterations, box)
 
 
@@ -300,32 +1024,624 @@ def fit_async(
 
 
 def locs_from_fits(identifications, theta, CRLBs, likelihoods, iterations, box):
-    box_offset = int(box / 2)
-    y = theta[:, 0] + identifications.y - box_offset
-    x = theta[:, 1] + identifications.x - box_offset
-    lpy = _np.sqrt(CRLBs[:, 0])
-    lpx = _np.sqrt(CRLBs[:, 1])
-    locs = _np.rec.array(
-        (
-            identifications.frame,
-            x,
-            y,
-            theta[:, 2],
-            theta[:, 5],
-            theta[:, 4],
-            theta[:, 3],
-            lpx,
-            lpy,
-            identifications.net_gradient,
-            likelihoods,
-            iterations,
-        ),
-        dtype=LOCS_DTYPE,
+    locs = _lib.build_locs(
+        identifications,
+        LOCS_DTYPE,
+        theta[:, 1],
+        theta[:, 0],
+        box_offset=int(box / 2),
+        photons=theta[:, 2],
+        sx=theta[:, 5],
+        sy=theta[:, 4],
+        bg=theta[:, 3],
+        lpx=CRLBs[:, 1],
+        lpy=CRLBs[:, 0],
+        likelihood=likelihoods,
+        iterations=iterations,
     )
-    locs.sort(kind="mergesort", order="frame")
+    with _np.errstate(invalid="ignore"):
+        _np.sqrt(locs.lpx, out=locs.lpx)
+        _np.sqrt(locs.lpy, out=locs.lpy)
     return locs
 
 
+def _identify_chunk(
+    movie,
+    minimum_ng,
+    box,
+    start,
+    stop,
+    executor,
+    n_workers,
+    roi=None,
+    source=None,
+    adaptive_snr=None,
+):
+    """Identifies spots in frames start to stop (exclusive) on the threads
+    of executor, or on its processes if the movie source is given.
+    The identifications are returned sorted by frame."""
+    block_size = _block_size(stop - start, n_workers)
+    if source is not None:
+        fs = _submit_identify_blocks(
+            executor,
+            source,
+            minimum_ng,
+            box,
+            roi,
+            start,
+            stop,
+            block_size,
+            adaptive_snr=adaptive_snr,
+        )
+        return identifications_from_futures(fs)
+    current = [start]
+    lock = _threading.Lock()
+    fs = [
+        executor.submit(
+            _identify_worker,
+            movie,
+            current,
+            minimum_ng,
+            box,
+            roi,
+            lock,
+            stop,
+            block_size,
+            adaptive_snr,
+        )
+        for _ in range(n_workers)
+    ]
+    return identifications_from_futures(fs)
+
+
+def _fit_spots_in_pool(fit_spots, spots, executor, n_tasks):
+    """Fits spots with a thread pool that lives across chunks"""
+    fs = [executor.submit(fit_spots, _) for _ in _np.array_split(spots, n_tasks)]
+    return _np.vstack([_.result() for _ in fs])
+
+
+def _previous_frame_links(ids):
+    """Index of an identification at most one pixel away in the previous
+    frame, preferring the same pixel, or -1. This links the spots of one
+    emitter across the frames of a binding event."""
+    n = len(ids)
+    links = _np.full(n, -1, dtype=_np.int64)
+    if n == 0:
+        return links
+    frame = ids.frame.astype(_np.int64)
+    y = ids.y.astype(_np.int64) + 1
+    x = ids.x.astype(_np.int64) + 1
+    height = y.max() + 2
+    width = x.max() + 2
+    keys = (frame * height + y) * width + x
+    order = _np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    offsets = [(0, 0)] + [
+        (dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx
+    ]
+    for dy, dx in offsets:
+        query = ((frame - 1) * height + y + dy) * width + x + dx
+        i = _np.minimum(_np.searchsorted(sorted_keys, query), n - 1)
+        found = (sorted_keys[i] == query) & (links < 0)
+        links[found] = order[i[found]]
+    return links
+
+
+def _link_depths(links):
+    """Number of linked spots before each spot"""
+    depths = _np.zeros(len(links), dtype=_np.int64)
+    linked = links >= 0
+    while True:
+        new_depths = _np.where(linked, depths[links] + 1, 0)
+        if _np.array_equal(new_depths, depths):
+            return depths
+        depths = new_depths
+
+
+def _fit_mle(
+    spots, ids, eps, max_it, executor, n_workers, warm_start, variances, rejection
+):
+    """
+    Fits spots with gaussmle and returns the fits with their stop reasons.
+    With warm_start="lq", the fits start from least squares fits. With
+    warm_start="previous", spots that are linked to a spot in the previous
+    frame start from its fit; these are fit in stages of increasing link
+    depth, each stage in parallel. sCMOS variances and rejection limits
+    are passed to gaussmle.
+    """
+    kwargs = {
+        "executor": executor,
+        "n_workers": n_workers,
+        "return_stop_reasons": True,
+        "rejection": rejection,
+    }
+    if warm_start in [None, "centroid"]:
+        return _gaussmle.gaussmle_parallel(
+            spots, eps, max_it, variances=variances, **kwargs
+        )
+    elif warm_start == "lq":
+        theta = _fit_spots_in_pool(_gausslq.fit_spots, spots, executor, 4 * n_workers)
+        initial_thetas = _gaussmle.initial_thetas_from_lq(theta, spots.shape[1])
+        return _gaussmle.gaussmle_parallel(
+            spots,
+            eps,
+            max_it,
+            initial_thetas=initial_thetas,
+            variances=variances,
+            **kwargs,
+        )
+    elif warm_start == "previous":
+        links = _previous_frame_links(ids)
+        depths = _link_depths(links)
+        N = len(spots)
+        fits = (
+            _np.zeros((N, 6), dtype=_np.float32),
+            _np.zeros((N, 6), dtype=_np.float32),
+            _np.zeros(N, dtype=_np.float32),
+            _np.zeros(N, dtype=_np.int32),
+            _np.zeros(N, dtype=_np.uint8),
+        )
+        thetas, stop_reasons = fits[0], fits[4]
+        for depth in range(depths.max(initial=-1) + 1):
+            index = _np.flatnonzero(depths == depth)
+            initial_thetas = None
+            if depth > 0:
+                previous = links[index]
+                initial_thetas = thetas[previous]
+                initial_thetas[:, 0] += ids.y[previous] - ids.y[index]
+                initial_thetas[:, 1] += ids.x[previous] - ids.x[index]
+                unconverged = stop_reasons[previous] != _gaussmle.STOP_CONVERGED
+                initial_thetas[unconverged] = _np.nan
+                # photons and background change between frames of an event
+                initial_thetas[:, 2:4] = _np.nan
+            stage_fits = _gaussmle.gaussmle_parallel(
+                spots[index],
+                eps,
+                max_it,
+                initial_thetas=initial_thetas,
+                variances=None if variances is None else variances[index],
+                **kwargs,
+            )
+            for array, stage_array in zip(fits, stage_fits):
+                array[index] = stage_array
+        return fits
+    raise ValueError("Warm start not available.")
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _find_root(labels, i):
+    while labels[i] != i:
+        labels[i] = labels[labels[i]]
+        i = labels[i]
+    return i
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _overlap_labels(ids_frame, ids_x, ids_y, box):
+    """Labels identifications, which are sorted by frame, with the smallest
+    index of their group of overlapping boxes in the same frame"""
+    N = len(ids_frame)
+    labels = _np.arange(N)
+    start = 0
+    while start < N:
+        stop = start + 1
+        while stop < N and ids_frame[stop] == ids_frame[start]:
+            stop += 1
+        for i in range(start, stop):
+            for j in range(i + 1, stop):
+                if abs(ids_x[i] - ids_x[j]) < box and abs(ids_y[i] - ids_y[j]) < box:
+                    root_i = _find_root(labels, i)
+                    root_j = _find_root(labels, j)
+                    labels[max(root_i, root_j)] = min(root_i, root_j)
+        start = stop
+    for i in range(N):
+        labels[i] = _find_root(labels, i)
+    return labels
+
+
+def overlap_groups(identifications, box, max_emitters, shape):
+    """
+    Groups identifications whose boxes overlap in the same frame, for
+    multi-emitter fits. Returns the members of each group, as indices of
+    identifications sorted by net gradient and padded with -1, and one
+    identification per group at the center of its ROI, a box of
+    2 * box - 1 pixels that contains the boxes of all members and lies
+    within frames of the given shape. Groups of more than max_emitters
+    identifications or too wide for their ROI are left out, so their
+    identifications are fit individually.
+    """
+    ids = identifications
+    roi_box = 2 * box - 1
+    members = -_np.ones((0, max_emitters), dtype=_np.int64)
+    roi_ids = _np.recarray(0, dtype=IDS_DTYPE)
+    if len(ids) == 0 or max_emitters < 2 or min(shape) < roi_box:
+        return members, roi_ids
+    labels = _overlap_labels(ids.frame, ids.x, ids.y, box)
+    order = _np.lexsort((-ids.net_gradient, labels))
+    _, starts, stops = _frame_ranges(labels[order])
+    x = ids.x[order]
+    y = ids.y[order]
+    min_x = _np.minimum.reduceat(x, starts)
+    max_x = _np.maximum.reduceat(x, starts)
+    min_y = _np.minimum.reduceat(y, starts)
+    max_y = _np.maximum.reduceat(y, starts)
+    sizes = stops - starts
+    grouped = (
+        (sizes >= 2)
+        & (sizes <= max_emitters)
+        & (max_x - min_x < box)
+        & (max_y - min_y < box)
+    )
+    group_index = _np.cumsum(grouped) - 1
+    element_group = _np.repeat(_np.arange(len(sizes)), sizes)
+    in_group = grouped[element_group]
+    rank = _np.arange(len(ids)) - _np.repeat(starts, sizes)
+    members = -_np.ones((grouped.sum(), max_emitters), dtype=_np.int64)
+    members[group_index[element_group[in_group]], rank[in_group]] = order[in_group]
+    roi_ids = _np.recarray(len(members), dtype=IDS_DTYPE)
+    roi_ids.frame = ids.frame[order[starts[grouped]]]
+    roi_ids.x = _np.clip((min_x + max_x)[grouped] // 2, box - 1, shape[1] - box)
+    roi_ids.y = _np.clip((min_y + max_y)[grouped] // 2, box - 1, shape[0] - box)
+    roi_ids.net_gradient = ids.net_gradient[members[:, 0]]
+    return members, roi_ids
+
+
+def _cut_overlap_groups(movie, ids, box, camera_info, max_emitters):
+    """Groups overlapping identifications and cuts their ROIs for
+    _fit_overlap_groups"""
+    shape = movie[0].shape if len(movie) > 0 else (0, 0)
+    members, roi_ids = overlap_groups(ids, box, max_emitters, shape)
+    if camera_info.get("maps") is None:
+        rois = get_spots(movie, roi_ids, 2 * box - 1, camera_info)
+        roi_variances = None
+    else:
+        rois, roi_variances = get_spots_and_variances(
+            movie, roi_ids, 2 * box - 1, camera_info
+        )
+    return members, roi_ids, rois, roi_variances
+
+
+def _fit_overlap_groups(
+    groups, ids, eps, max_it, initial_sigma, executor, n_workers, rejection
+):
+    """Fits the ROIs of overlapping identifications with gaussmle_multi and
+    returns the locs of the selected emitters that are not rejected"""
+    members, roi_ids, rois, roi_variances = groups
+    roi_box = rois.shape[1]
+    r = int(roi_box / 2)
+    member_ids = ids[_np.maximum(members, 0)]
+    initial_positions = _np.empty(members.shape + (2,), dtype=_np.float32)
+    initial_positions[..., 0] = member_ids.y - (roi_ids.y - r)[:, _np.newaxis]
+    initial_positions[..., 1] = member_ids.x - (roi_ids.x - r)[:, _np.newaxis]
+    fits = _gaussmle.gaussmle_multi(
+        rois,
+        initial_positions,
+        (members >= 0).sum(axis=1),
+        eps,
+        max_it,
+        initial_sigma=initial_sigma,
+        variances=roi_variances,
+        executor=executor,
+        n_workers=n_workers,
+        rejection=rejection,
+    )
+    thetas, CRLBs, likelihoods, iterations, n_emitters, stop_reasons = fits
+    selected = _np.arange(members.shape[1]) < n_emitters[:, _np.newaxis]
+    selected &= stop_reasons != _gaussmle.STOP_REJECTED
+    group, emitter = _np.nonzero(selected)
+    emitter_ids = roi_ids[group]
+    # emitters are fit in order of the net gradient of the identifications
+    emitter_ids.net_gradient = member_ids.net_gradient[group, emitter]
+    return locs_from_fits(
+        emitter_ids,
+        thetas[group, emitter],
+        CRLBs[group, emitter],
+        likelihoods[group],
+        iterations[group],
+        roi_box,
+    )
+
+
+def _fit_chunk(
+    spots,
+    ids,
+    box,
+    camera_info,
+    fit_method,
+    eps,
+    max_it,
+    executor,
+    n_workers,
+    warm_start=None,
+    iteration_histogram=None,
+    variances=None,
+    groups=None,
+    rejection=None,
+):
+    if fit_method == "mle":
+        all_ids = ids
+        if groups is not None:
+            # identifications in groups of overlapping spots are fit jointly
+            single = _np.ones(len(ids), dtype=bool)
+            single[groups[0][groups[0] >= 0]] = False
+            ids = ids[single]
+            spots = spots[single]
+            if variances is not None:
+                variances = variances[single]
+        thetas, CRLBs, likelihoods, iterations, stop_reasons = _fit_mle(
+            spots,
+            ids,
+            eps,
+            max_it,
+            executor,
+            n_workers,
+            warm_start,
+            variances,
+            rejection,
+        )
+        if iteration_histogram is not None:
+            iteration_histogram.add(iterations, stop_reasons)
+        if rejection is not None:
+            # rejected fits are dropped before any locs are created
+            accepted = stop_reasons != _gaussmle.STOP_REJECTED
+            ids = ids[accepted]
+            thetas = thetas[accepted]
+            CRLBs = CRLBs[accepted]
+            likelihoods = likelihoods[accepted]
+            iterations = iterations[accepted]
+            stop_reasons = stop_reasons[accepted]
+        locs = locs_from_fits(ids, thetas, CRLBs, likelihoods, iterations, box)
+        if groups is None or len(groups[0]) == 0:
+            return locs
+        # the width of the single spots is a good start for overlapping ones
+        converged = stop_reasons == _gaussmle.STOP_CONVERGED
+        initial_sigma = _np.median(thetas[converged, 4]) if converged.any() else 1.0
+        multi_locs = _fit_overlap_groups(
+            groups,
+            all_ids,
+            eps,
+            max_it,
+            initial_sigma,
+            executor,
+            n_workers,
+            rejection,
+        )
+        locs = _np.hstack((locs, multi_locs)).view(_np.recarray)
+        locs.sort(kind="mergesort", order="frame")
+        return locs
+    elif fit_method in ["lq", "lq-3d"]:
+        theta = _fit_spots_in_pool(_gausslq.fit_spots, spots, executor, 4 * n_workers)
+        return _gausslq.locs_from_fits(ids, theta, box, camera_info["gain"])
+    elif fit_method in ["lq-gpu", "lq-gpu-3d"]:
+        theta = _gausslq.fit_spots_gpufit(spots)
+        em = camera_info["gain"] > 1
+        return _gausslq.locs_from_fits_gpufit(ids, theta, box, em)
+    elif fit_method == "avg":
+        fs = _avgroi.fit_spots_parallel(spots, asynch=True)
+        theta = _avgroi.fits_from_futures(fs)
+        return _avgroi.locs_from_fits(ids, theta, box, camera_info["gain"])
+    raise ValueError("Fit method not available.")
+
+
+def _put_chunk(chunks, item, stop_event):
+    """Blocks until the item is queued or the stream is aborted"""
+    while not stop_event.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except _queue.Full:
+            pass
+    return False
+
+
+def _stream_producer(
+    movie,
+    minimum_ng,
+    box,
+    camera_info,
+    chunk_size,
+    roi,
+    executor,
+    n_workers,
+    source,
+    chunks,
+    stop_event,
+    adaptive_snr,
+    max_emitters,
+):
+    try:
+        n_frames = len(movie)
+        for start in range(0, n_frames, chunk_size):
+            stop = min(start + chunk_size, n_frames)
+            ids = _identify_chunk(
+                movie,
+                minimum_ng,
+                box,
+                start,
+                stop,
+                executor,
+                n_workers,
+                roi,
+                source,
+                adaptive_snr,
+            )
+            if camera_info.get("maps") is None:
+                spots = get_spots(movie, ids, box, camera_info)
+                variances = None
+            else:
+                spots, variances = get_spots_and_variances(
+                    movie, ids, box, camera_info
+                )
+            groups = None
+            if max_emitters > 1:
+                groups = _cut_overlap_groups(
+                    movie, ids, box, camera_info, max_emitters
+                )
+            item = (stop, ids, spots, variances, groups)
+            if not _put_chunk(chunks, item, stop_event):
+                return
+        _put_chunk(chunks, None, stop_event)
+    except Exception as e:
+        _put_chunk(chunks, e, stop_event)
+
+
+def localize_stream(
+    movie,
+    camera_info,
+    minimum_ng,
+    box,
+    fit_method="mle",
+    eps=0.001,
+    max_it=1000,
+    chunk_size=STREAM_CHUNK_SIZE,
+    roi=None,
+    callback=None,
+    processes=False,
+    adaptive_snr=None,
+    warm_start=None,
+    iteration_histogram=None,
+    max_emitters=1,
+    rejection=None,
+):
+    """
+    Identifies, cuts and fits spots in chunks of chunk_size frames and yields
+    the localizations of each chunk in frame order.
+    A background thread identifies and cuts the next chunk while the current
+    one is fitted. At most two chunks are held in memory in addition to the
+    one being fitted, so memory usage depends on chunk_size, not on the
+    length of the movie.
+    The callback is called with the number of processed frames.
+    With processes=True, identification runs in worker processes and with
+    adaptive_snr, the minimum net gradient adapts to the local noise
+    (see identify_async). MLE fits can be warm-started (see _fit_mle) and
+    their iterations and stop reasons counted in a
+    gaussmle.IterationHistogram. If camera_info has sCMOS camera maps,
+    spots are converted with them and MLE fits use the sCMOS likelihood
+    (see get_spots_and_variances). With max_emitters > 1, spots whose
+    boxes overlap are fit jointly as up to max_emitters emitters (see
+    overlap_groups and gaussmle.gaussmle_multi), which requires MLE fits.
+    MLE fits that fail the gaussmle.rejection_limits in rejection are
+    dropped in the fit kernels and never turned into localizations.
+    """
+    if max_emitters > 1 and fit_method != "mle":
+        raise ValueError("Multi-emitter fits are only available with mle.")
+    if rejection is not None and fit_method != "mle":
+        raise ValueError("Rejection in the fit kernels is only available with mle.")
+    n_workers = _n_workers()
+    chunks = _queue.Queue(maxsize=1)
+    source = _movie_source(movie) if processes else None
+    if source is not None:
+        identify_executor = _ProcessPoolExecutor(n_workers)
+    else:
+        if processes:
+            print("Movie is not backed by a file. Identifying with threads.")
+        identify_executor = _ThreadPoolExecutor(n_workers)
+    fit_executor = _ThreadPoolExecutor(n_workers)
+    stop_event = _threading.Event()
+    producer = _threading.Thread(
+        target=_stream_producer,
+        args=(
+            movie,
+            minimum_ng,
+            box,
+            camera_info,
+            chunk_size,
+            roi,
+            identify_executor,
+            n_workers,
+            source,
+            chunks,
+            stop_event,
+            adaptive_snr,
+            max_emitters,
+        ),
+        daemon=True,
+    )
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            stop, ids, spots, variances, groups = chunk
+            yield _fit_chunk(
+                spots,
+                ids,
+                box,
+                camera_info,
+                fit_method,
+                eps,
+                max_it,
+                fit_executor,
+                n_workers,
+                warm_start,
+                iteration_histogram,
+                variances,
+                groups,
+                rejection,
+            )
+            if callback is not None:
+                callback(stop)
+    finally:
+        stop_event.set()
+        producer.join()
+        identify_executor.shutdown()
+        fit_executor.shutdown()
+
+
+def localize_streaming(movie, camera_info, minimum_ng, box, **kwargs):
+    """Runs localize_stream over the whole movie and returns all locs"""
+    locs = list(localize_stream(movie, camera_info, minimum_ng, box, **kwargs))
+    if len(locs) == 0:  # a movie without frames
+        mle = kwargs.get("fit_method", "mle") == "mle"
+        return _np.recarray(0, dtype=LOCS_DTYPE if mle else _lib.FIT_LOCS_DTYPE)
+    return _np.hstack(locs).view(_np.recarray)
+
+
+def warmup():
+    """
+    Compiles the identification and fitting kernels for the movie and spot
+    types that picasso localize uses. The kernels are cached on disk by
+    numba, so later runs and worker processes load instead of compile them.
+    """
+    from . import zfit as _zfit
+
+    rng = _np.random.default_rng(0)
+    movie = rng.poisson(100, (4, 32, 32)).astype(_np.uint16)
+    movie[:, 14:17, 14:17] += 1000
+    readonly = movie.copy()
+    readonly.flags.writeable = False  # like a memmap of a raw file
+    camera_info = {"baseline": 0, "sensitivity": 1.0, "gain": 1, "qe": 1.0}
+    box = 7
+    # ndarray movies and frame-by-frame movies (e.g. TIFF files)
+    for movie_ in [movie, readonly, list(movie), list(readonly)]:
+        ids = identify(movie_, 0, box, threaded=False)
+        spots = get_spots(movie_, ids, box, camera_info)
+        for _ in iter_spots(movie_, ids, box, camera_info):
+            pass
+    identify_in_frame(movie[0], 0, box, tile_size=16)
+    identify(movie, 0, box, threaded=False, adaptive_snr=4)
+    maps = _np.ones((3, 32, 32), dtype=_np.float32)
+    maps.flags.writeable = False  # like memory-mapped camera maps
+    camera_info["maps"] = maps
+    get_spots_and_variances(movie, ids, box, camera_info)
+    for method in ["sigma", "sigmaxy"]:
+        _gaussmle.gaussmle(spots, 0.001, 10, method=method)
+    overlap_groups(ids, box, 2, movie[0].shape)
+    _gaussmle.gaussmle_multi(spots[:1], _np.full((1, 2, 2), 3.0), [2], 0.001, 10)
+    theta = _gausslq.fit_spots(spots)
+    _avgroi.fit_spots(spots)
+    locs = _gausslq.locs_from_fits(ids, theta, box, 1)
+    info = [{"Width": 32, "Height": 32}]
+    calibration = {
+        "X Coefficients": [0, 0, 0, 0, 1e-6, 0, 1],
+        "Y Coefficients": [0, 0, 0, 0, 1e-6, 0, 1],
+    }
+    _zfit.fit_z(locs, info, calibration, 1, filter=0)
+
+
 def localize(movie, info, parameters):
     print("localizing")
     identifications = identify(movie, parameters)
@@ -454,6 +1770,9 @@ def _db_filename():
 
 
 def save_file_summary(summary):
+    from sqlalchemy import create_engine
+    import pandas as pd
+
     engine = create_engine("sqlite:///" + _db_filename(), echo=False)
     s = pd.Series(summary, index=summary.keys()).to_frame().T
     s.to_sql("files", con=engine, if_exists="append", index=False)
@@ -11,18 +11,9 @@
 import numpy as _np
 import numba as _numba
 
-from sklearn.cluster import DBSCAN as _DBSCAN
-
-from scipy import interpolate as _interpolate
-from scipy.special import iv as _iv
-from scipy.spatial import distance
-from scipy.spatial import ConvexHull
-
 from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
 import multiprocessing as _multiprocessing
-import matplotlib.pyplot as _plt
 import itertools as _itertools
-import lmfit as _lmfit
 from collections import OrderedDict as _OrderedDict
 from . import lib as _lib
 from . import render as _render
@@ -199,6 +190,9 @@ def distance_histogram(locs, info, bin_size, r_max):
 
 
 def nena(locs, info, callback=None):
+    import lmfit as _lmfit
+    from scipy.special import iv as _iv
+
     bin_centers, dnfl_ = next_frame_neighbor_distance_histogram(locs, callback)
 
     def func(d, a, s, ac, dc, sc):
@@ -292,6 +286,9 @@ def pair_correlation(locs, info, bin_size, r_max):
 
 
 def dbscan(locs, radius, min_density):
+    from sklearn.cluster import DBSCAN as _DBSCAN
+    from scipy.spatial import ConvexHull
+
     print("Identifying clusters...")
     if hasattr(locs, "z"):
         print("z-coordinates detected")
@@ -440,6 +437,7 @@ def dbscan(locs, radius, min_density):
 def hdbscan(locs, min_cluster_size, min_samples):
 
     from hdbscan import HDBSCAN as _HDBSCAN
+    from scipy.spatial import ConvexHull
 
     print("Identifying clusters...")
     if hasattr(locs, "z"):
@@ -874,6 +872,8 @@ def cluster_combine(locs):
 
 
 def cluster_combine_dist(locs):
+    from scipy.spatial import distance
+
     print("Calculating distances...")
 
     if hasattr(locs, "z"):
@@ -1244,6 +1244,8 @@ def undrift(
     segmentation_callback=None,
     rcc_callback=None,
 ):
+    from scipy import interpolate as _interpolate
+
     bounds, segments = _render.segment(
         locs,
         info,
@@ -1259,6 +1261,9 @@ def undrift(
     drift = (drift_x_pol(t_inter), drift_y_pol(t_inter))
     drift = _np.rec.array(drift, dtype=[("x", "f"), ("y", "f")])
     if display:
+        import matplotlib.pyplot as _plt
+
+        _plt.style.use("ggplot")
         fig1 = _plt.figure(figsize=(17, 6))
         _plt.suptitle("Estimated drift")
         _plt.subplot(1, 2, 1)
@@ -9,7 +9,6 @@
 """
 import numpy as _np
 import numba as _numba
-import scipy.signal as _signal
 from tqdm import trange as _trange
 
 
@@ -267,6 +266,8 @@ def render_smooth(locs, oversampling, y_min, x_min, y_max, x_max):
 
 
 def _fftconvolve(image, blur_width, blur_height):
+    import scipy.signal as _signal
+
     kernel_width = 10 * int(_np.round(blur_width)) + 1
     kernel_height = 10 * int(_np.round(blur_height)) + 1
     kernel_y = _signal.gaussian(kernel_height, blur_height)
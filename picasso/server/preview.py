@@ -10,13 +10,15 @@ import matplotlib.pyplot as plt
 
 
 @st.cache
-def load_file(path: str):
+def load_file(path: str, viewport: tuple = None, frames: tuple = None):
     """Loads localization from files. Cached version.
 
     Args:
         path (str): Path to file.
+        viewport (tuple): Only load localizations in this viewport.
+        frames (tuple): Only load localizations in these frames.
     """
-    locs, info = io.load_locs(path)
+    locs, info = io.load_locs(path, viewport=viewport, frames=frames)
     return locs, info
 
 
@@ -75,14 +77,19 @@ def preview():
                 with st.spinner("Loading file"):
                     hdf_file_ = os.path.join(folder, hdf_file)
                     if os.path.isfile(hdf_file_):
-                        locs, info = load_file(hdf_file_)
+                        # Files saved with an index (see io.save_locs) are
+                        # only read in the selected viewport and frames
+                        info = io.load_info(hdf_file_)
+                        width = info[0]["Width"]
+                        height = info[0]["Height"]
+                        n_frames = info[0]["Frames"]
 
-                        x_min = np.min(locs.x)
-                        x_max = np.max(locs.x)
-                        y_min = np.min(locs.y)
-                        y_max = np.max(locs.y)
+                        x_min, x_max = st.slider("X", 0, width, (0, width))
+                        y_min, y_max = st.slider("Y", 0, height, (0, height))
+                        frames = st.slider("Frames", 0, n_frames, (0, n_frames))
 
                         viewport = (y_min, x_min), (y_max, x_max)
+                        locs, info = load_file(hdf_file_, viewport, frames)
 
                         c1, c2, c3 = st.columns(3)
 
@@ -268,6 +268,7 @@ def watcher():
             st.write(settings)
 
             settings["database"] = True
+            settings["index"] = True  # for viewport loading in the preview
 
             p = Process(
                 target=check_new_and_process,
@@ -2,17 +2,11 @@ import numpy as _np
 import numba as _numba
 import multiprocessing as _multiprocessing
 import concurrent.futures as _futures
-from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
-from scipy.optimize import minimize_scalar as _minimize_scalar
 from tqdm import tqdm as _tqdm
 import yaml as _yaml
-import matplotlib.pyplot as _plt
 from . import lib as _lib
 
 
-_plt.style.use("ggplot")
-
-
 def nan_index(y):
     return _np.isnan(y), lambda z: z.nonzero()[0]
 
@@ -59,6 +53,7 @@ def calibrate_z(locs, info, d, magnification_factor, path=None):
     calibration = {
         "X Coefficients": [float(_) for _ in cx],
         "Y Coefficients": [float(_) for _ in cy],
+        "Range": float(range),
     }
     if path is not None:
         with open(path, "w") as f:
@@ -67,6 +62,9 @@ def calibrate_z(locs, info, d, magnification_factor, path=None):
     locs = fit_z(locs, info, calibration, magnification_factor)
     locs.z /= magnification_factor
 
+    import matplotlib.pyplot as _plt
+
+    _plt.style.use("ggplot")
     _plt.figure(figsize=(18, 10))
 
     _plt.subplot(231)
@@ -172,7 +170,7 @@ def calibrate_z(locs, info, d, magnification_factor, path=None):
     return calibration
 
 
-@_numba.jit(nopython=True, nogil=True)
+@_numba.jit(nopython=True, nogil=True, cache=True)
 def _fit_z_target(z, sx, sy, cx, cy):
     z2 = z * z
     z3 = z * z2
@@ -204,48 +202,169 @@ def _fit_z_target(z, sx, sy, cx, cy):
     # return (sx-wx)**2 + (sy-wy)**2
 
 
-def fit_z(locs, info, calibration, magnification_factor, filter=2):
+# Grid of the z lookup table, in units of the calibration (nm). It spans
+# the "Range" of the calibration, or +/- Z_LOOKUP_RANGE for calibrations
+# saved without it.
+Z_LOOKUP_RANGE = 2000.0
+Z_LOOKUP_STEP = 1.0
+Z_LOOKUP_STRIDE = 8  # grid steps of the first, coarse walk downhill
+Z_NEWTON_ITERATIONS = 5
+
+
+def _z_lookup(calibration):
+    """Square roots of the calibrated spot width and height on a grid of z"""
     cx = _np.array(calibration["X Coefficients"])
     cy = _np.array(calibration["Y Coefficients"])
-    z = _np.zeros_like(locs.x)
-    square_d_zcalib = _np.zeros_like(z)
-    sx = locs.sx
-    sy = locs.sy
+    half_range = calibration.get("Range", 2 * Z_LOOKUP_RANGE) / 2
+    grid = _np.arange(-half_range, half_range + Z_LOOKUP_STEP, Z_LOOKUP_STEP)
+    with _np.errstate(invalid="ignore"):
+        return grid, _np.sqrt(_np.polyval(cx, grid)), _np.sqrt(_np.polyval(cy, grid))
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _polynomial(c, z):
+    """Value and first two derivatives of the polynomial c at z (Horner)"""
+    w = 0.0
+    dw = 0.0
+    d2w = 0.0
+    for k in range(len(c)):
+        d2w = d2w * z + 2 * dw
+        dw = dw * z + w
+        w = w * z + c[k]
+    return w, dw, d2w
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _z_cost(root_sx, root_sy, root_wx, root_wy):
+    cost = (root_sx - root_wx) ** 2 + (root_sy - root_wy) ** 2
+    return cost if _np.isfinite(cost) else _np.inf
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _newton_z(root_sx, root_sy, cx, cy, z, step):
+    """Refines z by Newton steps on the derivative of _fit_z_target, which
+    stay within one grid step"""
+    for _ in range(Z_NEWTON_ITERATIONS):
+        wx, dwx, d2wx = _polynomial(cx, z)
+        wy, dwy, d2wy = _polynomial(cy, z)
+        if wx <= 0 or wy <= 0:
+            break
+        ax = _np.sqrt(wx)
+        ay = _np.sqrt(wy)
+        dax = dwx / (2 * ax)
+        day = dwy / (2 * ay)
+        d2ax = d2wx / (2 * ax) - dwx**2 / (4 * ax**3)
+        d2ay = d2wy / (2 * ay) - dwy**2 / (4 * ay**3)
+        rx = root_sx - ax
+        ry = root_sy - ay
+        d1 = -2 * (rx * dax + ry * day)
+        d2 = 2 * (dax**2 - rx * d2ax + day**2 - ry * d2ay)
+        if d2 <= 0:
+            break
+        delta = d1 / d2
+        if _np.abs(delta) > step:
+            break
+        z -= delta
+        if _np.abs(delta) < 1e-6 * step:
+            break
+    return z
+
+
+@_numba.jit(nopython=True, nogil=True, cache=True)
+def _fit_z_lookup(sx, sy, cx, cy, grid, root_wx, root_wy, z, square_d_zcalib):
+    """
+    Estimates z like one scipy minimize_scalar of _fit_z_target per loc,
+    but limited to the calibrated range: each loc walks downhill on the
+    lookup grid from z = 0 to the nearest minimum of _fit_z_target, in strides
+    that halve down to one grid step. The minimum is then refined by Newton
+    steps on the calibration polynomials.
+    """
+    n_grid = len(grid)
+    step = grid[1] - grid[0]
+    center = int(_np.argmin(_np.abs(grid)))
     for i in range(len(z)):
-        result = _minimize_scalar(_fit_z_target, args=(sx[i], sy[i], cx, cy))
-        z[i] = result.x
-        square_d_zcalib[i] = result.fun
-    z *= magnification_factor
-    locs = _lib.append_to_rec(locs, z, "z")
-    locs = _lib.append_to_rec(locs, _np.sqrt(square_d_zcalib), "d_zcalib")
-    locs = _lib.ensure_sanity(locs, info)
+        root_sx = _np.sqrt(sx[i])
+        root_sy = _np.sqrt(sy[i])
+        if not (_np.isfinite(root_sx) and _np.isfinite(root_sy)):
+            z[i] = _np.nan
+            square_d_zcalib[i] = _np.nan
+            continue
+        j = center
+        cost = _z_cost(root_sx, root_sy, root_wx[j], root_wy[j])
+        stride = Z_LOOKUP_STRIDE
+        while stride > 0:
+            if j >= stride:
+                k = j - stride
+                left = _z_cost(root_sx, root_sy, root_wx[k], root_wy[k])
+                if left < cost:
+                    j = k
+                    cost = left
+                    continue
+            if j + stride < n_grid:
+                k = j + stride
+                right = _z_cost(root_sx, root_sy, root_wx[k], root_wy[k])
+                if right < cost:
+                    j = k
+                    cost = right
+                    continue
+            # continue on the next finer stride
+            stride //= 2
+        z[i] = grid[j]
+        square_d_zcalib[i] = cost
+        refined = _newton_z(root_sx, root_sy, cx, cy, grid[j], step)
+        refined_cost = _fit_z_target(refined, sx[i], sy[i], cx, cy)
+        if refined_cost <= cost:
+            z[i] = refined
+            square_d_zcalib[i] = refined_cost
+
+
+def _fit_z_task(locs, info, lookup, cx, cy, magnification_factor):
+    """Fits z of the locs into the z and d_zcalib fields of a new array"""
+    names = [_ for _ in locs.dtype.names if _ not in ["z", "d_zcalib"]]
+    dtype = [(_, locs.dtype[_]) for _ in names]
+    dtype += [("z", locs.x.dtype), ("d_zcalib", locs.x.dtype)]
+    locs_z = _np.recarray(len(locs), dtype=dtype)
+    for name in names:
+        locs_z[name] = locs[name]
+    _fit_z_lookup(locs.sx, locs.sy, cx, cy, *lookup, locs_z.z, locs_z.d_zcalib)
+    locs_z.z *= magnification_factor
+    _np.sqrt(locs_z.d_zcalib, out=locs_z.d_zcalib)
+    return _lib.ensure_sanity(locs_z, info)
+
+
+def fit_z(locs, info, calibration, magnification_factor, filter=2):
+    cx = _np.array(calibration["X Coefficients"])
+    cy = _np.array(calibration["Y Coefficients"])
+    lookup = _z_lookup(calibration)
+    locs = _fit_z_task(locs, info, lookup, cx, cy, magnification_factor)
     return filter_z_fits(locs, filter)
 
 
 def fit_z_parallel(
     locs, info, calibration, magnification_factor, filter=2, asynch=False
 ):
+    """Fits z on threads, as the z kernel releases the GIL. Each task fits
+    a slice of the locs."""
     n_workers = max(1, int(0.75 * _multiprocessing.cpu_count()))
-    n_locs = len(locs)
     n_tasks = 100 * n_workers
-    spots_per_task = [
-        int(n_locs / n_tasks + 1) if _ < n_locs % n_tasks else int(n_locs / n_tasks)
-        for _ in range(n_tasks)
-    ]
-    start_indices = _np.cumsum([0] + spots_per_task[:-1])
-    fs = []
-    executor = _ProcessPoolExecutor(n_workers)
-    for i, n_locs_task in zip(start_indices, spots_per_task):
-        fs.append(
-            executor.submit(
-                fit_z,
-                locs[i : i + n_locs_task],
-                info,
-                calibration,
-                magnification_factor,
-                filter=0,
-            )
+    cx = _np.array(calibration["X Coefficients"])
+    cy = _np.array(calibration["Y Coefficients"])
+    lookup = _z_lookup(calibration)
+    bounds = _np.linspace(0, len(locs), n_tasks + 1).astype(int)
+    executor = _futures.ThreadPoolExecutor(n_workers)
+    fs = [
+        executor.submit(
+            _fit_z_task,
+            locs[start:stop],
+            info,
+            lookup,
+            cx,
+            cy,
+            magnification_factor,
         )
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    executor.shutdown(wait=False)
     if asynch:
         return fs
     with _tqdm(total=n_tasks, unit="task") as progress_bar:
@@ -32,3 +32,876 @@ def test_localize():
     for fit_method in ["mle"]:
         args.fit_method = fit_method
         main._localize(args)
+
+
+def test_localize_index():
+    """
+    Test that the localize command saves an index from which load_locs
+    reads viewports and frame ranges
+    """
+    import argparse
+
+    import h5py
+    import numpy as np
+    from picasso import io
+
+    args = argparse.Namespace(
+        files="./tests/data/testdata.raw",
+        fit_method="mle",
+        box_side_length=7,
+        gradient=5000,
+        baseline=0,
+        sensitivity=1,
+        gain=1,
+        qe=1,
+        drift=0,
+        index=True,
+    )
+    main._localize(args)
+    path = "./tests/data/testdata_locs.hdf5"
+    with h5py.File(path, "r") as locs_file:
+        assert "locs_index" in locs_file
+    locs, info = io.load_locs(path)
+    assert np.all(np.diff(locs.frame.astype(int)) >= 0)
+    viewport = (8, 10), (24, 30)
+    frames = (50, 150)
+    locs_in, info = io.load_locs(path, viewport=viewport, frames=frames)
+    in_view = (
+        (locs.y >= 8)
+        & (locs.y < 24)
+        & (locs.x >= 10)
+        & (locs.x < 30)
+        & (locs.frame >= 50)
+        & (locs.frame < 150)
+    )
+    assert 0 < len(locs_in) < len(locs)
+    assert np.array_equal(locs_in, locs[in_view])
+
+
+def test_localize_stream():
+    """
+    Test that chunked streaming gives the same locs as a single chunk
+    """
+    import numpy as np
+    from picasso import io, localize
+
+    movie, info = io.load_movie("./tests/data/testdata.raw")
+    camera_info = {"baseline": 0, "sensitivity": 1, "gain": 1, "qe": 1}
+    locs = localize.localize_streaming(
+        movie, camera_info, 5000, 7, chunk_size=len(movie)
+    )
+    locs_chunked = localize.localize_streaming(
+        movie, camera_info, 5000, 7, chunk_size=37
+    )
+    assert len(locs) > 0
+    assert np.all(np.diff(locs_chunked.frame.astype(int)) >= 0)
+    for name in locs.dtype.names:
+        assert np.array_equal(locs[name], locs_chunked[name])
+
+
+def test_localize_stream_empty():
+    """
+    Test that movies without frames or spots give empty locs
+    """
+    import numpy as np
+    from picasso import localize
+
+    camera_info = {"baseline": 0, "sensitivity": 1, "gain": 1, "qe": 1}
+    movie = np.full((5, 32, 32), 10, dtype=np.uint16)
+    for movie_ in [movie, movie[:0]]:
+        locs = localize.localize_streaming(movie_, camera_info, 1000, 7)
+        assert len(locs) == 0
+        assert locs.dtype == np.dtype(localize.LOCS_DTYPE)
+
+
+def test_local_maxima():
+    """
+    Test that the separable local maximum kernel keeps the argmax tie-break
+    """
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    for box in [3, 5, 7, 9, 11, 13, 15]:
+        frame = np.float32(rng.integers(0, 4, (64, 48)))
+        y0, x0 = localize._local_maxima_argmax(frame, box)
+        y1, x1 = localize.local_maxima(frame, box)
+        assert np.array_equal(y0, y1)
+        assert np.array_equal(x0, x1)
+
+
+def test_identify_processes():
+    """
+    Test that identification in worker processes matches threads
+    """
+    import numpy as np
+    from picasso import io, localize
+
+    movie, info = io.load_movie("./tests/data/testdata.raw")
+    ids = localize.identify(movie, 5000, 7)
+    ids_processes = localize.identify(movie, 5000, 7, processes=True)
+    for name in ids.dtype.names:
+        assert np.array_equal(ids[name], ids_processes[name])
+
+
+def test_identify_tiled():
+    """
+    Test that identification in tiles gives the same spots as in one piece
+    """
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    frame = np.float32(rng.poisson(50, (157, 203)))
+    for box in [5, 7, 9]:
+        for tile_size in [16, 33, 64]:
+            y0, x0, ng0 = localize.identify_in_frame(frame, 200, box)
+            y1, x1, ng1 = localize.identify_in_frame(
+                frame, 200, box, tile_size=tile_size
+            )
+            assert np.array_equal(y0, y1)
+            assert np.array_equal(x0, x1)
+            assert np.array_equal(ng0, ng1)
+
+
+def test_lazy_imports():
+    """
+    Test that the headless core modules do not import GUI, plotting or
+    fitting stacks at import time
+    """
+    import subprocess
+    import sys
+
+    heavy = ["matplotlib", "PyQt5", "sklearn", "lmfit", "pandas", "sqlalchemy"]
+    code = (
+        "import sys\n"
+        "from picasso import localize, postprocess, render, zfit, io, lib\n"
+        "print(' '.join(m for m in {!r} if m in sys.modules))".format(heavy)
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.split() == []
+
+
+def test_identify_adaptive():
+    """
+    Test that the adaptive minimum net gradient removes candidates where
+    the noise is high, and that it does not depend on the frame blocks
+    """
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    background = np.full((96, 128), 10.0)
+    background[:, 64:] = 2000
+    movie = np.uint16(rng.poisson(background, (80, 96, 128)))
+    ids = localize.identify(movie, 200, 7)
+    ids_adaptive = localize.identify(movie, 200, 7, adaptive_snr=4)
+    assert np.sum(ids_adaptive.x >= 72) < np.sum(ids.x >= 72) / 10
+    assert np.array_equal(ids_adaptive[ids_adaptive.x < 56], ids[ids.x < 56])
+    ids_frames = localize.identify(movie, 200, 7, threaded=False, adaptive_snr=4)
+    assert np.array_equal(ids_adaptive, ids_frames)
+
+    class CountingMovie(list):
+        reads = 0
+
+        def __getitem__(self, index):
+            self.reads += 1
+            return list.__getitem__(self, index)
+
+    counting = CountingMovie(movie)
+    localize.identify(counting, 200, 7, threaded=False, adaptive_snr=4)
+    assert counting.reads < 1.2 * len(movie)  # the noise map is built once
+
+
+def test_fit_spots_lm():
+    """
+    Test that the numba Levenberg-Marquardt fits agree with scipy's leastsq
+    """
+    import numpy as np
+    from picasso import gausslq
+
+    rng = np.random.default_rng(0)
+    grid = np.arange(-3, 4)
+    spots = []
+    for x, y in rng.uniform(-0.5, 0.5, (200, 2)):
+        gx = np.exp(-0.5 * ((grid - x) / 1.2) ** 2) / (np.sqrt(2 * np.pi) * 1.2)
+        gy = np.exp(-0.5 * ((grid - y) / 1.2) ** 2) / (np.sqrt(2 * np.pi) * 1.2)
+        spots.append(rng.poisson(2000 * np.outer(gy, gx) + 20))
+    spots = np.float32(spots)
+    theta = gausslq.fit_spots(spots)
+    theta_leastsq = np.array([gausslq.fit_spot(_) for _ in spots])
+    assert theta.shape == (200, 6)
+    assert np.percentile(np.abs(theta[:, :2] - theta_leastsq[:, :2]), 95) < 0.02
+    assert np.allclose(theta[:, 2], theta_leastsq[:, 2], rtol=0.05)
+    assert np.array_equal(gausslq.fit_spots_parallel(spots), theta)
+
+
+def test_fit_parallel_shared():
+    """
+    Test that the process pool fitters with shared memory give the same
+    results as the serial ones
+    """
+    import numpy as np
+    from picasso import avgroi, zfit
+
+    rng = np.random.default_rng(0)
+    spots = np.float32(rng.poisson(50, (1000, 7, 7)))
+    theta = avgroi.fit_spots_parallel(spots)  # below SHARED_MIN_SPOTS: threads
+    assert np.array_equal(theta, avgroi.fit_spots(spots))
+    shared_min_spots = avgroi.SHARED_MIN_SPOTS
+    avgroi.SHARED_MIN_SPOTS = 0
+    try:
+        theta = avgroi.fit_spots_parallel(spots)
+    finally:
+        avgroi.SHARED_MIN_SPOTS = shared_min_spots
+    assert np.array_equal(theta, avgroi.fit_spots(spots))
+
+    n = 500
+    locs = np.rec.array(
+        (
+            np.arange(n) % 10,
+            rng.uniform(0, 32, n),
+            rng.uniform(0, 32, n),
+            rng.uniform(0.9, 1.5, n),
+            rng.uniform(0.9, 1.5, n),
+            np.full(n, 0.1),
+            np.full(n, 0.1),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("sx", "f4"),
+            ("sy", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+    info = [{"Width": 32, "Height": 32, "Frames": 10}]
+    calibration = {
+        "X Coefficients": [0, 0, 0, 0, 1e-6, 1e-3, 1.2],
+        "Y Coefficients": [0, 0, 0, 0, 1e-6, -1e-3, 1.2],
+    }
+    locs_z = zfit.fit_z_parallel(locs, info, calibration, 0.8)
+    assert np.array_equal(locs_z, zfit.fit_z(locs, info, calibration, 0.8))
+
+
+def test_gaussmle_blocks():
+    """
+    Test that MLE fits do not depend on the block size or the number of threads
+    """
+    import numpy as np
+    from picasso import gaussmle
+
+    rng = np.random.default_rng(0)
+    spots = np.float32(rng.poisson(20, (300, 7, 7)))
+    spots[:, 2:5, 2:5] += np.float32(rng.poisson(200, (300, 3, 3)))
+    for method in ["sigma", "sigmaxy"]:
+        fits = gaussmle.gaussmle(spots, 0.001, 100, method=method, block_size=1)
+        fits_blocks = gaussmle.gaussmle(spots, 0.001, 100, method=method)
+        fits_parallel = gaussmle.gaussmle_parallel(
+            spots, 0.001, 100, method=method, n_workers=3, block_size=16
+        )
+        for a, b, c in zip(fits, fits_blocks, fits_parallel):
+            assert np.array_equal(a, b) and np.array_equal(a, c)
+
+
+def test_gaussmle_integral_terms():
+    """
+    Test that the per-row integral terms reproduce the per-pixel PSF derivatives
+    """
+    import numpy as np
+    from picasso import gaussmle
+
+    rng = np.random.default_rng(0)
+    terms = np.zeros((8, 7, 1))
+    for mu, sigma, photons in rng.uniform((1, 0.5, 100), (5, 2, 1e4), (20, 3)):
+        mu, sigma, photons = np.float32([mu, sigma, photons])
+        gaussmle._fill_integral_terms(terms, 0, mu, sigma)
+        for i in range(7):
+            PSF = gaussmle._gaussian_integral(i, mu, sigma)
+            assert terms[0, i, 0] == PSF
+            assert gaussmle._position_derivative(
+                terms, i, 0, sigma, photons, PSF
+            ) == gaussmle._derivative_gaussian_integral(i, mu, sigma, photons, PSF)
+            assert gaussmle._sigma_derivative(
+                terms, i, 0, sigma, photons, PSF
+            ) == gaussmle._derivative_gaussian_integral_1d_sigma(
+                i, mu, sigma, photons, PSF
+            )
+
+
+def test_gaussmle_stop_reasons():
+    """
+    Test divergence detection, warm starts and the iteration histogram
+    """
+    import numpy as np
+    from picasso import gaussmle, localize
+
+    rng = np.random.default_rng(0)
+    spots = np.float32(rng.poisson(20, (200, 7, 7)))
+    spots[:, 2:5, 2:5] += np.float32(rng.poisson(200, (200, 3, 3)))
+    spots[100:, 0, 0] += 5000  # hot pixels
+    fits = gaussmle.gaussmle(
+        spots, 0.001, 100, method="sigmaxy", return_stop_reasons=True
+    )
+    thetas, iterations, stop_reasons = fits[0], fits[3], fits[4]
+    assert np.all(stop_reasons[:100] == gaussmle.STOP_CONVERGED)
+    assert np.mean(stop_reasons[100:] == gaussmle.STOP_DIVERGED) > 0.9
+    unchecked = gaussmle.gaussmle(
+        spots, 0.001, 100, method="sigmaxy", check_divergence=False
+    )
+    assert np.array_equal(unchecked[0][:100], thetas[:100])
+    assert np.sum(unchecked[3]) > 2 * np.sum(iterations)
+
+    warm = gaussmle.gaussmle(
+        spots[:100], 0.001, 100, method="sigmaxy", initial_thetas=thetas[:100]
+    )
+    assert np.all(warm[3] <= 2)
+    assert np.allclose(warm[0][:, [0, 1, 4, 5]], thetas[:100, [0, 1, 4, 5]], atol=0.01)
+
+    histogram = gaussmle.IterationHistogram(100)
+    histogram.add(iterations, stop_reasons)
+    assert histogram.counts.sum() == 200
+    assert histogram.percentile(100) == iterations.max()
+
+    ids = np.rec.fromarrays(
+        ([0, 1, 1, 2, 2], [5, 6, 20, 7, 20], [5, 5, 20, 6, 25]),
+        dtype=[("frame", "i"), ("x", "i"), ("y", "i")],
+    )
+    links = localize._previous_frame_links(ids)
+    assert list(links) == [-1, 0, -1, 1, -1]
+    assert list(localize._link_depths(links)) == [0, 1, 0, 2, 0]
+
+
+def test_gaussmle_rejection():
+    """
+    Test that fits are rejected in the kernels and never become locs
+    """
+    import numpy as np
+    from picasso import gaussmle, localize
+
+    rng = np.random.default_rng(0)
+    spots = np.float32(rng.poisson(20, (200, 7, 7)))
+    spots[:, 2:5, 2:5] += np.float32(rng.poisson(200, (200, 3, 3)))
+    spots[100:, 0, 0] += 5000  # hot pixels
+    spots[:50, 2:5, 2:5] /= 4
+    fits = gaussmle.gaussmle(
+        spots, 0.001, 100, method="sigmaxy", return_stop_reasons=True
+    )
+    rejection = gaussmle.rejection_limits(
+        max_sigma=2.0, min_photons=1000, max_llr=11.0, unconverged=True
+    )
+    rejected = gaussmle.gaussmle(
+        spots,
+        0.001,
+        100,
+        method="sigmaxy",
+        return_stop_reasons=True,
+        rejection=rejection,
+    )
+    # rejection does not change the fits themselves
+    assert np.array_equal(rejected[0], fits[0])
+    llr = -2 * fits[2] / 49
+    expected = (
+        (fits[0][:, 4:6].max(axis=1) > 2.0)
+        | (fits[0][:, 2] < 1000)
+        | (llr > 11.0)
+        | (fits[4] != gaussmle.STOP_CONVERGED)
+    )
+    assert np.array_equal(rejected[4] == gaussmle.STOP_REJECTED, expected)
+    assert 0 < expected.sum() < 200
+
+    ids = np.rec.fromarrays(
+        (np.arange(200), np.full(200, 10), np.full(200, 10), np.ones(200)),
+        dtype=localize.IDS_DTYPE,
+    )
+    locs = localize._fit_chunk(
+        spots, ids, 7, {}, "mle", 0.001, 100, None, 1, rejection=rejection
+    )
+    assert np.array_equal(locs.frame, np.flatnonzero(~expected))
+
+
+def test_build_locs():
+    """
+    Test that locs are built in place and only sorted if needed
+    """
+    import numpy as np
+    from picasso import gausslq, lib, postprocess
+
+    rng = np.random.default_rng(0)
+    n = 1000
+    ids = np.rec.fromarrays(
+        (
+            np.sort(rng.integers(0, 100, n)),
+            rng.integers(3, 100, n),
+            rng.integers(3, 100, n),
+            rng.uniform(0, 1e4, n),
+        ),
+        dtype=[("frame", "i"), ("x", "i"), ("y", "i"), ("net_gradient", "f4")],
+    )
+    theta = rng.uniform(0.5, 1.5, (n, 6)).astype(np.float32)
+    theta[:, 2] *= 1000
+    locs = gausslq.locs_from_fits(ids, theta, 7, True)
+    assert locs.dtype == np.dtype(lib.FIT_LOCS_DTYPE)
+    # frame-ordered identifications keep their order
+    assert np.array_equal(locs.net_gradient, ids.net_gradient)
+    assert np.allclose(locs.x, theta[:, 0] + ids.x)
+    photons, sx, bg = theta[:, 2], theta[:, 4], theta[:, 3]
+    lpx = postprocess.localization_precision(photons, sx, bg, True)
+    assert np.allclose(locs.lpx, lpx, rtol=1e-6)
+    shuffled = rng.permutation(n)
+    locs = gausslq.locs_from_fits(ids[shuffled], theta[shuffled], 7, True)
+    assert np.all(np.diff(locs.frame) >= 0)
+    assert np.array_equal(np.sort(locs.net_gradient), np.sort(ids.net_gradient))
+
+
+def test_fit_z_lookup():
+    """
+    Test the z lookup against minimize_scalar, on threads and beyond the
+    default lookup range
+    """
+    import numpy as np
+    from scipy.optimize import minimize_scalar
+    from picasso import zfit
+
+    def fit_z_values(sx, sy, cx, cy, z, square_d_zcalib):
+        for i in range(len(z)):
+            result = minimize_scalar(zfit._fit_z_target, args=(sx[i], sy[i], cx, cy))
+            z[i] = result.x
+            square_d_zcalib[i] = result.fun
+
+    rng = np.random.default_rng(0)
+    z_range = np.linspace(-600, 600, 121)
+    cx = np.polyfit(z_range, 1.2 * np.sqrt(1 + ((z_range - 250) / 450) ** 2), 6)
+    cy = np.polyfit(z_range, 1.2 * np.sqrt(1 + ((z_range + 250) / 450) ** 2), 6)
+    n = 2000
+    true_z = rng.uniform(-500, 500, n)
+    locs = np.rec.fromarrays(
+        (
+            np.arange(n),
+            rng.uniform(1, 31, n),
+            rng.uniform(1, 31, n),
+            np.polyval(cx, true_z) * rng.normal(1, 0.03, n),
+            np.polyval(cy, true_z) * rng.normal(1, 0.03, n),
+            np.full(n, 0.1),
+            np.full(n, 0.1),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("sx", "f4"),
+            ("sy", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+    info = [{"Width": 32, "Height": 32}]
+    calibration = {"X Coefficients": list(cx), "Y Coefficients": list(cy)}
+    locs_z = zfit.fit_z(locs, info, calibration, 1, filter=0)
+    assert len(locs_z) == n
+
+    z = np.zeros(n, dtype=np.float32)
+    square_d_zcalib = np.zeros_like(z)
+    fit_z_values(locs.sx, locs.sy, cx, cy, z, square_d_zcalib)
+    found = np.isfinite(z)
+    assert found.mean() > 0.9
+    assert np.allclose(locs_z.z[found], z[found], atol=0.5)
+    d_zcalib = np.sqrt(square_d_zcalib[found])
+    assert np.allclose(locs_z.d_zcalib[found], d_zcalib, atol=1e-4)
+
+    fs = zfit.fit_z_parallel(locs, info, calibration, 1, filter=0, asynch=True)
+    locs_parallel = zfit.locs_from_futures(fs, filter=0)
+    assert np.array_equal(locs_parallel.z, locs_z.z)
+
+    # The lookup grid spans the calibrated range, here +/- 3000 nm
+    scale = 5
+    calibration = {
+        "X Coefficients": list(np.polyfit(scale * z_range, np.polyval(cx, z_range), 6)),
+        "Y Coefficients": list(np.polyfit(scale * z_range, np.polyval(cy, z_range), 6)),
+        "Range": float(scale * np.ptp(z_range)),
+    }
+    locs_scaled = zfit.fit_z(locs, info, calibration, 1, filter=0)
+    assert np.sum(np.abs(locs_scaled.z) > zfit.Z_LOOKUP_RANGE) > 0.1 * n
+    assert np.allclose(locs_scaled.z[found], scale * z[found], atol=scale)
+
+
+def test_scmos_camera_maps(tmp_path):
+    """
+    Test that fits with sCMOS camera maps beat the Poisson likelihood
+    """
+    import numpy as np
+    from picasso import gaussmle, io, localize
+
+    rng = np.random.default_rng(0)
+    n_frames, size = 100, 32
+    baseline = rng.uniform(90, 110, (size, size))
+    variance = rng.lognormal(np.log(40), 1.5, (size, size))
+    sensitivity = rng.uniform(0.4, 0.6, (size, size))
+    io.save_camera_maps(tmp_path / "maps.npy", baseline, variance, sensitivity)
+    maps = io.load_camera_maps(tmp_path / "maps.npy")
+    assert isinstance(maps, np.memmap) and maps.shape == (3, size, size)
+
+    grid = np.arange(size)
+    centers = np.arange(6, 27, 10)
+    movie = np.zeros((n_frames, size, size), dtype=np.uint16)
+    truth = []
+    for frame in range(n_frames):
+        photons = np.full((size, size), 10.0)
+        for y in centers:
+            for x in centers:
+                dy, dx = rng.uniform(-0.5, 0.5, 2)
+                gy = np.exp(-0.5 * (grid - y - dy) ** 2)
+                gx = np.exp(-0.5 * (grid - x - dx) ** 2)
+                photons += 300 * np.outer(gy / gy.sum(), gx / gx.sum())
+                truth.append((frame, x, y, x + dx, y + dy))
+        counts = rng.poisson(photons) / sensitivity + baseline
+        counts += rng.normal(0, np.sqrt(variance))
+        movie[frame] = np.round(counts)
+    truth = np.array(truth)
+    ids = np.rec.fromarrays(
+        (truth[:, 0], truth[:, 1], truth[:, 2], np.zeros(len(truth))),
+        dtype=localize.IDS_DTYPE,
+    )
+    camera_info = {"baseline": 100, "sensitivity": 0.5, "gain": 1, "qe": 1}
+    camera_info["maps"] = maps
+    spots, variances = localize.get_spots_and_variances(movie, ids, 7, camera_info)
+    expected = variance[3:10, 3:10] * sensitivity[3:10, 3:10] ** 2
+    assert np.allclose(variances[0], expected)
+
+    def rmse(variances):
+        theta = gaussmle.gaussmle(spots, 0.001, 200, "sigmaxy", variances=variances)[0]
+        dx = theta[:, 1] - 3 + ids.x - truth[:, 3]
+        dy = theta[:, 0] - 3 + ids.y - truth[:, 4]
+        return np.sqrt(np.mean(dx**2 + dy**2))
+
+    assert rmse(variances) < 0.8 * rmse(None)
+
+
+def test_multi_emitter():
+    """
+    Test that spots with overlapping boxes are fit jointly
+    """
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    n_frames, size = 50, 32
+    grid = np.arange(size)
+    movie = np.zeros((n_frames, size, size), dtype=np.uint16)
+    truth = []
+    for frame in range(n_frames):
+        photons = np.full((size, size), 10.0)
+        y0, x0 = rng.uniform(12, 14, 2)
+        for y, x in [(y0, x0), (y0 + 1.5, x0 + 4), (y0 + 10, x0 + 10)]:
+            gy = np.exp(-0.5 * (grid - y) ** 2 / 1.2**2)
+            gx = np.exp(-0.5 * (grid - x) ** 2 / 1.2**2)
+            photons += 1000 * np.outer(gy / gy.sum(), gx / gx.sum())
+            truth.append((frame, x, y))
+        movie[frame] = rng.poisson(photons)
+    truth = np.array(truth).reshape(n_frames, 3, 3)
+
+    ids = localize.identify(movie, 1000, 7, threaded=False)
+    members, roi_ids = localize.overlap_groups(ids, 7, 2, movie[0].shape)
+    assert len(members) == np.sum(np.bincount(ids.frame) == 3)
+    assert np.all(ids.frame[members] == roi_ids.frame[:, np.newaxis])
+
+    camera_info = {"baseline": 0, "sensitivity": 1, "gain": 1, "qe": 1}
+
+    def pair_rmse(max_emitters):
+        locs = localize.localize_streaming(
+            movie, camera_info, 1000, 7, max_emitters=max_emitters
+        )
+        assert len(locs) == len(ids)
+        frames = np.flatnonzero(np.bincount(locs.frame, minlength=n_frames) == 3)
+        errors = []
+        for frame in frames:
+            frame_locs = locs[locs.frame == frame]
+            for _, x, y in truth[frame, :2]:
+                errors.append(np.min(np.hypot(frame_locs.x - x, frame_locs.y - y)))
+        return np.sqrt(np.mean(np.square(errors)))
+
+    assert pair_rmse(2) < 0.2 * pair_rmse(1)
+
+
+def _write_tiff(path, movie, padding=()):
+    """Writes an uncompressed little endian TIFF with one strip per frame."""
+    import struct
+
+    n_frames, height, width = movie.shape
+    frame_bytes = height * width * 2
+    tags = [(256, 4, width), (257, 4, height), (258, 3, 16), (259, 3, 1)]
+    tags += [(273, 4, 0), (278, 4, height), (279, 4, frame_bytes)]
+    with open(path, "wb") as file:
+        file.write(b"II" + struct.pack("<HL", 42, 8))
+        for i, frame in enumerate(movie):
+            file.write(b"\0" * (padding[i] if i < len(padding) else 0))
+            image_offset = file.tell() + 2 + 12 * len(tags) + 4
+            file.write(struct.pack("<H", len(tags)))
+            for tag, type, value in tags:
+                value = image_offset if tag == 273 else value
+                file.write(struct.pack("<HHLL", tag, type, 1, value))
+            next_ifd = image_offset + frame_bytes
+            next_ifd += padding[i + 1] if i + 1 < len(padding) else 0
+            file.write(struct.pack("<L", next_ifd if i < n_frames - 1 else 0))
+            file.write(frame.astype("<u2").tobytes())
+
+
+def test_tiff_memmap(tmp_path):
+    """Regular TIFF stacks are memory-mapped, others are read frame by frame."""
+    import numpy as np
+    from picasso import io, localize
+
+    movie = np.random.default_rng(0).integers(0, 2**16, (20, 16, 24), np.uint16)
+    _write_tiff(tmp_path / "regular.ome.tif", movie)
+    _write_tiff(tmp_path / "irregular.ome.tif", movie, padding=[0, 0, 6])
+
+    with io.TiffMap(tmp_path / "regular.ome.tif") as tif:
+        assert tif.stack is not None and not tif.stack.flags.writeable
+        assert np.array_equal(tif[:], movie)
+        assert np.array_equal(tif[3:9, 2, 5:], movie[3:9, 2, 5:])
+        assert np.array_equal(tif.get_frame(7), movie[7])
+        assert not localize._prefetches(tif)
+    with io.TiffMap(tmp_path / "irregular.ome.tif") as tif:
+        assert tif.stack is None
+        assert localize._prefetches(tif)
+        assert np.array_equal(np.array(list(tif)), movie)
+
+
+def test_tiff_index(tmp_path):
+    """Image offsets are cached next to the TIFF file until it changes."""
+    import os
+    import numpy as np
+    from picasso import io
+
+    movie = np.random.default_rng(0).integers(0, 2**16, (20, 16, 24), np.uint16)
+    path = tmp_path / "movie.ome.tif"
+    _write_tiff(path, movie)
+    with io.TiffMap(path) as tif:
+        offsets = tif.image_offsets
+        assert os.path.exists(tif.index_path)
+    with io.TiffMap(path) as tif:
+        assert np.array_equal(tif.image_offsets, offsets)
+        assert np.array_equal(tif[:], movie)
+    _write_tiff(path, movie, padding=[0, 4, 0, 8])
+    with io.TiffMap(path) as tif:
+        assert tif.image_offsets[1] == offsets[1] + 4
+        assert np.array_equal(np.array(list(tif)), movie)
+
+
+def test_frame_prefetcher(tmp_path):
+    """Prefetched frames of multi-file TIFF movies match the movie."""
+    import threading
+    import numpy as np
+    from picasso import io, localize
+
+    rng = np.random.default_rng(0)
+    movie = rng.poisson(20, (30, 32, 32)).astype(np.uint16)
+    movie[:, 10:13, 20:23] += 500
+    _write_tiff(tmp_path / "movie.ome.tif", movie[:12])
+    _write_tiff(tmp_path / "movie_1.ome.tif", movie[12:])
+
+    with io.TiffMultiMap(tmp_path / "movie.ome.tif") as tif:
+        assert np.array_equal(tif[:], movie)
+        assert np.array_equal(tif[-1], movie[-1])
+        order = rng.permutation(len(movie))
+        with io.FramePrefetcher(tif, order, n_workers=3, buffer_size=0) as frames:
+            threads = [
+                threading.Thread(
+                    target=lambda part: [
+                        np.testing.assert_array_equal(frames[_], movie[_])
+                        for _ in part
+                    ],
+                    args=(part,),
+                )
+                for part in np.array_split(order, 3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert np.array_equal(frames[order[0]], movie[order[0]])
+        # Frames beyond the window are read directly and taken as well
+        with io.FramePrefetcher(tif, range(len(movie)), 1, 2, 0) as frames:
+            for i in range(len(movie) - 1, -1, -1):
+                assert np.array_equal(frames[i], movie[i])
+            assert frames._first == len(movie) and len(frames._buffer) == 0
+        ids = localize.identify(tif, 1000, 7)
+        assert np.array_equal(ids, localize.identify(movie, 1000, 7))
+        spots = localize._cut_spots(tif, ids, 7)
+        assert np.array_equal(spots, localize._cut_spots(movie, ids, 7))
+
+
+def test_locs_layouts(tmp_path):
+    """Compressed and columnar locs files load the same locs and columns."""
+    import h5py
+    import numpy as np
+    from picasso import io
+
+    rng = np.random.default_rng(0)
+    n_locs = 50000
+    locs = np.rec.fromarrays(
+        (
+            np.sort(rng.integers(0, 1000, n_locs)).astype(np.uint32),
+            rng.uniform(0, 32, n_locs).astype(np.float32),
+            rng.uniform(0, 32, n_locs).astype(np.float32),
+            rng.uniform(100, 1000, n_locs).astype(np.float32),
+            rng.uniform(0.01, 0.1, n_locs).astype(np.float32),
+            rng.uniform(0.01, 0.1, n_locs).astype(np.float32),
+        ),
+        dtype=[
+            ("frame", "u4"),
+            ("x", "f4"),
+            ("y", "f4"),
+            ("photons", "f4"),
+            ("lpx", "f4"),
+            ("lpy", "f4"),
+        ],
+    )
+    info = [{"Frames": 1000, "Width": 32, "Height": 32}]
+    for name, kwargs in [
+        ("default", {}),
+        ("lzf", {"compression": "lzf"}),
+        ("columnar", {"compression": "gzip", "columnar": True}),
+    ]:
+        path = str(tmp_path / (name + ".hdf5"))
+        io.save_locs(path, locs, info, **kwargs)
+        loaded, loaded_info = io.load_locs(path)
+        assert loaded.dtype == locs.dtype and np.array_equal(loaded, locs)
+        assert loaded_info == info
+        columns, _ = io.load_locs(path, columns=["y", "frame"])
+        assert columns.dtype.names == ("y", "frame")
+        assert np.array_equal(columns.y, locs.y)
+        assert np.array_equal(columns.frame, locs.frame)
+    with h5py.File(tmp_path / "lzf.hdf5", "r") as locs_file:
+        assert locs_file["locs"].chunks == (io.LOCS_CHUNK_SIZE // 24,)
+        assert locs_file["locs"].compression == "lzf"
+    io.save_locs(str(tmp_path / "empty.hdf5"), locs[:0], info, columnar=True)
+    assert len(io.load_locs(str(tmp_path / "empty.hdf5"))[0]) == 0
+
+
+def test_load_locs_viewport(tmp_path):
+    """Indexed locs files load the locs of a viewport and frame range in
+    the order they were saved in."""
+    import numpy as np
+    from picasso import io
+
+    rng = np.random.default_rng(0)
+    n_locs = 20000
+    locs = np.rec.fromarrays(
+        (
+            rng.integers(0, 5000, n_locs).astype(np.uint32),
+            rng.uniform(0.01, 100, n_locs).astype(np.float32),
+            rng.uniform(0.01, 80, n_locs).astype(np.float32),
+            np.full(n_locs, 0.05, dtype=np.float32),
+            np.full(n_locs, 0.05, dtype=np.float32),
+        ),
+        dtype=[("frame", "u4"), ("x", "f4"), ("y", "f4"), ("lpx", "f4"), ("lpy", "f4")],
+    )
+    info = [{"Frames": 5000, "Width": 100, "Height": 80}]
+    viewport = ((10.5, 40), (47, 70.2))
+    frames = (1200, 3100)
+    in_view = (locs.y >= 10.5) & (locs.y < 47) & (locs.x >= 40) & (locs.x < 70.2)
+    in_frames = (locs.frame >= 1200) & (locs.frame < 3100)
+
+    for name, kwargs in [
+        ("plain", {}),
+        ("indexed", {"index": True}),
+        ("columnar", {"index": True, "columnar": True}),
+    ]:
+        path = str(tmp_path / (name + ".hdf5"))
+        io.save_locs(path, locs, info, **kwargs)
+        assert np.array_equal(io.load_locs(path)[0], locs)
+        for expected, query in [
+            (in_view, {"viewport": viewport}),
+            (in_frames, {"frames": frames}),
+            (in_view & in_frames, {"viewport": viewport, "frames": frames}),
+        ]:
+            loaded, _ = io.load_locs(path, **query)
+            assert np.array_equal(loaded, locs[expected])
+        loaded, _ = io.load_locs(path, columns=["x"], frames=frames)
+        assert loaded.dtype.names == ("x",)
+        assert np.array_equal(loaded.x, locs.x[in_frames])
+
+
+def test_cut_spots_frame_list():
+    """Spots of movies given as lists of frames match those of arrays."""
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    movie = rng.poisson(20, (6, 32, 32)).astype(np.uint16)
+    movie[:, 14:17, 14:17] += 1000
+    ids = localize.identify(movie, 1000, 7, threaded=False)
+    camera_info = {"baseline": 0, "sensitivity": 1.0, "gain": 1, "qe": 1.0}
+    expected = localize.get_spots(movie, ids, 7, camera_info)
+    assert len(ids) > 0
+    spots = localize.get_spots(list(movie), ids, 7, camera_info)
+    assert np.array_equal(spots, expected)
+
+
+def test_net_gradient_fused():
+    """The fused net gradient stencil matches the reference net gradient."""
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    frame = rng.poisson(100, (64, 64)).astype(np.float32)
+    grid = np.arange(64)
+    for y0, x0 in [(20.3, 30.8), (40.6, 12.1), (44.0, 45.5)]:
+        gy = np.exp(-0.5 * (grid - y0) ** 2 / 1.3**2)
+        gx = np.exp(-0.5 * (grid - x0) ** 2 / 1.3**2)
+        frame += 5000 * np.outer(gy, gx).astype(np.float32)
+    for box in [3, 5, 7, 9, 11]:
+        r = box // 2 + 1
+        y, x = np.mgrid[r : 64 - r, r : 64 - r]
+        y, x = y.ravel().astype(np.int32), x.ravel().astype(np.int32)
+        uy, ux = localize._unit_vector_stencils(box)
+        expected = localize.net_gradient(frame, y, x, box, uy, ux)
+        weights = localize._net_gradient_weights(box)
+        ng = localize.net_gradient_fused(frame, y, x, box, weights)
+        # float32 sums in another order, and fastmath may reassociate them
+        atol = 1e-5 * np.abs(expected).max()
+        np.testing.assert_allclose(ng, expected, rtol=1e-4, atol=atol)
+
+
+def test_iter_spots_batches():
+    """Spot batches of any size concatenate to the spots of get_spots."""
+    import numpy as np
+    from picasso import localize
+
+    rng = np.random.default_rng(0)
+    movie = rng.poisson(120, (10, 40, 40)).astype(np.uint16)
+    movie[:, 8:11, 8:11] += 1000
+    movie[::2, 25:28, 30:33] += 1500
+    ids = localize.identify(movie, 1000, 7, threaded=False)
+    camera_info = {"baseline": 100, "sensitivity": 0.45, "gain": 2, "qe": 0.9}
+    raw = localize._cut_spots(movie, ids, 7)
+    # out-of-place conversion as before spots were converted in place
+    expected = (raw - 100) * 0.45 / (2 * 0.9)
+    spots = localize.get_spots(movie, ids, 7, camera_info)
+    assert spots.dtype == np.float32
+    np.testing.assert_allclose(spots, expected, rtol=1e-6)
+    photons = raw.copy()
+    assert localize._to_photons(photons, camera_info) is photons
+    assert len(ids) % 4 != 0
+    for movie_ in [movie, list(movie)]:
+        for batch_size in [1, 4, len(ids) - 1, len(ids), 2 * len(ids)]:
+            indices, batches = [], []
+            for index, batch in localize.iter_spots(
+                movie_, ids, 7, camera_info, batch_size=batch_size
+            ):
+                assert len(batch) <= batch_size
+                indices.append(index)
+                batches.append(batch.copy())
+            assert indices == list(np.cumsum([0] + [len(_) for _ in batches])[:-1])
+            assert np.array_equal(np.concatenate(batches), spots)
+
+
+def test_warmup(capsys):
+    """picasso warmup runs every kernel on its synthetic movies."""
+    main._warmup()
+    assert "done" in capsys.readouterr().out